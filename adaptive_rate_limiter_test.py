@@ -0,0 +1,82 @@
+import unittest
+from unittest.mock import patch
+from change_client.adaptive_rate_limiter import AdaptiveRateLimiter
+
+_MONOTONIC = "change_client.adaptive_rate_limiter.time.monotonic"
+_SLEEP = "change_client.adaptive_rate_limiter.time.sleep"
+
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+
+  def test_initial_rate_clamped(self):
+    self.assertEqual(AdaptiveRateLimiter("roles", 100, 0.5, 10).rate, 10)
+    self.assertEqual(AdaptiveRateLimiter("roles", 0.1, 0.5, 10).rate, 0.5)
+
+  def test_additive_increase_multiplicative_decrease(self):
+    with patch(_MONOTONIC, return_value=100), patch(_SLEEP):
+      limiter = AdaptiveRateLimiter("directory", 10, 0.5, 100)
+      # The first call is within the burst, the next 10 wait for the rate
+      for _ in range(11):
+        limiter.acquire()
+      for _ in range(11):
+        limiter.on_success()
+      self.assertAlmostEqual(limiter.rate, 11, delta=0.1)
+      limiter.on_rate_limited()
+    self.assertAlmostEqual(limiter.rate, 5.5, delta=0.1)
+    self.assertEqual(limiter.confirmed_rate, limiter.rate)
+    for _ in range(10):
+      limiter.on_rate_limited()
+    self.assertEqual(limiter.rate, 0.5)
+
+  def test_rate_not_increased_without_demand(self):
+    with patch(_MONOTONIC, side_effect=range(100, 120)), patch(_SLEEP):
+      limiter = AdaptiveRateLimiter("directory", 10, 0.5, 100)
+      # One call a second never waits for the rate
+      for _ in range(10):
+        self.assertEqual(limiter.reserve(), 0)
+        limiter.on_success()
+    self.assertEqual(limiter.rate, 10)
+    self.assertIsNone(limiter.confirmed_rate)
+
+  def test_acquire_paces_calls(self):
+    with patch(_MONOTONIC, return_value=100), patch(_SLEEP) as mock_sleep:
+      limiter = AdaptiveRateLimiter("roles", 2, 0.5, 10)
+      limiter.acquire()
+      limiter.acquire()
+      limiter.acquire()
+    self.assertEqual(
+        [c.args[0] for c in mock_sleep.call_args_list], [0.5, 1.0]
+    )
+
+  def test_acquire_burst_and_refill(self):
+    with patch(_MONOTONIC, return_value=100), patch(_SLEEP) as mock_sleep:
+      limiter = AdaptiveRateLimiter("directory", 10, 0.5, 100, burst=20)
+      limiter.acquire(20)
+      mock_sleep.assert_not_called()
+      limiter.acquire(5)
+      mock_sleep.assert_called_once_with(0.5)
+    with patch(_MONOTONIC, return_value=110), patch(_SLEEP) as mock_sleep:
+      # Refilled up to the burst only
+      limiter.acquire(20)
+      mock_sleep.assert_not_called()
+
+  def test_reserve_returns_wait_without_sleeping(self):
+    with patch(_MONOTONIC, return_value=100), patch(_SLEEP) as mock_sleep:
+      limiter = AdaptiveRateLimiter("roles", 2, 0.5, 10)
+      self.assertEqual(limiter.reserve(), 0)
+      self.assertEqual(limiter.reserve(), 0.5)
+      limiter.on_rate_limited(retry_after_seconds=3)
+      self.assertEqual(limiter.reserve(), 3)
+    mock_sleep.assert_not_called()
+
+  def test_retry_after_holds_calls(self):
+    with patch(_MONOTONIC, return_value=100), patch(_SLEEP) as mock_sleep:
+      limiter = AdaptiveRateLimiter("roles", 4, 0.5, 10, burst=4)
+      limiter.on_rate_limited(retry_after_seconds=3)
+      limiter.acquire()
+    mock_sleep.assert_called_once_with(3)
+    self.assertEqual(limiter.rate, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
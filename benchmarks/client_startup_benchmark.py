@@ -0,0 +1,117 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Startup benchmark of the discovery clients.
+
+Compares building the admin sdk, cloudidentity and people clients with
+discovery.build in every worker thread, with building only the clients of the
+services used ( the people client is only used by the precheck ) from the
+discovery documents loaded once. No request is issued.
+
+Run from the repository root :
+  python -m benchmarks.client_startup_benchmark
+"""
+
+from concurrent import futures
+import tempfile
+import time
+
+from absl import app
+from absl import flags
+from google.oauth2 import credentials
+import google_auth_httplib2
+from googleapiclient import discovery
+import httplib2
+import tabulate
+
+from change_client import discovery_documents
+from change_client import google_api_client
+
+_WORKERS = flags.DEFINE_integer(
+    'workers', 8, 'Worker threads, each building its own clients.'
+)
+_REPETITIONS = flags.DEFINE_integer(
+    'repetitions', 5, 'Runs of each strategy, the best one is reported.'
+)
+
+
+def _authorized_http():
+  return google_auth_httplib2.AuthorizedHttp(
+      credentials.Credentials(token='benchmark'), http=httplib2.Http()
+  )
+
+
+def _build_all(unused_documents):
+  return [
+      discovery.build(
+          api, version, http=_authorized_http(), cache_discovery=False
+      )
+      for api, version in google_api_client.DISCOVERY_SERVICES.values()
+  ]
+
+
+def _build_used(documents):
+  # The MODIFY workers only call the admin sdk
+  return [
+      discovery.build_from_document(
+          documents.get(*google_api_client.DISCOVERY_SERVICES['admin_sdk']),
+          http=_authorized_http(),
+      )
+  ]
+
+
+def _run(build_clients):
+  """Returns the seconds until the first client and until all workers' ones."""
+  with tempfile.TemporaryDirectory() as cache_dir:
+    documents = discovery_documents.DiscoveryDocuments(
+        cache_dir, httplib2.Http().request
+    )
+    start = time.perf_counter()
+    build_clients(documents)
+    first_seconds = time.perf_counter() - start
+    with futures.ThreadPoolExecutor(max_workers=_WORKERS.value) as executor:
+      list(
+          executor.map(
+              lambda _: build_clients(documents), range(_WORKERS.value - 1)
+          )
+      )
+    return first_seconds, time.perf_counter() - start
+
+
+def main(unused_argv):
+  rows = []
+  for name, build_clients in (
+      ('discovery.build per thread', _build_all),
+      ('loaded documents , lazy', _build_used),
+  ):
+    runs = [_run(build_clients) for _ in range(_REPETITIONS.value)]
+    rows.append([
+        name,
+        1000 * min(first_seconds for first_seconds, _ in runs),
+        1000 * min(all_seconds for _, all_seconds in runs),
+    ])
+  print('Clients built for {} worker threads'.format(_WORKERS.value))
+  print(
+      tabulate.tabulate(
+          rows,
+          headers=['Strategy', 'First client ms', 'All workers ms'],
+          floatfmt='.1f',
+      )
+  )
+
+
+if __name__ == '__main__':
+  app.run(main)
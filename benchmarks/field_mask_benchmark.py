@@ -0,0 +1,177 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Payload benchmark of the partial responses ( fields= ) of the reads.
+
+Issues each read once with and once without its field mask against the
+customer of the given credentials, and reports the response bytes saved per
+call type. Only reads are issued.
+
+Run from the repository root :
+  python -m benchmarks.field_mask_benchmark
+  --oa_client_id_creds=/path/to/oa-client-id-creds.json
+  --output_path=/path/to/output/dir [--group_key=group@example.com]
+"""
+
+from typing import Any, Callable, Optional
+
+from absl import app
+from absl import flags
+import tabulate
+
+from change_client import google_api_client
+from utils import logger
+
+_OAUTH_CLIENT_ID_CREDS = flags.DEFINE_string(
+    'oa_client_id_creds', None, 'Path to the Oauth client id credentials.'
+)
+_OUTPUT_PATH = flags.DEFINE_string(
+    'output_path', None, 'Directory of the token and the logs.'
+)
+_GROUP_KEY = flags.DEFINE_string(
+    'group_key', None, 'Group whose groups.get and members.list are measured.'
+)
+flags.mark_flags_as_required(['oa_client_id_creds', 'output_path'])
+
+
+def _response_bytes(build_request: Callable[[Optional[str]], Any], fields):
+  """Returns the size of the raw response body of the request."""
+  request = build_request(fields)
+  # Skip the JSON parsing, execute returns the raw body
+  request.postproc = lambda unused_resp, content: content
+  return len(request.execute())
+
+
+def main(unused_argv):
+  logger.Logger.initialize(_OUTPUT_PATH.value, False)
+  client = google_api_client.GoogleApiClient(
+      _OUTPUT_PATH.value, _OAUTH_CLIENT_ID_CREDS.value, False, True
+  )
+  admin = client.get_admin_sdk_client()
+  customer_id = client.get_customer()['id']
+  root_ou_id = client.get_root_ou(customer_id)
+  primary_email = client.get_primary_email()
+  role_id = client.list_roles()[0]['roleId']
+  list_fields = google_api_client.list_fields
+  page_size = google_api_client.DEFAULT_PAGE_SIZE
+
+  # Call type -> ( builder of the request for a fields mask , the mask )
+  call_types = {
+      'customers.get': (
+          lambda fields: admin.customers().get(
+              customerKey='my_customer', fields=fields
+          ),
+          google_api_client.CUSTOMER_FIELDS,
+      ),
+      'orgunits.list': (
+          lambda fields: admin.orgunits().list(
+              customerId=customer_id, fields=fields
+          ),
+          google_api_client.ROOT_ORG_UNIT_FIELDS,
+      ),
+      'orgunits.get': (
+          lambda fields: admin.orgunits().get(
+              customerId='my_customer',
+              orgUnitPath='id:' + root_ou_id,
+              fields=fields,
+          ),
+          google_api_client.ORG_UNIT_FIELDS,
+      ),
+      'people.get': (
+          lambda fields: client.get_people_client()
+          .people()
+          .get(
+              resourceName='people/me',
+              personFields='emailAddresses',
+              fields=fields,
+          ),
+          google_api_client.PERSON_FIELDS,
+      ),
+      'users.get': (
+          lambda fields: admin.users().get(
+              userKey=primary_email, fields=fields
+          ),
+          google_api_client.USER_FIELDS,
+      ),
+      'users.list ( page )': (
+          lambda fields: admin.users().list(
+              customer='my_customer',
+              maxResults=google_api_client.USERS_PAGE_SIZE,
+              fields=fields,
+          ),
+          list_fields('users', google_api_client.USER_FIELDS),
+      ),
+      'roles.get': (
+          lambda fields: admin.roles().get(
+              customer='my_customer', roleId=role_id, fields=fields
+          ),
+          google_api_client.ROLE_FIELDS,
+      ),
+      'roles.list ( page )': (
+          lambda fields: admin.roles().list(
+              customer='my_customer', maxResults=page_size, fields=fields
+          ),
+          list_fields('items', google_api_client.ROLE_FIELDS),
+      ),
+      'roleAssignments.list ( page )': (
+          lambda fields: admin.roleAssignments().list(
+              customer='my_customer', maxResults=page_size, fields=fields
+          ),
+          list_fields('items', google_api_client.ROLE_ASSIGNMENT_FIELDS),
+      ),
+  }
+  if _GROUP_KEY.value:
+    call_types['groups.get'] = (
+        lambda fields: admin.groups().get(
+            groupKey=_GROUP_KEY.value, fields=fields
+        ),
+        google_api_client.GROUP_FIELDS,
+    )
+    call_types['members.list ( page )'] = (
+        lambda fields: admin.members().list(
+            groupKey=_GROUP_KEY.value, maxResults=page_size, fields=fields
+        ),
+        list_fields('members', google_api_client.MEMBER_FIELDS),
+    )
+
+  table = []
+  for call_type, (build_request, fields) in call_types.items():
+    full_bytes = _response_bytes(build_request, None)
+    masked_bytes = _response_bytes(build_request, fields)
+    saved_bytes = full_bytes - masked_bytes
+    table.append([
+        call_type,
+        full_bytes,
+        masked_bytes,
+        saved_bytes,
+        '{:.0f}%'.format(100 * saved_bytes / max(full_bytes, 1)),
+    ])
+  print(
+      tabulate.tabulate(
+          table,
+          headers=[
+              'Call',
+              'Full bytes',
+              'Masked bytes',
+              'Saved bytes',
+              'Saved',
+          ],
+      )
+  )
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Contention benchmark of the third_party RateLimiter.
+
+Compares the reservation based RateLimiter with the previous implementation,
+which slept while holding its lock and stamped calls when they returned, when
+many threads share one limiter and each call takes a while ( like an API call ).
+
+Run from the repository root :
+  python -m benchmarks.ratelimiter_contention_benchmark
+"""
+
+import collections
+from concurrent import futures
+import threading
+import time
+
+from absl import app
+from absl import flags
+import tabulate
+
+from third_party.ratelimiter import _sync
+
+_THREADS = flags.DEFINE_integer('threads', 16, 'Threads sharing the limiter.')
+_CALLS = flags.DEFINE_integer('calls', 400, 'Total number of calls.')
+_MAX_CALLS = flags.DEFINE_integer('max_calls', 100, 'Calls allowed per period.')
+_PERIOD = flags.DEFINE_float('period', 1.0, 'Period in seconds.')
+_CALL_SECONDS = flags.DEFINE_float(
+    'call_seconds', 0.05, 'Duration of each call, e.g an API round trip.'
+)
+
+
+class LegacyRateLimiter(object):
+  """The RateLimiter before reservations, kept for comparison."""
+
+  def __init__(self, max_calls, period=1.0):
+    self.calls = collections.deque()
+    self.period = period
+    self.max_calls = max_calls
+    self._lock = threading.Lock()
+
+  def __enter__(self):
+    with self._lock:
+      if len(self.calls) >= self.max_calls:
+        until = time.time() + self.period - self._timespan
+        sleeptime = until - time.time()
+        if sleeptime > 0:
+          time.sleep(sleeptime)
+      return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    with self._lock:
+      self.calls.append(time.time())
+      while self._timespan >= self.period:
+        self.calls.popleft()
+
+  @property
+  def _timespan(self):
+    return self.calls[-1] - self.calls[0]
+
+
+def _max_calls_in_window(start_times, period):
+  """Returns the most calls started within any window of period seconds."""
+  start_times = sorted(start_times)
+  most, first = 0, 0
+  for last, start_time in enumerate(start_times):
+    while start_time - start_times[first] >= period:
+      first += 1
+    most = max(most, last - first + 1)
+  return most
+
+
+def _run(limiter):
+  start_times = []
+
+  def call():
+    with limiter:
+      start_times.append(time.monotonic())
+      time.sleep(_CALL_SECONDS.value)
+
+  start = time.monotonic()
+  with futures.ThreadPoolExecutor(max_workers=_THREADS.value) as executor:
+    for pending in [executor.submit(call) for _ in range(_CALLS.value)]:
+      pending.result()
+  elapsed = time.monotonic() - start
+  return [
+      elapsed,
+      _CALLS.value / elapsed,
+      _max_calls_in_window(start_times, _PERIOD.value),
+  ]
+
+
+def main(unused_argv):
+  rows = [
+      ['legacy'] + _run(LegacyRateLimiter(_MAX_CALLS.value, _PERIOD.value)),
+      ['reservation']
+      + _run(_sync.RateLimiter(_MAX_CALLS.value, _PERIOD.value)),
+  ]
+  print(
+      '{} calls of {}s on {} threads, limited to {} calls per {}s'.format(
+          _CALLS.value,
+          _CALL_SECONDS.value,
+          _THREADS.value,
+          _MAX_CALLS.value,
+          _PERIOD.value,
+      )
+  )
+  print(
+      tabulate.tabulate(
+          rows,
+          headers=['Limiter', 'Seconds', 'Calls/second', 'Max calls/period'],
+          floatfmt='.2f',
+      )
+  )
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""CPU benchmark of the selection of the role-scopes of a scope.
+
+Compares the role_scope_planner with the previous selection loop, which
+summed the role-assignments of all the role-scopes selected so far at every
+role-scope, on synthetic role-assignments of a single scope. The role
+eligibility is resolved beforehand for both, no API call is issued.
+
+Run from the repository root :
+  python -m benchmarks.role_scope_planner_benchmark
+"""
+
+import collections
+import random
+import time
+
+from absl import app
+from absl import flags
+import tabulate
+
+import role_scope_planner
+
+_ROLE_ASSIGNMENTS = flags.DEFINE_integer(
+    'role_assignments', 1000000, 'Role-assignments of the scope.'
+)
+_ROLE_SCOPES = flags.DEFINE_list(
+    'role_scopes',
+    ['100', '1000', '10000'],
+    'Role-scope counts of the scope to benchmark.',
+)
+_RA_LIMIT = flags.DEFINE_integer(
+    'ra_limit', 5000, 'Role-assignments limit per scope.'
+)
+_REPETITIONS = flags.DEFINE_integer(
+    'repetitions', 3, 'Runs of each selection, the best one is reported.'
+)
+
+RoleScope = collections.namedtuple(
+    'RoleScope', ['roleId', 'scopeType', 'orgUnit']
+)
+
+
+def _role_scope_to_ras_map(role_scopes, role_assignments):
+  """Returns role-assignments spread unevenly over the role-scopes."""
+  rng = random.Random(0)
+  keys = [RoleScope(str(i), 'CUSTOMER', '') for i in range(role_scopes)]
+  weights = [1 / (i + 1) for i in range(role_scopes)]
+  role_scope_to_ras_map = {key: [] for key in keys}
+  for key in rng.choices(keys, weights, k=role_assignments):
+    role_scope_to_ras_map[key].append({'roleId': key.roleId})
+  return role_scope_to_ras_map
+
+
+def _legacy_select(role_scope_to_ras_map, ra_count, eligible_role_ids):
+  """The selection loop before the planner, kept for comparison."""
+  ordered_ra_scope_to_ra_map = collections.OrderedDict(
+      sorted(
+          role_scope_to_ras_map.items(), key=lambda x: len(x[1]), reverse=True
+      )
+  )
+  filtered_role_scope_to_ra_map = {}
+  for key, value in ordered_ra_scope_to_ra_map.items():
+    reduced_ra_count_for_scope = sum(
+        len(values) for values in filtered_role_scope_to_ra_map.values()
+    ) - len(filtered_role_scope_to_ra_map)
+    remaining_ra_count_for_scope = ra_count - reduced_ra_count_for_scope
+    if remaining_ra_count_for_scope < _RA_LIMIT.value:
+      continue
+    if key.roleId not in eligible_role_ids:
+      continue
+    filtered_role_scope_to_ra_map[key] = value
+  return filtered_role_scope_to_ra_map
+
+
+def _planner_select(role_scope_to_ras_map, ra_count, eligible_role_ids):
+  plan = role_scope_planner.plan_role_scopes(
+      {key: len(value) for key, value in role_scope_to_ras_map.items()},
+      ra_count,
+      _RA_LIMIT.value,
+      eligible_role_ids,
+      [],
+      [],
+  )
+  return {key: role_scope_to_ras_map[key] for key in plan.selected}
+
+
+def _timed(select, *args):
+  """Returns the selection and the seconds of its best run."""
+  best_seconds = float('inf')
+  for _ in range(_REPETITIONS.value):
+    start = time.perf_counter()
+    selection = select(*args)
+    seconds = time.perf_counter() - start
+    best_seconds = min(best_seconds, seconds)
+  return selection, best_seconds
+
+
+def main(unused_argv):
+  rows = []
+  for role_scopes in (int(count) for count in _ROLE_SCOPES.value):
+    role_scope_to_ras_map = _role_scope_to_ras_map(
+        role_scopes, _ROLE_ASSIGNMENTS.value
+    )
+    eligible_role_ids = {key.roleId for key in role_scope_to_ras_map}
+    args = (role_scope_to_ras_map, _ROLE_ASSIGNMENTS.value, eligible_role_ids)
+    legacy_selection, legacy_seconds = _timed(_legacy_select, *args)
+    planner_selection, planner_seconds = _timed(_planner_select, *args)
+    if list(legacy_selection) != list(planner_selection):
+      raise AssertionError('The selections differ')
+    rows.append([
+        role_scopes,
+        len(planner_selection),
+        1000 * legacy_seconds,
+        1000 * planner_seconds,
+    ])
+  print(
+      'Selection among {} role-assignments , limit {}'.format(
+          _ROLE_ASSIGNMENTS.value, _RA_LIMIT.value
+      )
+  )
+  print(
+      tabulate.tabulate(
+          rows,
+          headers=['Role-scopes', 'Selected', 'Legacy ms', 'Planner ms'],
+          floatfmt='.1f',
+      )
+  )
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Token bucket rate limiter which adapts its rate to the quota errors.
+
+The rate is increased additively while calls which had to wait for it succeed
+and decreased multiplicatively ( AIMD ) when the API responds with a quota
+error, so that the limiter converges on the quota actually available to the
+customer. Without demand beyond the rate there's nothing to probe, and the
+rate is left as is.
+"""
+
+import threading
+import time
+from typing import Optional
+
+# Increase of the rate, in calls/second, per second worth of successful calls
+ADDITIVE_INCREASE = 1.0
+MULTIPLICATIVE_DECREASE = 0.5
+
+
+class AdaptiveRateLimiter:
+  """AIMD token bucket refilled at rate tokens/second up to burst tokens.
+
+  Callers reserve their tokens under the lock, possibly running the bucket
+  into debt, and sleep until the debt is repaid outside of the lock. A burst
+  of 1 paces calls to evenly spaced slots.
+  """
+
+  def __init__(
+      self,
+      name: str,
+      rate: float,
+      min_rate: float,
+      max_rate: float,
+      burst: float = 1,
+  ) -> None:
+    self.name = name
+    self.min_rate = min_rate
+    self.max_rate = max_rate
+    self.rate = min(max(rate, min_rate), max_rate)
+    self.burst = burst
+    self._tokens = burst
+    self._updated_at = time.monotonic()
+    self._hold_until = self._updated_at
+    # Calls which waited for the rate, whose success may increase it
+    self._throttled_calls = 0
+    # Rate set by the last quota error, None until one was received
+    self.confirmed_rate = None
+    self._lock = threading.Lock()
+
+  def _refill(self, now: float) -> None:
+    self._tokens = min(
+        self.burst, self._tokens + (now - self._updated_at) * self.rate
+    )
+    self._updated_at = now
+
+  def reserve(self, calls: int = 1) -> float:
+    """Reserves the given number of calls, without blocking.
+
+    Returns:
+      The number of seconds to wait before making the calls, e.g awaited by
+      coroutines rather than slept.
+    """
+    with self._lock:
+      now = time.monotonic()
+      self._refill(now)
+      self._tokens -= calls
+      if self._tokens < 0:
+        self._throttled_calls += min(calls, -self._tokens)
+      return max(-self._tokens / self.rate, self._hold_until - now, 0)
+
+  def acquire(self, calls: int = 1) -> None:
+    """Blocks until the given number of calls may be made."""
+    delay = self.reserve(calls)
+    if delay > 0:
+      time.sleep(delay)
+
+  def on_success(self, calls: int = 1) -> None:
+    """Increases the rate for the given calls which waited for it."""
+    with self._lock:
+      throttled_calls = min(calls, self._throttled_calls)
+      self._throttled_calls -= throttled_calls
+      self.rate = min(
+          self.max_rate,
+          self.rate + throttled_calls * ADDITIVE_INCREASE / self.rate,
+      )
+
+  def on_rate_limited(
+      self, retry_after_seconds: Optional[float] = None
+  ) -> None:
+    """Lowers the rate, and holds calls for retry_after_seconds if given."""
+    with self._lock:
+      now = time.monotonic()
+      self._refill(now)
+      self.rate = max(self.min_rate, self.rate * MULTIPLICATIVE_DECREASE)
+      self.confirmed_rate = self.rate
+      self._throttled_calls = 0
+      # The quota is exhausted, drop the saved up burst
+      self._tokens = min(self._tokens, 0)
+      if retry_after_seconds is not None:
+        self._hold_until = max(self._hold_until, now + retry_after_seconds)
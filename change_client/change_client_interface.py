@@ -25,6 +25,28 @@ import abc
 from typing import Any, Dict, Optional, Sequence, Mapping
 
 
+class BulkOperationError(RuntimeError):
+  """Some calls of a bulk operation failed, once all of its calls were made.
+
+  Attributes:
+    results: Outcome of each call which completed, by key.
+    failures: Error of each call which failed, by key.
+  """
+
+  def __init__(
+      self, results: Mapping[str, Any], failures: Mapping[str, Exception]
+  ):
+    super().__init__(
+        'Non-retryable error. {} of {} calls failed. {}'.format(
+            len(failures),
+            len(results) + len(failures),
+            next(iter(failures.values())),
+        )
+    )
+    self.results = results
+    self.failures = failures
+
+
 class ChangeClientInterface(abc.ABC):
 
   """Change-client abstract class."""
@@ -36,7 +58,17 @@ class ChangeClientInterface(abc.ABC):
   @abc.abstractmethod
   def get_user(self, user_email: str) -> Optional[Mapping[str, Any]]:
     """Returns the user information for the given user email."""
-    
+
+  @abc.abstractmethod
+  def get_users(
+      self, user_keys: Sequence[str]
+  ) -> Mapping[str, Optional[Mapping[str, Any]]]:
+    """Returns the user information for each of the given user keys."""
+
+  @abc.abstractmethod
+  def list_users(self) -> Sequence[Mapping[str, Any]]:
+    """Returns a list of all users of the customer."""
+
   @abc.abstractmethod
   def get_ou(self, user_email: str) -> Optional[Mapping[str, Any]]:
     """Returns the organizational-unit information for the given ou id."""
@@ -59,6 +91,17 @@ class ChangeClientInterface(abc.ABC):
   ) -> None:
     """Inserts the given user into the given group."""
 
+  @abc.abstractmethod
+  def insert_members_into_group(
+      self, group_email: str, members: Sequence[Mapping[str, str]]
+  ) -> Mapping[str, bool]:
+    """Inserts the given members ( email , id ) into the given group.
+
+    Returns whether each member email was inserted , False if it already was a
+    member. Raises BulkOperationError once all insertions were attempted if
+    any failed.
+    """
+
   @abc.abstractmethod
   def create_group(
       self,
@@ -84,8 +127,20 @@ class ChangeClientInterface(abc.ABC):
     """Deletes the given role assignment."""
 
   @abc.abstractmethod
-  def insert_role_assignment(self, role_assignment: Dict[str, Any]) -> None:
-    """Inserts a new role assignment."""
+  def delete_role_assignments(
+      self, role_assignment_ids: Sequence[str]
+  ) -> Mapping[str, bool]:
+    """Deletes the given role assignments.
+
+    Returns whether each role assignment was deleted. Raises
+    BulkOperationError once all deletions were attempted if any failed.
+    """
+
+  @abc.abstractmethod
+  def insert_role_assignment(
+      self, role_assignment: Dict[str, Any]
+  ) -> Optional[Mapping[str, Any]]:
+    """Inserts a new role assignment, returns the inserted role assignment."""
 
   @abc.abstractmethod
   def get_role(self, role_id: str) -> Optional[Mapping[str, Any]]:
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pool of discovery clients, checked out by the threads using them.
+
+Discovery service objects and their authorized http aren't thread-safe, so a
+thread checks out its own client of each service on first use and keeps it
+while it runs. The clients of a thread are checked back in when it exits, for
+the next threads to reuse, since pipelined listings and per-role listings run
+on short-lived threads. The clients authorize their requests with the current
+credential, so that they outlive credential refreshes.
+"""
+
+import collections
+import threading
+from typing import Any, Callable, Dict
+import weakref
+
+
+class _Checkout:
+  """Clients checked out by a thread, checked in once the thread exits."""
+
+  def __init__(self):
+    self.clients: Dict[str, Any] = {}
+
+
+class ClientPool:
+  """Discovery clients checked out per thread, built when none is idle."""
+
+  def __init__(self, build_client: Callable[[str], Any]):
+    self._build_client = build_client
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    # Clients checked in by the exited threads, per service
+    self._idle = collections.defaultdict(list)
+    self.clients_built = 0
+    self.clients_reused = 0
+
+  def _checkin(self, clients: Dict[str, Any]) -> None:
+    with self._lock:
+      for service, client in clients.items():
+        self._idle[service].append(client)
+
+  def _checkout(self, service: str) -> Any:
+    with self._lock:
+      if self._idle[service]:
+        self.clients_reused += 1
+        return self._idle[service].pop()
+    client = self._build_client(service)
+    with self._lock:
+      self.clients_built += 1
+    return client
+
+  def get(self, service: str) -> Any:
+    """Returns the client of the service checked out by the calling thread."""
+    checkout = getattr(self._local, 'checkout', None)
+    if checkout is None:
+      checkout = self._local.checkout = _Checkout()
+      # The thread-local checkout is released when the thread exits
+      weakref.finalize(checkout, self._checkin, checkout.clients)
+    if service not in checkout.clients:
+      checkout.clients[service] = self._checkout(service)
+    return checkout.clients[service]
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Discovery documents of the APIs, loaded and checked once per process.
+
+A document is read from the discovery documents bundled with
+google-api-python-client or from the on-disk cache under the output path,
+whichever holds the latest revision for the API version. It is only fetched
+over http when neither holds a valid document, and then saved to the on-disk
+cache for later runs.
+
+Each client is built from its own parse of the document, since the library
+completes the method parameters of the parsed document as methods are used.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Callable, Mapping, Optional, Tuple
+from googleapiclient import discovery
+from googleapiclient import discovery_cache
+import httplib2
+from utils import logger
+
+DISCOVERY_CACHE_DIR_NAME = 'discovery_cache'
+
+
+def _parse_document(
+    content: Optional[str], api: str, version: str
+) -> Optional[Mapping[str, Any]]:
+  """Returns the parsed document if it is the one of the API version."""
+  if not content:
+    return None
+  try:
+    document = json.loads(content)
+  except ValueError:
+    return None
+  if (
+      not isinstance(document, dict)
+      or document.get('name') != api
+      or document.get('version') != version
+      or 'revision' not in document
+  ):
+    return None
+  return document
+
+
+class DiscoveryDocuments:
+  """Discovery documents, shared by the clients of all threads."""
+
+  def __init__(
+      self,
+      cache_dir: str,
+      fetch: Callable[[str], Tuple[httplib2.Response, bytes]],
+  ):
+    self._cache_dir = cache_dir
+    self._fetch = fetch
+    self._documents = {}
+    self._lock = threading.Lock()
+
+  def get(self, api: str, version: str) -> str:
+    """Returns the discovery document of the API version."""
+    with self._lock:
+      if (api, version) not in self._documents:
+        self._documents[(api, version)] = self._load(api, version)
+      return self._documents[(api, version)]
+
+  def _cache_path(self, api: str, version: str) -> str:
+    return os.path.join(self._cache_dir, '{}.{}.json'.format(api, version))
+
+  def _load(self, api: str, version: str) -> str:
+    cache_path = self._cache_path(api, version)
+    cached_content = None
+    if os.path.exists(cache_path):
+      with open(cache_path, 'r') as f:
+        cached_content = f.read()
+    # ( revision , content ) of the valid documents
+    documents = []
+    bundled_content = discovery_cache.get_static_doc(api, version)
+    for content in (bundled_content, cached_content):
+      document = _parse_document(content, api, version)
+      if document is not None:
+        documents.append((document['revision'], content))
+    if documents:
+      return max(documents)[1]
+    return self._fetch_and_cache(api, version)
+
+  def _fetch_and_cache(self, api: str, version: str) -> str:
+    """Fetches the document over http, then saves it to the on-disk cache."""
+    for uri in (discovery.DISCOVERY_URI, discovery.V2_DISCOVERY_URI):
+      uri = uri.format(api=api, apiVersion=version)
+      logger.Logger.get_instance().debug(
+          'Fetching discovery document {}'.format(uri)
+      )
+      response, content = self._fetch(uri)
+      if response.status != 200:
+        continue
+      content = content.decode('utf-8')
+      document = _parse_document(content, api, version)
+      if document is None:
+        continue
+      os.makedirs(self._cache_dir, exist_ok=True)
+      with open(self._cache_path(api, version), 'w') as f:
+        f.write(content)
+      return content
+    raise RuntimeError(
+        'No discovery document found for {} {}'.format(api, version)
+    )
@@ -32,6 +32,14 @@ class DryRunChangeClient(change_client_interface.ChangeClientInterface):
 
   def get_user(self, user_email: str) -> Optional[Mapping[str, Any]]:
     raise ValueError('Unexpected dry-run client check for get_user')
+
+  def get_users(
+      self, user_keys: Sequence[str]
+  ) -> Mapping[str, Optional[Mapping[str, Any]]]:
+    raise ValueError('Unexpected dry-run client check for get_users')
+
+  def list_users(self) -> Sequence[Mapping[str, Any]]:
+    raise ValueError('Unexpected dry-run client check for list_users')
   
   def get_ou(self, ou_id: str) -> Optional[Mapping[str, Any]]:
     raise ValueError('Unexpected dry-run client check for get_ou')
@@ -65,10 +73,28 @@ class DryRunChangeClient(change_client_interface.ChangeClientInterface):
   def insert_member_into_group(
       self, user_email: str, user_id: str, group_email: str
   ) -> None:
+    if self.group_has_member(group_email, user_email):
+      return
     self._group_to_members[group_email].append(
         {'email': user_email, 'id': user_id}
     )
 
+  def insert_members_into_group(
+      self, group_email: str, members: Sequence[Mapping[str, str]]
+  ) -> Mapping[str, bool]:
+    member_emails = {
+        member['email'] for member in self._group_to_members[group_email]
+    }
+    results = {}
+    for member in members:
+      results[member['email']] = member['email'] not in member_emails
+      if results[member['email']]:
+        member_emails.add(member['email'])
+        self._group_to_members[group_email].append(
+            {'email': member['email'], 'id': member['id']}
+        )
+    return results
+
   def group_has_member(self, group_email: str, user_email: str) -> bool:
     for member in self._group_to_members[group_email]:
       if member['email'] == user_email:
@@ -78,8 +104,11 @@ class DryRunChangeClient(change_client_interface.ChangeClientInterface):
   def get_group_members(self, group_email: str) -> Sequence[Mapping[str, Any]]:
     return self._group_to_members[group_email]
 
-  def insert_role_assignment(self, role_assignment: Mapping[str, Any]) -> None:
+  def insert_role_assignment(
+      self, role_assignment: Mapping[str, Any]
+  ) -> Optional[Mapping[str, Any]]:
     self._inserted_ras.append(role_assignment)
+    return role_assignment
 
   def delete_role_assignment(self, role_assignment_id: str) -> bool:
     self._inserted_ras = [
@@ -90,6 +119,20 @@ class DryRunChangeClient(change_client_interface.ChangeClientInterface):
     self._deleted_ras.append(role_assignment_id)
     return True
 
+  def delete_role_assignments(
+      self, role_assignment_ids: Sequence[str]
+  ) -> Mapping[str, bool]:
+    ids_to_delete = set(role_assignment_ids)
+    self._inserted_ras = [
+        item
+        for item in self._inserted_ras
+        if item['roleAssignmentId'] not in ids_to_delete
+    ]
+    self._deleted_ras.extend(role_assignment_ids)
+    return {
+        role_assignment_id: True for role_assignment_id in role_assignment_ids
+    }
+
   def list_role_assignments(
       self, role_id: Optional[str] = None, user_id: Optional[str] = None
   ) -> Sequence[Mapping[str, Any]]:
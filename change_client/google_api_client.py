@@ -15,108 +15,727 @@
 # limitations under the License.
 
 """Client to call CIG / Google-admin-sdk APIs."""
-import random
+from concurrent import futures
+import functools
+import json
+import os.path
+import queue
 import re
+import threading
 import time
-from typing import Any, Callable, Mapping, Sequence, Optional, TypeVar
+from typing import Any, Callable, Dict, Iterator, Mapping, Optional, Sequence
+from typing import Tuple
+from typing import TypeVar
+from google.auth import credentials as google_credentials
+import google_auth_httplib2
 from googleapiclient import discovery
 from googleapiclient import errors
-from third_party import ratelimiter
 from change_client import change_client_interface
+from change_client import client_pool
+from change_client import discovery_documents
+from change_client import http_transport
+from change_client import quota_registry
+from change_client import retry_policy
+from change_client import token_refresher
 from utils import credential_store
 from utils import logger
 
 
-REQUESTS_PER_SECOND_DEFAULT = 10
-REQUESTS_PER_SECOND_ROLES = 1
-MAX_RETRIES = 5
-BASE_DELAY_SECONDS = 1
-MAX_DELAY_SECONDS = 32
+# The learned rate per quota bucket is persisted under the output path for the
+# next run.
+LEARNED_RATES_FILE_NAME = 'learned-rates.json'
+# Client -> ( API , version ) of its discovery document
+DISCOVERY_SERVICES = {
+    'admin_sdk': ('admin', 'directory_v1'),
+    'identity': ('cloudidentity', 'v1'),
+    'people': ('people', 'v1'),
+}
 DEFAULT_PAGE_SIZE = 100
+USERS_PAGE_SIZE = 500
 TEST_PAGE_SIZE = 10
+# Number of fetched pages buffered ahead of the consumer by pipelined listings,
+# the next page is requested while the consumer processes the current one.
+PAGE_PREFETCH_DEPTH = 2
+# Partial responses ( fields= ) of the reads, requesting only the attributes
+# consumed by the utility.
+CUSTOMER_FIELDS = 'id,customerDomain'
+ORG_UNIT_FIELDS = 'orgUnitId,orgUnitPath'
+ROOT_ORG_UNIT_FIELDS = 'organizationUnits(orgUnitId,parentOrgUnitId)'
+PERSON_FIELDS = 'emailAddresses(value,metadata/primary)'
+USER_FIELDS = 'id,primaryEmail'
+GROUP_FIELDS = 'id,email,name'
+MEMBER_FIELDS = 'id,email'
+ROLE_FIELDS = (
+    'roleId,roleName,isSuperAdminRole,rolePrivileges(privilegeName,serviceId)'
+)
+ROLE_ASSIGNMENT_FIELDS = (
+    'roleAssignmentId,roleId,assignedTo,assigneeType,scopeType,orgUnitId'
+)
+
+
+def list_fields(items_key: str, item_fields: str) -> str:
+  """Returns the partial response of a listing page of the given items."""
+  return 'nextPageToken,{}({})'.format(items_key, item_fields)
+
+
+# Number of calls packed into a single batch http request, each call still
+# counts against the API quota individually.
+BATCH_SIZE = 50
+# Maximum number of in-flight calls per endpoint family, shared by all the
+# threads using the client.
+MAX_CONCURRENT_CALLS = {
+    'groups': 4,
+    'members': 8,
+    'roleAssignments': 4,
+}
+_ENDPOINT_SEMAPHORES = {
+    endpoint: threading.BoundedSemaphore(max_calls)
+    for endpoint, max_calls in MAX_CONCURRENT_CALLS.items()
+}
 
 # TODO(b/298438250) : unit tests for this file
 T = TypeVar('T')  # TypeVar for the return type of the inner function
+# Per-item outcome of a batched call : (response, error)
+BatchResult = Tuple[Optional[Any], Optional[errors.HttpError]]
+
+
+def _is_unchanged_delete_role_assignment_error(e: errors.HttpError) -> bool:
+  """Returns whether a roleAssignments.delete error leaves nothing to delete."""
+  error_code = e.resp.status
+  if error_code == 404:
+    return True
+  # The asserted user -i.e. admin cannot perform actions on itself
+  if error_code == 403 and re.search(r'AdminSelfRevokeNotAllowed', str(e)):
+    logger.Logger.get_instance().debug(
+        ' ....AdminSelfRevokeNotAllowed! {}'.format(str(e))
+    )
+    return True
+  return False
+
+
+def _on_rate_limited(bucket, e: errors.HttpError) -> None:
+  bucket.on_rate_limited(retry_policy.get_retry_after_seconds(e))
+  logger.Logger.get_instance().debug(
+      'Rate limited on {} , lowered rate to {:.1f} calls/second'.format(
+          bucket.name, bucket.rate
+      )
+  )
+
+
+_END_OF_ITEMS = object()
+
+
+def _prefetched(items: Iterator[T], depth: int) -> Iterator[T]:
+  """Yields the items of the iterator, advanced by a background thread.
+
+  Up to depth items are buffered ahead of the consumer, the background thread
+  blocks once the buffer is full. Errors raised by the iterator are re-raised
+  to the consumer, and the background thread stops when the consumer does.
+
+  Args:
+    items: The iterator, e.g. fetching a page per item.
+    depth: Maximum number of items buffered ahead of the consumer.
+
+  Yields:
+    The items of the iterator, in order.
+  """
+  buffer = queue.Queue(maxsize=depth)
+  stopped = threading.Event()
+
+  def put(entry):
+    while not stopped.is_set():
+      try:
+        buffer.put(entry, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def produce():
+    try:
+      for item in items:
+        if not put((item, None)):
+          return
+    except Exception as e:  # pylint: disable=broad-except
+      put((_END_OF_ITEMS, e))
+    else:
+      put((_END_OF_ITEMS, None))
+
+  threading.Thread(target=produce, daemon=True).start()
+  try:
+    while True:
+      item, error = buffer.get()
+      if item is _END_OF_ITEMS:
+        if error is not None:
+          raise error
+        return
+      yield item
+  finally:
+    stopped.set()
+
+
+def _call_rate_limited(client, endpoint: str, func: Callable[[], T]) -> T:
+  """Draws the call from the quota bucket of the endpoint, adapting its rate."""
+  bucket = client.quota_registry.bucket(endpoint)
+  if not client.is_test_env:
+    bucket.acquire()
+  try:
+    result = func()
+  except errors.HttpError as e:
+    if retry_policy.is_rate_limit_error(e):
+      _on_rate_limited(bucket, e)
+    raise
+  bucket.on_success()
+  return result
+
+
+def rate_limited(
+    endpoint: str,
+) -> Callable[[Callable[..., T]], Callable[..., T]]:
+  """Draws each call from the quota bucket of the endpoint."""
+
+  def decorator(func: Callable[..., T]) -> Callable[..., T]:
+    @functools.wraps(func)
+    def limited_func(self, *args: Any, **kwargs: Any) -> T:
+      return _call_rate_limited(
+          self, endpoint, lambda: func(self, *args, **kwargs)
+      )
+
+    # Retries are accounted to the endpoint
+    limited_func.endpoint = endpoint
+    return limited_func
+
+  return decorator
+
+
+def limit_concurrency(
+    endpoint: str,
+) -> Callable[[Callable[..., T]], Callable[..., T]]:
+  """Caps concurrent calls to an endpoint family ( MAX_CONCURRENT_CALLS )."""
+
+  def decorator(func: Callable[..., T]) -> Callable[..., T]:
+    @functools.wraps(func)
+    def limited_func(*args: Any, **kwargs: Any) -> T:
+      with _ENDPOINT_SEMAPHORES[endpoint]:
+        return func(*args, **kwargs)
+
+    return limited_func
+
+  return decorator
+
+
+def _call_with_retries(client, endpoint: str, func: Callable[[], T]) -> T:
+  """Calls func, retrying the failures retry_policy classifies as retryable.
+
+  Args:
+    client: The GoogleApiClient, whose retry policy and credentials are used.
+    endpoint: The endpoint called, retries and time lost are accounted to it.
+    func: The call.
+
+  Returns:
+    The result of the call.
+
+  Raises:
+    RuntimeError: The call failed with an error which isn't retried, or
+      still failed after MAX_RETRIES attempts or once the retry budget was
+      exhausted.
+  """
+  policy = client.retry_policy
+  delay = 0.0
+  for _ in range(retry_policy.MAX_RETRIES):
+    credential_generation = client.credential_generation
+    start_time = time.monotonic()
+    try:
+      result = func()
+    except (errors.HttpError, TimeoutError, ConnectionError) as e:
+      outcome = retry_policy.classify(e)
+      if outcome == retry_policy.FAIL:
+        policy.on_failure(endpoint)
+        raise RuntimeError(
+            'Non-retryable error. The operation failed. {}'.format(e)
+        ) from e
+      if outcome == retry_policy.REFRESH_CREDENTIALS:
+        client.refresh_credentials(credential_generation)
+      else:
+        delay = policy.get_delay_seconds(endpoint, e, delay)
+        logger.Logger.get_instance().log(
+            'Caught error which will be retried in {:.1f} seconds {}'.format(
+                delay, str(e)
+            )
+        )
+        if not client.is_test_env:
+          time.sleep(delay)
+      policy.on_retry(endpoint, time.monotonic() - start_time)
+      continue
+    policy.on_success()
+    return result
+  raise RuntimeError('Max retries exceeded. The operation failed.')
 
 
 def retry_with_credential_refresh(func: Callable[..., T]) -> Callable[..., T]:
-  """Retry with credential refresh if error code 503 is returned."""
+  """Retries the call per retry_policy, refreshing expired credentials.
+
+  Retries are accounted to the endpoint of the rate_limited call.
+  """
 
+  @functools.wraps(func)
   def retried_func(self, *args: Any, **kwargs: Any) -> T:
-    for retries in range(MAX_RETRIES):
-      try:
-        result = func(self, *args, **kwargs)
-        return result
-      except errors.HttpError as e:
-        error_code = e.resp.status
-        if error_code == 401:
-          logger.Logger.get_instance().log(
-              'Oauth token expired , refreshed token'
-          )
-          self.reauth_and_refresh_clients()
-        else:
-          logger.Logger.get_instance().log(
-              'Caught http error which will be retried {}'.format(str(e))
-          )
-          if not self.is_test_env:
-            delay = min(BASE_DELAY_SECONDS * 2**retries, MAX_DELAY_SECONDS)
-            time.sleep(delay + random.uniform(0, 0.1 * delay))
-    raise RuntimeError('Max retries exceeded. The operation failed.')
+    return _call_with_retries(
+        self,
+        getattr(func, 'endpoint', func.__name__),
+        lambda: func(self, *args, **kwargs),
+    )
+
   return retried_func
 
 
+class _StoreCredentials(google_credentials.Credentials):
+  """Credentials delegating to the current credential of a CredentialStore.
+
+  A credential refresh swaps the credential of the store, which the
+  authorized http of every client picks up on its next request. An expired
+  credential is refreshed through refresh, once across all workers, rather
+  than by each request. Being google-auth Credentials, they also authorize
+  the calls packed into batch requests.
+  """
+
+  def __init__(
+      self,
+      store: credential_store.CredentialStore,
+      get_generation: Callable[[], int],
+      refresh: Callable[[int], None],
+  ):
+    self._store = store
+    self._get_generation = get_generation
+    self._refresh = refresh
+    super().__init__()
+
+  # The token and expiry are those of the credential of the store, the
+  # values set by the base class are ignored.
+
+  @property
+  def token(self) -> Optional[str]:
+    return self._store.get_oauth_token().token
+
+  @token.setter
+  def token(self, value: Optional[str]) -> None:
+    del value
+
+  @property
+  def expiry(self) -> Any:
+    return self._store.get_oauth_token().expiry
+
+  @expiry.setter
+  def expiry(self, value: Any) -> None:
+    del value
+
+  @property
+  def expired(self) -> bool:
+    return self._store.get_oauth_token().expired
+
+  @property
+  def valid(self) -> bool:
+    return self._store.get_oauth_token().valid
+
+  def refresh(self, request) -> None:
+    del request  # Refreshed by the store
+    self._refresh(self._get_generation())
+
+  def apply(self, headers, token=None) -> None:
+    self._store.get_oauth_token().apply(headers, token=token)
+
+  def before_request(self, request, method, url, headers) -> None:
+    del request, method, url  # Only the token is applied to the request
+    generation = self._get_generation()
+    if not self.valid:
+      self._refresh(generation)
+    self.apply(headers)
+
+
 class GoogleApiClient(change_client_interface.ChangeClientInterface):
   """GoogleAPIClient following ChangeClientInterface.
 
   Implementing actual invocation of adminsdk and CIG client.
   """
 
-  def __init__(self, output_path, oa_client_creds, is_test_envs, is_dry_run):
+  def __init__(
+      self,
+      output_path,
+      oa_client_creds,
+      is_test_envs,
+      is_dry_run,
+      token_refresh_margin_seconds: Optional[float] = None,
+  ):
     self.is_test_env = is_test_envs
     self.is_dry_run = is_dry_run
     self._credential_store = credential_store.CredentialStore(
         output_path, oa_client_creds
     )
-    self.reauth_and_refresh_clients()
+    self._learned_rates_path = os.path.join(
+        output_path, LEARNED_RATES_FILE_NAME
+    )
+    learned_rates = {}
+    if os.path.exists(self._learned_rates_path):
+      with open(self._learned_rates_path, 'r') as f:
+        learned_rates = json.load(f)
+    self.quota_registry = quota_registry.QuotaRegistry(learned_rates)
+    self.retry_policy = retry_policy.RetryPolicy()
+    self._transport = http_transport.PooledHttp()
+    # Incremented by each credential refresh
+    self.credential_generation = 0
+    # 401s which waited for the refresh of another worker instead of
+    # refreshing again
+    self.coalesced_refreshes = 0
+    self._refresh_lock = threading.Lock()
+    self._discovery_documents = discovery_documents.DiscoveryDocuments(
+        os.path.join(
+            output_path, discovery_documents.DISCOVERY_CACHE_DIR_NAME
+        ),
+        self._transport.request,
+    )
+    # The credential store authenticated on creation, each thread checks out
+    # the client of a service on its first call to the service.
+    self._client_pool = client_pool.ClientPool(self._build_client)
+    # Unless None , the token is refreshed in the background this many
+    # seconds before its expiry.
+    self._token_refresher = None
+    if token_refresh_margin_seconds is not None:
+      self._token_refresher = token_refresher.TokenRefresher(
+          lambda: self._credential_store.get_oauth_token().expiry,
+          self._refresh_credentials_ahead_of_expiry,
+          token_refresh_margin_seconds,
+      )
+      self._token_refresher.start()
+
+  def save_learned_rates(self) -> None:
+    """Logs and persists the learned rate of each quota bucket."""
+    learned_rates = self.quota_registry.learned_rates()
+    for name, rate in learned_rates.items():
+      logger.Logger.get_instance().debug(
+          'Learned rate for {} = {:.1f} calls/second'.format(name, rate)
+      )
+    with open(self._learned_rates_path, 'w') as f:
+      json.dump(learned_rates, f)
+
+  def get_transport_stats(self) -> Mapping[str, Any]:
+    """Returns the requests, new connections and reuse of the transport."""
+    return self._transport.stats.as_dict()
+
+  def get_retry_stats(self) -> Mapping[str, Mapping[str, float]]:
+    """Returns the retries, seconds lost and failures per endpoint."""
+    return self.retry_policy.stats()
+
+  def get_credential_stats(self) -> Mapping[str, Any]:
+    """Returns the credential refreshes and their latency."""
+    stats = {
+        'refreshes': self.credential_generation,
+        'coalesced_refreshes': self.coalesced_refreshes,
+        'background_refreshes': 0,
+        'background_failures': 0,
+        'max_refresh_seconds': 0.0,
+    }
+    if self._token_refresher is not None:
+      refresher_stats = self._token_refresher.stats()
+      stats['background_refreshes'] = refresher_stats['refreshes']
+      stats['background_failures'] = refresher_stats['failures']
+      stats['max_refresh_seconds'] = refresher_stats['max_refresh_seconds']
+    return stats
 
   def get_admin_sdk_client(self) -> Any:
-    return self._adminsdk_client
+    return self._client_pool.get('admin_sdk')
 
   def get_identity_client(self) -> Any:
-    return self._identity_client
+    return self._client_pool.get('identity')
 
   def get_people_client(self) -> Any:
-    return self._people_client
-
-  def reauth_and_refresh_clients(self):
-    self._credential_store.authenticate()
-    self._create_or_refresh_clients()
-
-  def _create_or_refresh_clients(self):
-    self._adminsdk_client = discovery.build(
-        'admin',
-        'directory_v1',
-        credentials=self._credential_store.get_oauth_token(),
-        cache_discovery=False,
+    return self._client_pool.get('people')
+
+  def refresh_credentials(self, stale_generation: int) -> None:
+    """Refreshes the credential once across all workers.
+
+    Called after a 401 and before a request with an expired credential. The
+    first worker holding the credential of generation stale_generation
+    refreshes it, the others wait for that refresh and use its result. The
+    refresh is forced, the server rejected the credential even if it doesn't
+    look expired, and the refreshed credential is saved. The clients are
+    kept, they authorize each request with the current credential of the
+    store.
+
+    Args:
+      stale_generation: credential_generation read before the failed request
+        or the expiry check.
+    """
+    with self._refresh_lock:
+      if self.credential_generation != stale_generation:
+        self.coalesced_refreshes += 1
+        return
+      logger.Logger.get_instance().log('Oauth token expired , refreshed token')
+      self._credential_store.refresh()
+      self.credential_generation += 1
+
+  def _refresh_credentials_ahead_of_expiry(self) -> None:
+    # Requests in flight keep the previous token until they complete, a 401
+    # of theirs then waits for this refresh rather than refreshing again.
+    with self._refresh_lock:
+      self._credential_store.refresh()
+      self.credential_generation += 1
+
+  def _build_client(self, service: str) -> Any:
+    """Builds a discovery client of the service for the client pool."""
+    # All clients share the pooled transport, whose keep-alive connections
+    # outlive the credential refreshes. Refreshes on expiry and on 401 are
+    # left to refresh_credentials rather than to each AuthorizedHttp.
+    authorized_http = google_auth_httplib2.AuthorizedHttp(
+        _StoreCredentials(
+            self._credential_store,
+            lambda: self.credential_generation,
+            self.refresh_credentials,
+        ),
+        http=self._transport,
+        refresh_status_codes=(),
     )
-    self._identity_client = discovery.build(
-        'cloudidentity',
-        'v1',
-        credentials=self._credential_store.get_oauth_token(),
-        cache_discovery=False,
+    return discovery.build_from_document(
+        self._discovery_documents.get(*DISCOVERY_SERVICES[service]),
+        http=authorized_http,
+    )
+
+  def _execute_batch(
+      self,
+      keys: Sequence[str],
+      request_builders: Mapping[str, Callable[[], Any]],
+  ) -> Dict[str, BatchResult]:
+    """Executes the requests for the given keys as a single batch request.
+
+    Only the failures of the batch request itself are raised, those of the
+    batched calls are returned along with their key.
+    """
+    results = {}
+
+    def callback(request_id, response, exception):
+      results[keys[int(request_id)]] = (response, exception)
+
+    batch = self.get_admin_sdk_client().new_batch_http_request(
+        callback=callback
     )
-    self._people_client = discovery.build(
-        'people',
-        'v1',
-        credentials=self._credential_store.get_oauth_token(),
-        cache_discovery=False,
+    for index, key in enumerate(keys):
+      batch.add(request_builders[key](), request_id=str(index))
+    batch.execute()
+    return results
+
+  def _execute_batched(
+      self,
+      endpoint: str,
+      request_builders: Mapping[str, Callable[[], Any]],
+      is_handled_error: Callable[[errors.HttpError], bool],
+      progress_name: Optional[str] = None,
+      concurrency_family: Optional[str] = None,
+  ) -> Tuple[Dict[str, BatchResult], Dict[str, Exception]]:
+    """Executes the given requests packed into batches of BATCH_SIZE calls.
+
+    A failed call doesn't stop the others, all calls are made and the
+    outcome of each is returned.
+
+    Args:
+      endpoint: The endpoint called, each batched call draws from its quota
+        bucket.
+      request_builders: Map of key to a function building the request for the
+        key. Requests are re-built on each retry.
+      is_handled_error: Returns whether a per-item error is an expected outcome
+        to be returned to the caller ( e.g 404 ) rather than retried.
+      progress_name: If set , the progress and rate of completed calls is
+        logged after each batch under this name.
+      concurrency_family: If set , each batch request counts against the
+        concurrency cap of the endpoint family while it executes.
+
+    Returns:
+      Map of key to (response, error) of the completed calls, error being a
+      handled error or None, and map of key to error of the failed calls.
+      Together they hold every key in request_builders.
+    """
+    results = {}
+    # Latest error of each call which didn't complete
+    failures = {}
+    pending_keys = list(request_builders)
+    bucket = self.quota_registry.bucket(endpoint)
+    start_time = time.time()
+    delay = 0.0
+    for attempt in range(retry_policy.MAX_RETRIES):
+      credential_generation = self.credential_generation
+      attempt_start_time = time.monotonic()
+      retried_errors = []
+      for start in range(0, len(pending_keys), BATCH_SIZE):
+        chunk = pending_keys[start : start + BATCH_SIZE]
+        if not self.is_test_env:
+          bucket.acquire(len(chunk))
+        rate_limit_errors = []
+
+        def execute_batch(chunk=chunk):
+          if concurrency_family is None:
+            return self._execute_batch(chunk, request_builders)
+          with _ENDPOINT_SEMAPHORES[concurrency_family]:
+            return self._execute_batch(chunk, request_builders)
+
+        try:
+          batch_results = _call_with_retries(self, endpoint, execute_batch)
+        except RuntimeError as e:
+          # The batch request itself failed, as did all of its calls
+          for key in chunk:
+            failures[key] = e
+          continue
+        for key, (response, error) in batch_results.items():
+          if error is None or is_handled_error(error):
+            results[key] = (response, error)
+            failures.pop(key, None)
+            self.retry_policy.on_success()
+            continue
+          failures[key] = error
+          if retry_policy.classify(error) == retry_policy.FAIL:
+            self.retry_policy.on_failure(endpoint)
+            continue
+          retried_errors.append(error)
+          if retry_policy.is_rate_limit_error(error):
+            rate_limit_errors.append(error)
+        if rate_limit_errors:
+          # Honor the longest Retry-After of the batch
+          _on_rate_limited(
+              bucket,
+              max(
+                  rate_limit_errors,
+                  key=lambda e: retry_policy.get_retry_after_seconds(e) or 0,
+              ),
+          )
+        else:
+          bucket.on_success(len(chunk))
+        if progress_name:
+          elapsed_seconds = max(time.time() - start_time, 1e-3)
+          logger.Logger.get_instance().log(
+              '{} : {}/{} completed at {:.1f} calls/second'.format(
+                  progress_name,
+                  len(results),
+                  len(request_builders),
+                  len(results) / elapsed_seconds,
+              )
+          )
+      # Only the retryable failures are retried
+      pending_keys = [
+          key
+          for key in pending_keys
+          if key in failures
+          and isinstance(failures[key], errors.HttpError)
+          and retry_policy.classify(failures[key]) != retry_policy.FAIL
+      ]
+      if not pending_keys or attempt == retry_policy.MAX_RETRIES - 1:
+        break
+      outcomes = [retry_policy.classify(error) for error in retried_errors]
+      if retry_policy.REFRESH_CREDENTIALS in outcomes:
+        self.refresh_credentials(credential_generation)
+      else:
+        # Honor the longest Retry-After of the failed calls
+        try:
+          delay = self.retry_policy.get_delay_seconds(
+              endpoint,
+              max(
+                  retried_errors,
+                  key=lambda e: retry_policy.get_retry_after_seconds(e) or 0,
+              ),
+              delay,
+          )
+        except RuntimeError as e:
+          logger.Logger.get_instance().log(str(e))
+          break
+        logger.Logger.get_instance().log(
+            'Caught http errors for {} batched calls which will be retried in'
+            ' {:.1f} seconds {}'.format(
+                len(pending_keys), delay, [str(e) for e in retried_errors[:1]]
+            )
+        )
+        if not self.is_test_env:
+          time.sleep(delay)
+      self.retry_policy.on_retry(
+          endpoint, time.monotonic() - attempt_start_time
+      )
+    return results, failures
+
+  def _execute_page(
+      self,
+      endpoint: str,
+      concurrency_family: Optional[str],
+      build_request: Callable[[Optional[str]], Any],
+      page_token: Optional[str],
+  ) -> Mapping[str, Any]:
+    """Executes the request for a single page, retried on its own."""
+
+    def execute():
+      if concurrency_family is None:
+        return build_request(page_token).execute()
+      with _ENDPOINT_SEMAPHORES[concurrency_family]:
+        return build_request(page_token).execute()
+
+    return _call_with_retries(
+        self, endpoint, lambda: _call_rate_limited(self, endpoint, execute)
     )
 
+  def _iter_pages(
+      self,
+      endpoint: str,
+      build_request: Callable[[Optional[str]], Any],
+      concurrency_family: Optional[str],
+  ) -> Iterator[Mapping[str, Any]]:
+    page_token = None
+    while True:
+      response = self._execute_page(
+          endpoint, concurrency_family, build_request, page_token
+      )
+      yield response
+      page_token = response.get('nextPageToken')
+      if not page_token:
+        break
+
+  def _paginate(
+      self,
+      endpoint: str,
+      build_request: Callable[[Optional[str]], Any],
+      items_key: str,
+      concurrency_family: Optional[str] = None,
+      pipelined: bool = False,
+  ) -> Iterator[Mapping[str, Any]]:
+    """Yields the items of each page as soon as the page is fetched.
+
+    Args:
+      endpoint: The endpoint called, each page draws from its quota bucket.
+      build_request: Builds the request for the given page token ( None for
+        the first page ).
+      items_key: Key of the items in each page.
+      concurrency_family: If set , each page counts against the concurrency
+        cap of the endpoint family.
+      pipelined: If set , pages are fetched by a background thread up to
+        PAGE_PREFETCH_DEPTH pages ahead of the consumer.
+
+    Yields:
+      The items of all pages, in order.
+    """
+    pages = self._iter_pages(endpoint, build_request, concurrency_family)
+    if pipelined:
+      pages = _prefetched(pages, PAGE_PREFETCH_DEPTH)
+    for page in pages:
+      yield from page.get(items_key, [])
+
+  def _get_page_size(self, page_size: int) -> int:
+    if self.is_test_env:
+      return TEST_PAGE_SIZE
+    return page_size
+
   @retry_with_credential_refresh
+  @rate_limited('people.get')
   def get_primary_email(self) -> str:
     person_info = (
-        self._people_client.people()
-        .get(resourceName='people/me', personFields='emailAddresses')
+        self.get_people_client()
+        .people()
+        .get(
+            resourceName='people/me',
+            personFields='emailAddresses',
+            fields=PERSON_FIELDS,
+        )
         .execute()
     )
     authenticated_email = None
@@ -133,20 +752,22 @@ class GoogleApiClient(change_client_interface.ChangeClientInterface):
     return authenticated_email
 
   @retry_with_credential_refresh
+  @rate_limited('customers.get')
   def get_customer(self) -> Optional[Mapping[str, Any]]:
     return (
         self.get_admin_sdk_client()
         .customers()
-        .get(customerKey='my_customer')
+        .get(customerKey='my_customer', fields=CUSTOMER_FIELDS)
         .execute()
     )
 
   @retry_with_credential_refresh
+  @rate_limited('orgunits.list')
   def get_root_ou(self, customer_id: str) -> str:
     result = (
         self.get_admin_sdk_client()
         .orgunits()
-        .list(customerId=customer_id)
+        .list(customerId=customer_id, fields=ROOT_ORG_UNIT_FIELDS)
         .execute()
     )
     ous = set()
@@ -169,14 +790,18 @@ class GoogleApiClient(change_client_interface.ChangeClientInterface):
     else:
       raise AssertionError('Unexpected error:invalid ouId patterns')
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_DEFAULT, period=1)
   @retry_with_credential_refresh
+  @rate_limited('orgunits.get')
   def get_ou(self, ou_id: str) -> Optional[Mapping[str, Any]]:
     try:
       return (
           self.get_admin_sdk_client()
           .orgunits()
-          .get(customerId='my_customer', orgUnitPath='id:' + ou_id)
+          .get(
+              customerId='my_customer',
+              orgUnitPath='id:' + ou_id,
+              fields=ORG_UNIT_FIELDS,
+          )
           .execute()
       )
     except errors.HttpError as e:
@@ -186,12 +811,15 @@ class GoogleApiClient(change_client_interface.ChangeClientInterface):
       else:
         raise
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_DEFAULT, period=1)
   @retry_with_credential_refresh
+  @rate_limited('users.get')
   def get_user(self, user_email: str) -> Optional[Mapping[str, Any]]:
     try:
       return (
-          self.get_admin_sdk_client().users().get(userKey=user_email).execute()
+          self.get_admin_sdk_client()
+          .users()
+          .get(userKey=user_email, fields=USER_FIELDS)
+          .execute()
       )
     except errors.HttpError as e:
       error_code = e.resp.status
@@ -200,13 +828,56 @@ class GoogleApiClient(change_client_interface.ChangeClientInterface):
       else:
         raise
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_DEFAULT, period=1)
+  def get_users(
+      self, user_keys: Sequence[str]
+  ) -> Mapping[str, Optional[Mapping[str, Any]]]:
+    request_builders = {
+        user_key: (
+            lambda user_key=user_key: self.get_admin_sdk_client()
+            .users()
+            .get(userKey=user_key, fields=USER_FIELDS)
+        )
+        for user_key in user_keys
+    }
+    results, failures = self._execute_batched(
+        'users.get', request_builders, lambda error: error.resp.status == 404
+    )
+    users = {
+        user_key: response for user_key, (response, _) in results.items()
+    }
+    if failures:
+      raise change_client_interface.BulkOperationError(users, failures)
+    return users
+
+  def iter_users(self) -> Iterator[Mapping[str, Any]]:
+    page_size = self._get_page_size(USERS_PAGE_SIZE)
+    return self._paginate(
+        'users.list',
+        lambda page_token: self.get_admin_sdk_client()
+        .users()
+        .list(
+            customer='my_customer',
+            pageToken=page_token,
+            maxResults=page_size,
+            fields=list_fields('users', USER_FIELDS),
+        ),
+        'users',
+    )
+
+  def list_users(self) -> Sequence[Mapping[str, Any]]:
+    return list(self.iter_users())
+
   @retry_with_credential_refresh
+  @rate_limited('groups.get')
+  @limit_concurrency('groups')
   def get_group(self, group_key: str) -> Optional[Mapping[str, Any]]:
     result = None
     try:
       result = (
-          self.get_admin_sdk_client().groups().get(groupKey=group_key).execute()
+          self.get_admin_sdk_client()
+          .groups()
+          .get(groupKey=group_key, fields=GROUP_FIELDS)
+          .execute()
       )
     except errors.HttpError as e:
       error_code = e.resp.status
@@ -214,15 +885,18 @@ class GoogleApiClient(change_client_interface.ChangeClientInterface):
         raise
     return result
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_DEFAULT, period=1)
   @retry_with_credential_refresh
+  @rate_limited('members.get')
+  @limit_concurrency('members')
   def group_has_member(self, group_email: str, user_email: str) -> bool:
     has_member = False
     try:
       member = (
           self.get_admin_sdk_client()
           .members()
-          .get(groupKey=group_email, memberKey=user_email)
+          .get(
+              groupKey=group_email, memberKey=user_email, fields=MEMBER_FIELDS
+          )
           .execute()
       )
       if member is not None and member['email'] == user_email:
@@ -234,34 +908,31 @@ class GoogleApiClient(change_client_interface.ChangeClientInterface):
 
     return has_member
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_DEFAULT, period=1)
-  @retry_with_credential_refresh
-  def get_group_members(self, group_email: str) -> Sequence[Mapping[str, Any]]:
-    all_members = []
-    page_token = None
-    page_size = DEFAULT_PAGE_SIZE
-    if self.is_test_env:
-      page_size = TEST_PAGE_SIZE
+  def iter_group_members(self, group_email: str) -> Iterator[Mapping[str, Any]]:
     if self.get_group(group_email) is None:
-      return []
-    while True:
-      members_list = (
-          self.get_admin_sdk_client()
-          .members()
-          .list(
-              groupKey=group_email, pageToken=page_token, maxResults=page_size
-          )
-          .execute()
-      )
-      if 'members' in members_list:
-        all_members.extend(members_list['members'])
-      page_token = members_list.get('nextPageToken')
-      if not page_token:
-        break
-    return all_members
+      return
+    page_size = self._get_page_size(DEFAULT_PAGE_SIZE)
+    yield from self._paginate(
+        'members.list',
+        lambda page_token: self.get_admin_sdk_client()
+        .members()
+        .list(
+            groupKey=group_email,
+            pageToken=page_token,
+            maxResults=page_size,
+            fields=list_fields('members', MEMBER_FIELDS),
+        ),
+        'members',
+        concurrency_family='members',
+        pipelined=True,
+    )
+
+  def get_group_members(self, group_email: str) -> Sequence[Mapping[str, Any]]:
+    return list(self.iter_group_members(group_email))
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_DEFAULT, period=1)
   @retry_with_credential_refresh
+  @rate_limited('cloudidentity.groups.create')
+  @limit_concurrency('groups')
   def create_group(
       self,
       customer_id: str,
@@ -297,106 +968,93 @@ class GoogleApiClient(change_client_interface.ChangeClientInterface):
       else:
         raise
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_ROLES, period=1)
-  @retry_with_credential_refresh
+  def iter_roles(self) -> Iterator[Mapping[str, Any]]:
+    page_size = self._get_page_size(DEFAULT_PAGE_SIZE)
+    return self._paginate(
+        'roles.list',
+        lambda page_token: self.get_admin_sdk_client()
+        .roles()
+        .list(
+            customer='my_customer',
+            pageToken=page_token,
+            maxResults=page_size,
+            fields=list_fields('items', ROLE_FIELDS),
+        ),
+        'items',
+        pipelined=True,
+    )
+
   def list_roles(
       self,
   ) -> Sequence[Mapping[str, Any]]:
-    all_roles = []
-    page_token = 'first_page'
+    return list(self.iter_roles())
 
-    if self.is_test_env:
-      page_size = TEST_PAGE_SIZE
-    else:
-      page_size = DEFAULT_PAGE_SIZE
-    while page_token is not None:
-      if page_token == 'first_page':
-        roles_response = (
-            self.get_admin_sdk_client()
-            .roles()
-            .list(
-                customer='my_customer',
-                maxResults=page_size,
-            )
-            .execute()
-        )
-      else:
-        roles_response = (
-            self.get_admin_sdk_client()
-            .roles()
-            .list(
-                customer='my_customer',
-                pageToken=page_token,
-                maxResults=page_size,
-            )
-            .execute()
-        )
-      page_token = roles_response.get('nextPageToken')
-      all_roles.extend(roles_response.get('items', []))
-
-    return all_roles
+  def iter_role_assignments(
+      self, role_id: Optional[str] = None, user_id: Optional[str] = None
+  ) -> Iterator[Mapping[str, Any]]:
+    """Yields the role-assignments, optionally of a role or a user."""
+    if role_id is not None and user_id is not None:
+      raise AssertionError(
+          'google_api_client.list_role_assignments user_id and role_id may'
+          ' not be both specified'
+      )
+    filters = {}
+    if role_id is not None:
+      filters['roleId'] = role_id
+    if user_id is not None:
+      filters['userKey'] = user_id
+    page_size = self._get_page_size(DEFAULT_PAGE_SIZE)
+    return self._paginate(
+        'roleAssignments.list',
+        lambda page_token: self.get_admin_sdk_client()
+        .roleAssignments()
+        .list(
+            customer='my_customer',
+            pageToken=page_token,
+            maxResults=page_size,
+            fields=list_fields('items', ROLE_ASSIGNMENT_FIELDS),
+            **filters
+        ),
+        'items',
+        concurrency_family='roleAssignments',
+        pipelined=True,
+    )
 
-  @retry_with_credential_refresh
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_ROLES, period=1)
   def list_role_assignments(
       self, role_id: Optional[str] = None, user_id: Optional[str] = None
   ) -> Sequence[Mapping[str, Any]]:
-    all_role_assignments = []
-    page_token = None
-    page_size = DEFAULT_PAGE_SIZE
+    return list(self.iter_role_assignments(role_id, user_id))
 
-    if self.is_test_env:
-      page_size = TEST_PAGE_SIZE
-    while True:
-      if role_id is None and user_id is None:
-        ra_response = (
-            self.get_admin_sdk_client()
-            .roleAssignments()
-            .list(
-                customer='my_customer',
-                pageToken=page_token,
-                maxResults=page_size,
-            )
-            .execute()
-        )
-      elif role_id is not None and user_id is None:
-        ra_response = (
-            self.get_admin_sdk_client()
-            .roleAssignments()
-            .list(
-                customer='my_customer',
-                roleId=role_id,
-                pageToken=page_token,
-                maxResults=page_size,
-            )
-            .execute()
-        )
-      elif user_id is not None and role_id is None:
-        ra_response = (
-            self.get_admin_sdk_client()
-            .roleAssignments()
-            .list(
-                customer='my_customer',
-                userKey=user_id,
-                pageToken=page_token,
-                maxResults=page_size,
-            )
-            .execute()
-        )
-      else:
-        raise AssertionError(
-            'google_api_client.list_role_assignments user_id and role_id may'
-            ' not be both specified'
-        )
+  def iter_role_assignments_by_role(
+      self, role_ids: Sequence[str], max_workers: int
+  ) -> Iterator[Mapping[str, Any]]:
+    """Yields all role-assignments from concurrent listings per role.
 
-      page_token = ra_response.get('nextPageToken')
-      all_role_assignments.extend(ra_response.get('items', []))
-      if not page_token:
-        break
-    return all_role_assignments
+    Each role is a separate pagination chain, so that the listing isn't bound
+    by the latency of a single chain.
+
+    Args:
+      role_ids: Ids of all roles of the customer.
+      max_workers: Number of roles listed concurrently.
+
+    Yields:
+      The role-assignments of all roles, in the order of role_ids. Those of a
+      role are yielded once all of them were listed.
+    """
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+      for role_role_assignments in executor.map(
+          self.list_role_assignments, role_ids
+      ):
+        yield from role_role_assignments
+
+  def list_role_assignments_by_role(
+      self, role_ids: Sequence[str], max_workers: int
+  ) -> Sequence[Mapping[str, Any]]:
+    return list(self.iter_role_assignments_by_role(role_ids, max_workers))
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_ROLES, period=1)
   @retry_with_credential_refresh
+  @rate_limited('roleAssignments.delete')
+  @limit_concurrency('roleAssignments')
   def delete_role_assignment(self, role_assignment_id: str) -> bool:
     if self.is_dry_run:
       raise AssertionError(
@@ -407,21 +1065,49 @@ class GoogleApiClient(change_client_interface.ChangeClientInterface):
           customer='my_customer', roleAssignmentId=role_assignment_id
       ).execute()
     except errors.HttpError as e:
-      error_code = e.resp.status
-      if error_code == 404:
-        return False
-      # The asserted user -i.e. admin cannot perform actions on itself
-      if error_code == 403 and re.search(r'AdminSelfRevokeNotAllowed', str(e)):
-        logger.Logger.get_instance().debug(
-            ' ....AdminSelfRevokeNotAllowed! {}'.format(str(e))
-        )
+      if _is_unchanged_delete_role_assignment_error(e):
         return False
       else:
         raise
     return True
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_DEFAULT, period=1)
+  def delete_role_assignments(
+      self, role_assignment_ids: Sequence[str]
+  ) -> Mapping[str, bool]:
+    if self.is_dry_run:
+      raise AssertionError(
+          'GoogleApiClient.delete_role_assignments invoked when dryRun=True '
+      )
+    request_builders = {
+        role_assignment_id: (
+            lambda role_assignment_id=role_assignment_id: (
+                self.get_admin_sdk_client()
+                .roleAssignments()
+                .delete(
+                    customer='my_customer', roleAssignmentId=role_assignment_id
+                )
+            )
+        )
+        for role_assignment_id in role_assignment_ids
+    }
+    results, failures = self._execute_batched(
+        'roleAssignments.delete',
+        request_builders,
+        _is_unchanged_delete_role_assignment_error,
+        progress_name='Deleting role-assignments',
+        concurrency_family='roleAssignments',
+    )
+    deleted = {
+        role_assignment_id: error is None
+        for role_assignment_id, (_, error) in results.items()
+    }
+    if failures:
+      raise change_client_interface.BulkOperationError(deleted, failures)
+    return deleted
+
   @retry_with_credential_refresh
+  @rate_limited('members.insert')
+  @limit_concurrency('members')
   def insert_member_into_group(
       self, user_email: str, user_id: str, group_email: str
   ) -> None:
@@ -445,28 +1131,65 @@ class GoogleApiClient(change_client_interface.ChangeClientInterface):
         raise
     return
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_ROLES, period=1)
+  def insert_members_into_group(
+      self, group_email: str, members: Sequence[Mapping[str, str]]
+  ) -> Mapping[str, bool]:
+    if self.is_dry_run:
+      raise AssertionError(
+          'GoogleApiClient.insert_members_into_group invoked when dryRun=True '
+      )
+    request_builders = {
+        member['email']: (
+            lambda member=member: self.get_admin_sdk_client()
+            .members()
+            .insert(
+                groupKey=group_email,
+                body={'email': member['email'], 'role': 'MEMBER'},
+            )
+        )
+        for member in members
+    }
+    # 409 : already a member of the group
+    results, failures = self._execute_batched(
+        'members.insert',
+        request_builders,
+        lambda error: error.resp.status == 409,
+        concurrency_family='members',
+    )
+    inserted = {email: error is None for email, (_, error) in results.items()}
+    if failures:
+      raise change_client_interface.BulkOperationError(inserted, failures)
+    return inserted
+
   @retry_with_credential_refresh
-  def insert_role_assignment(self, role_assignment: Mapping[str, Any]) -> None:
+  @rate_limited('roleAssignments.insert')
+  @limit_concurrency('roleAssignments')
+  def insert_role_assignment(
+      self, role_assignment: Mapping[str, Any]
+  ) -> Optional[Mapping[str, Any]]:
     if self.is_dry_run:
       raise AssertionError(
           'GoogleApiClient.insert_role_assignment invoked when dryRun=False '
       )
     try:
-      self.get_admin_sdk_client().roleAssignments().insert(
-          customer='my_customer', body=role_assignment
-      ).execute()
+      return (
+          self.get_admin_sdk_client()
+          .roleAssignments()
+          .insert(customer='my_customer', body=role_assignment)
+          .execute()
+      )
     except errors.HttpError as e:
       error_code = e.resp.status
       if error_code != 409:
         raise
+    return None
 
-  @ratelimiter.RateLimiter(max_calls=REQUESTS_PER_SECOND_ROLES, period=1)
   @retry_with_credential_refresh
+  @rate_limited('roles.get')
   def get_role(self, role_id: str) -> Optional[Mapping[str, Any]]:
     return (
         self.get_admin_sdk_client()
         .roles()
-        .get(customer='my_customer', roleId=role_id)
+        .get(customer='my_customer', roleId=role_id, fields=ROLE_FIELDS)
         .execute()
     )
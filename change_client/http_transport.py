@@ -0,0 +1,157 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pooled keep-alive HTTP transport shared by the discovery clients.
+
+httplib2.Http objects keep their connections alive but aren't thread-safe.
+PooledHttp lends an idle Http object to each request, so that concurrent
+requests run on separate connections and later requests reuse the warm ones
+rather than paying for a new TCP / TLS handshake.
+"""
+
+import threading
+import time
+from typing import Any, Mapping
+import urllib.parse
+import httplib2
+
+# Socket timeout of each request.
+REQUEST_TIMEOUT_SECONDS = 60
+# Idle Http objects ( each with its keep-alive connections ) kept in the pool,
+# extra ones are closed when returned.
+MAX_IDLE_CONNECTIONS = 32
+
+
+class TransportStats:
+  """Counts requests and the new connections ( handshakes ) they required."""
+
+  def __init__(self):
+    self.requests = 0
+    self.connects = 0
+    self.connect_seconds = 0.0
+    self._lock = threading.Lock()
+
+  def record_request(self) -> None:
+    with self._lock:
+      self.requests += 1
+
+  def record_connect(self, seconds: float) -> None:
+    with self._lock:
+      self.connects += 1
+      self.connect_seconds += seconds
+
+  def as_dict(self) -> Mapping[str, Any]:
+    """Returns the counters, the reuse rate and the handshake time saved.
+
+    The time saved is the mean handshake time of the new connections times
+    the number of requests which reused a connection instead.
+    """
+    with self._lock:
+      reused = max(self.requests - self.connects, 0)
+      mean_connect_seconds = self.connect_seconds / max(self.connects, 1)
+      return {
+          'requests': self.requests,
+          'connects': self.connects,
+          'reuse_rate': reused / max(self.requests, 1),
+          'connect_seconds': self.connect_seconds,
+          'handshake_seconds_saved': reused * mean_connect_seconds,
+      }
+
+
+class PooledHttp:
+  """Thread-safe httplib2.Http compatible transport over pooled Http objects.
+
+  Requests ask for gzip compressed responses, which the Google APIs only
+  send when the user agent contains "gzip" as well.
+  """
+
+  def __init__(
+      self,
+      timeout: float = REQUEST_TIMEOUT_SECONDS,
+      max_idle: int = MAX_IDLE_CONNECTIONS,
+  ):
+    self.timeout = timeout
+    self.follow_redirects = True
+    self.redirect_codes = httplib2.REDIRECT_CODES
+    self.stats = TransportStats()
+    self._max_idle = max_idle
+    # Most recently returned last, so that the warmest connections are reused
+    self._idle = []
+    self._lock = threading.Lock()
+    stats = self.stats
+
+    class TimedHTTPSConnection(httplib2.HTTPSConnectionWithTimeout):
+      """HTTPS connection recording the duration of its TCP / TLS handshake."""
+
+      def connect(self):
+        start_time = time.monotonic()
+        super().connect()
+        stats.record_connect(time.monotonic() - start_time)
+
+    self._connection_type = TimedHTTPSConnection
+
+  def _checkout(self) -> httplib2.Http:
+    with self._lock:
+      if self._idle:
+        return self._idle.pop()
+    return httplib2.Http(timeout=self.timeout)
+
+  def _checkin(self, http: httplib2.Http) -> None:
+    with self._lock:
+      if len(self._idle) < self._max_idle:
+        self._idle.append(http)
+        return
+    http.close()
+
+  def request(
+      self,
+      uri,
+      method='GET',
+      body=None,
+      headers=None,
+      redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+      connection_type=None,
+  ):
+    """Implementation of httplib2's Http.request on a pooled Http object."""
+    headers = dict(headers or {})
+    headers.setdefault('accept-encoding', 'gzip')
+    user_agent = headers.get('user-agent', '')
+    if 'gzip' not in user_agent:
+      headers['user-agent'] = (user_agent + ' (gzip)').strip()
+    if (
+        connection_type is None
+        and urllib.parse.urlsplit(uri).scheme == 'https'
+    ):
+      connection_type = self._connection_type
+    self.stats.record_request()
+    http = self._checkout()
+    try:
+      return http.request(
+          uri,
+          method,
+          body=body,
+          headers=headers,
+          redirections=redirections,
+          connection_type=connection_type,
+      )
+    finally:
+      self._checkin(http)
+
+  def close(self) -> None:
+    with self._lock:
+      idle, self._idle = self._idle, []
+    for http in idle:
+      http.close()
@@ -22,7 +22,10 @@ otherwise writes to dry-run change records.
 """
 from __future__ import print_function
 
-from typing import Any, Dict, Sequence, Optional, Mapping
+import itertools
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Sequence, Optional
+from typing import Mapping
 
 from googleapiclient import errors
 
@@ -32,6 +35,28 @@ from googleapiclient import errors
 from change_client import change_client_interface
 from change_client import dry_run_change_client
 from change_client import google_api_client
+from change_client import retry_policy
+from change_client import role_assignment_counter
+from change_client import role_assignment_snapshot
+from utils import directory_cache
+from utils import lookup_cache
+from utils import single_flight
+
+# Bounds of the in-memory lookup caches, time-to-live is per entity kind.
+# Entities which were not found are cached for NEGATIVE_CACHE_TTL_SECONDS.
+LOOKUP_CACHE_MAX_ENTRIES = 100000
+LOOKUP_CACHE_TTL_SECONDS = {
+    'user': 3600,
+    'group': 600,
+    'role': 3600,
+    'ou': 3600,
+    'root_ou': 3600,
+    'customer': 3600,
+}
+NEGATIVE_CACHE_TTL_SECONDS = 300
+# Reads of a group created by this run before it is taken as missing, a new
+# group may take a while to be returned by groups.get.
+CREATED_GROUP_MAX_READS = retry_policy.MAX_RETRIES
 
 
 class MigrationUtilChangeClient(change_client_interface.ChangeClientInterface):
@@ -42,18 +67,124 @@ class MigrationUtilChangeClient(change_client_interface.ChangeClientInterface):
   otherwise writes to dry-run change records.
   """
 
-  def __init__(self, output_path, oa_client_id_creds, dry_run, is_test_envs):
+  def __init__(
+      self,
+      output_path,
+      oa_client_id_creds,
+      dry_run,
+      is_test_envs,
+      cache_max_age_hours=None,
+      ra_listing_workers=1,
+      token_refresh_margin_seconds=None,
+  ):
     self.dry_run_changes = dry_run_change_client.DryRunChangeClient()
     self.google_api_client = google_api_client.GoogleApiClient(
-        output_path, oa_client_id_creds, is_test_envs, dry_run
+        output_path,
+        oa_client_id_creds,
+        is_test_envs,
+        dry_run,
+        token_refresh_margin_seconds,
     )
-    self.user_cache = {}
-    self.ou_cache = {}
+    self.lookup_caches = {
+        kind: lookup_cache.LookupCache(
+            LOOKUP_CACHE_MAX_ENTRIES, ttl_seconds, NEGATIVE_CACHE_TTL_SECONDS
+        )
+        for kind, ttl_seconds in LOOKUP_CACHE_TTL_SECONDS.items()
+    }
+    self.user_cache = self.lookup_caches['user']
+    # Concurrent reads of the same entity share one API call
+    self.in_flight_reads = single_flight.SingleFlight()
+    # Emails of the groups created by this run, their absence isn't cached.
+    self.created_groups = set()
+    # Compact users index keyed by both id and lower-cased primary email,
+    # populated by preload_users.
+    self.user_index = {}
+    # Once preloaded the index holds every user, a miss isn't looked up.
+    self.users_preloaded = False
+    # Loaded by load_role_assignment_snapshot, role-assignment listings are
+    # then served from memory.
+    self.ra_snapshot = None
+    self._dry_run_ra_ids = itertools.count(1)
+    # Only entities read from / written to the API are persisted, never the
+    # dry-run changes.
+    self.directory_cache = None
+    if cache_max_age_hours is not None:
+      self.directory_cache = directory_cache.DirectoryCache(
+          output_path, cache_max_age_hours * 3600
+      )
+    # All role-assignments are listed per role by this many workers, unless 1.
+    self.ra_listing_workers = ra_listing_workers
     self.dry_run = dry_run
 
   def is_dry_run(self) -> bool:
     return self.dry_run
 
+  def _read_through(self, kind: str, key: str, fetch: Callable[[], Any]) -> Any:
+    """Returns the cached entity, else fetches and caches it.
+
+    The in-memory lookup cache is checked first, then the directory cache.
+    Concurrent misses for the entity share a single fetch.
+    """
+    hit, value = self.lookup_caches[kind].lookup(key)
+    if hit:
+      return value
+    return self.in_flight_reads.do(
+        (kind, key), lambda: self._fetch_through(kind, key, fetch)
+    )
+
+  def _fetch_through(
+      self, kind: str, key: str, fetch: Callable[[], Any]
+  ) -> Any:
+    hit = False
+    if self.directory_cache is not None:
+      hit, value = self.directory_cache.get(kind, key)
+    if not hit:
+      value = fetch()
+      if self.directory_cache is not None:
+        self.directory_cache.put(kind, key, value)
+    self.lookup_caches[kind][key] = value
+    return value
+
+  def _invalidate(self, kind: str, key: str) -> None:
+    self.in_flight_reads.forget((kind, key))
+    self.lookup_caches[kind].invalidate(key)
+    if self.directory_cache is not None:
+      self.directory_cache.delete(kind, key)
+
+  def save_learned_rates(self) -> None:
+    self.google_api_client.save_learned_rates()
+
+  def get_cache_stats(self) -> Mapping[str, Mapping[str, int]]:
+    """Returns the size, hits, misses and evictions per lookup cache."""
+    return {kind: cache.stats() for kind, cache in self.lookup_caches.items()}
+
+  def get_transport_stats(self) -> Mapping[str, Any]:
+    return self.google_api_client.get_transport_stats()
+
+  def get_credential_stats(self) -> Mapping[str, Any]:
+    return self.google_api_client.get_credential_stats()
+
+  def get_retry_stats(self) -> Mapping[str, Mapping[str, float]]:
+    return self.google_api_client.get_retry_stats()
+
+  def get_coalescing_stats(self) -> Mapping[str, int]:
+    """Returns the reads issued and those saved by sharing one in flight."""
+    return self.in_flight_reads.stats()
+
+  def _list_through(
+      self, kind: str, key_field: str, fetch: Callable[[], Sequence[Any]]
+  ) -> Sequence[Any]:
+    """Returns the cached listing, else lists and caches it."""
+    if self.directory_cache is None:
+      return fetch()
+    values = self.directory_cache.get_all(kind)
+    if values is None:
+      values = fetch()
+      self.directory_cache.put_all(
+          kind, {value[key_field]: value for value in values}
+      )
+    return values
+
   def insert_ra(
       self,
       role_id: str,
@@ -88,11 +219,92 @@ class MigrationUtilChangeClient(change_client_interface.ChangeClientInterface):
       if error_code != 409:
         raise
 
+  def _iter_all_role_assignments(self) -> Iterator[Mapping[str, Any]]:
+    if self.ra_listing_workers <= 1:
+      return self.google_api_client.iter_role_assignments(None, None)
+    return self.google_api_client.iter_role_assignments_by_role(
+        [role['roleId'] for role in self.list_roles()],
+        self.ra_listing_workers,
+    )
+
+  def _list_all_role_assignments(self) -> Sequence[Mapping[str, Any]]:
+    if self.ra_listing_workers <= 1:
+      return self.google_api_client.list_role_assignments(None, None)
+    return self.google_api_client.list_role_assignments_by_role(
+        [role['roleId'] for role in self.list_roles()],
+        self.ra_listing_workers,
+    )
+
+  def _with_dry_run_changes(
+      self,
+      role_assignments: Iterable[Mapping[str, Any]],
+      role_id: Optional[str] = None,
+      user_id: Optional[str] = None,
+  ) -> Iterator[Mapping[str, Any]]:
+    """Yields the listed role-assignments updated with the dry-run changes."""
+    if not self.is_dry_run():
+      yield from role_assignments
+      return
+    dry_run_deleted_ra_ids = {
+        item['roleAssignmentId']
+        for item in self.dry_run_changes.list_deleted_role_assignments()
+    }
+    for ra in itertools.chain(
+        role_assignments,
+        self.dry_run_changes.list_role_assignments(role_id, user_id),
+    ):
+      if ra['roleAssignmentId'] not in dry_run_deleted_ra_ids:
+        yield ra
+
+  def load_role_assignment_snapshot(
+      self,
+      ra_counter: Optional[
+          role_assignment_counter.RoleAssignmentCounter
+      ] = None,
+  ) -> int:
+    """Lists all role-assignments once, unless already loaded.
+
+    Later role-assignment listings are served from the snapshot, which is
+    updated with the role-assignments inserted or deleted through this client.
+    Without the directory cache, pages are added to the snapshot as they are
+    fetched rather than once the listing completes.
+
+    Args:
+      ra_counter: If set , counts the role-assignments of the snapshot as they
+        are loaded.
+
+    Returns:
+      The number of role-assignments in the snapshot.
+    """
+    if self.ra_snapshot is None:
+      if self.directory_cache is None:
+        role_assignments = self._with_dry_run_changes(
+            self._iter_all_role_assignments()
+        )
+      else:
+        role_assignments = self.list_role_assignments(None, None)
+      if ra_counter is not None:
+        role_assignments = ra_counter.counted(role_assignments)
+      self.ra_snapshot = role_assignment_snapshot.RoleAssignmentSnapshot(
+          role_assignments
+      )
+    elif ra_counter is not None:
+      for role_assignment in self.ra_snapshot.list_role_assignments(None, None):
+        ra_counter.add(role_assignment)
+    return len(self.ra_snapshot)
+
   def get_role_assignment(
       self, ra_to_find: Dict[str, Any]
   ) -> Optional[Dict[str, Any]]:
     """Find role-assignments by checking matching fields."""
-    ras_by_role = self.list_role_assignments(ra_to_find['roleId'])
+    if self.ra_snapshot is not None:
+      ras_by_role = self.ra_snapshot.list_role_assignments_at_role_scope(
+          ra_to_find['roleId'],
+          ra_to_find['scopeType'],
+          ra_to_find.get('orgUnitId', ''),
+      )
+    else:
+      ras_by_role = self.list_role_assignments(ra_to_find['roleId'])
     # Role-assignments have fields such as etag etc which neednt be exactly
     # matched and may not exist in dry run, therefore do a minimum
     # field by field match
@@ -124,33 +336,121 @@ class MigrationUtilChangeClient(change_client_interface.ChangeClientInterface):
       self.google_api_client.create_group(
           customer_id, group_email, group_display_name, group_description
       )
+      self.created_groups.add(group_email)
+      self._invalidate('group', group_email)
 
   def get_ou(self, ou_id: str) -> Optional[Mapping[str, Any]]:
-    if ou_id in self.ou_cache:
-      return self.ou_cache[ou_id]
-    return self.google_api_client.get_ou(ou_id)
+    return self._read_through(
+        'ou', ou_id, lambda: self.google_api_client.get_ou(ou_id)
+    )
+
+  def preload_users(self) -> int:
+    """Indexes all users of the customer, returns the number of users."""
+    users = self._list_through('users', 'id', self.list_users)
+    for user in users:
+      compact_user = {'id': user['id'], 'primaryEmail': user['primaryEmail']}
+      self.user_index[user['id']] = compact_user
+      self.user_index[user['primaryEmail'].lower()] = compact_user
+    self.users_preloaded = True
+    return len(users)
+
+  def _get_indexed_user(self, user_key: str) -> Optional[Mapping[str, Any]]:
+    return self.user_index.get(user_key) or self.user_index.get(
+        user_key.lower()
+    )
 
   def get_user(self, user_email: str) -> Optional[Mapping[str, Any]]:
-    if user_email in self.user_cache:
-      return self.user_cache[user_email]
-    self.user_cache[user_email] = self.google_api_client.get_user(user_email)
-    return self.user_cache[user_email]
+    indexed_user = self._get_indexed_user(user_email)
+    if indexed_user is not None or self.users_preloaded:
+      return indexed_user
+    return self._read_through(
+        'user',
+        user_email,
+        lambda: self.google_api_client.get_user(user_email),
+    )
+
+  def get_users(
+      self, user_keys: Sequence[str]
+  ) -> Mapping[str, Optional[Mapping[str, Any]]]:
+    if self.users_preloaded:
+      return {
+          user_key: self._get_indexed_user(user_key) for user_key in user_keys
+      }
+    uncached_user_keys = [
+        user_key
+        for user_key in dict.fromkeys(user_keys)
+        if user_key not in self.user_cache
+        and self._get_indexed_user(user_key) is None
+    ]
+    if self.directory_cache is not None:
+      for user_key in list(uncached_user_keys):
+        hit, user = self.directory_cache.get('user', user_key)
+        if hit:
+          self.user_cache[user_key] = user
+          uncached_user_keys.remove(user_key)
+    if uncached_user_keys:
+      users = self.google_api_client.get_users(uncached_user_keys)
+      self.user_cache.update(users)
+      if self.directory_cache is not None:
+        for user_key, user in users.items():
+          self.directory_cache.put('user', user_key, user)
+    return {user_key: self.get_user(user_key) for user_key in user_keys}
+
+  def list_users(self) -> Sequence[Mapping[str, Any]]:
+    return self.google_api_client.list_users()
+
+  def _get_created_group(self, group_key: str) -> Optional[Mapping[str, Any]]:
+    """Returns a group created by this run, waiting for it to be visible.
+
+    groups.get is retried with backoff while it doesn't return the group, and
+    only the group once found is cached.
+    """
+    hit, group = self.lookup_caches['group'].lookup(group_key)
+    if hit and group is not None:
+      return group
+    delay = 0.0
+    for attempt in range(CREATED_GROUP_MAX_READS):
+      if attempt:
+        delay = retry_policy.get_backoff_seconds(delay)
+        time.sleep(delay)
+      group = self.in_flight_reads.do(
+          ('group', group_key),
+          lambda: self.google_api_client.get_group(group_key),
+      )
+      if group is not None:
+        self.lookup_caches['group'][group_key] = group
+        if self.directory_cache is not None:
+          self.directory_cache.put('group', group_key, group)
+        return group
+    return None
 
   def get_group(self, group_key: str) -> Optional[Mapping[str, Any]]:
-    result = self.google_api_client.get_group(group_key)
+    if group_key in self.created_groups:
+      return self._get_created_group(group_key)
+    result = self._read_through(
+        'group', group_key, lambda: self.google_api_client.get_group(group_key)
+    )
     if result is None and self.is_dry_run():
       result = self.dry_run_changes.get_group(group_key)
     return result
 
   def get_group_members(self, group_email: str) -> Sequence[Mapping[str, Any]]:
-    all_members = list(self.google_api_client.get_group_members(group_email))
+    all_members = list(
+        self.in_flight_reads.do(
+            ('members', group_email),
+            lambda: self.google_api_client.get_group_members(group_email),
+        )
+    )
     if self.is_dry_run():
       all_members.extend(self.dry_run_changes.get_group_members(group_email))
     return all_members
 
   def group_has_member(self, group_email: str, user_email: str) -> bool:
-    has_member = self.google_api_client.group_has_member(
-        group_email, user_email
+    has_member = self.in_flight_reads.do(
+        ('member', group_email, user_email),
+        lambda: self.google_api_client.group_has_member(
+            group_email, user_email
+        ),
     )
     if not has_member and self.is_dry_run():
       has_member = self.dry_run_changes.group_has_member(
@@ -159,7 +459,11 @@ class MigrationUtilChangeClient(change_client_interface.ChangeClientInterface):
     return has_member
 
   def get_root_ou(self, customer_id: str) -> str:
-    return self.google_api_client.get_root_ou(customer_id)
+    return self._read_through(
+        'root_ou',
+        customer_id,
+        lambda: self.google_api_client.get_root_ou(customer_id),
+    )
 
   def list_role_assignments(
       self, role_id: Optional[str] = None, user_id: Optional[str] = None
@@ -168,38 +472,75 @@ class MigrationUtilChangeClient(change_client_interface.ChangeClientInterface):
       raise AssertionError(
           'list_role_assignments role_id and user_id may not be specified'
       )
-    role_assignments = list(
-        self.google_api_client.list_role_assignments(role_id, user_id)
-    )
-    if self.is_dry_run():
-      role_assignments.extend(
-          self.dry_run_changes.list_role_assignments(role_id, user_id)
+    # Users keys other than ids ( e.g emails ) aren't indexed by the snapshot
+    if self.ra_snapshot is not None and (
+        user_id is None or self.ra_snapshot.has_assignee(user_id)
+    ):
+      return self.ra_snapshot.list_role_assignments(role_id, user_id)
+    if role_id is None and user_id is None:
+      role_assignments = self._list_through(
+          'role_assignment',
+          'roleAssignmentId',
+          self._list_all_role_assignments,
       )
-      dry_run_deleted_ra_ids = {
-          item['roleAssignmentId']
-          for item in self.dry_run_changes.list_deleted_role_assignments()
-      }
-      role_assignments = [
-          ra
-          for ra in role_assignments
-          if ra['roleAssignmentId'] not in dry_run_deleted_ra_ids
-      ]
-    return role_assignments
+    else:
+      role_assignments = self.google_api_client.list_role_assignments(
+          role_id, user_id
+      )
+    return list(
+        self._with_dry_run_changes(role_assignments, role_id, user_id)
+    )
 
   def list_roles(self) -> Sequence[Mapping[str, Any]]:
-    return self.google_api_client.list_roles()
+    return self._list_through(
+        'roles', 'roleId', self.google_api_client.list_roles
+    )
 
   def delete_role_assignment(self, role_assignment_id: str) -> bool:
     if self.is_dry_run():
-      return self.dry_run_changes.delete_role_assignment(role_assignment_id)
+      deleted = self.dry_run_changes.delete_role_assignment(role_assignment_id)
     else:
-      return self.google_api_client.delete_role_assignment(role_assignment_id)
+      deleted = self.google_api_client.delete_role_assignment(
+          role_assignment_id
+      )
+      if self.directory_cache is not None:
+        self.directory_cache.delete('role_assignment', role_assignment_id)
+    if deleted and self.ra_snapshot is not None:
+      self.ra_snapshot.remove(role_assignment_id)
+    return deleted
+
+  def delete_role_assignments(
+      self, role_assignment_ids: Sequence[str]
+  ) -> Mapping[str, bool]:
+    failure = None
+    if self.is_dry_run():
+      results = self.dry_run_changes.delete_role_assignments(
+          role_assignment_ids
+      )
+    else:
+      try:
+        results = self.google_api_client.delete_role_assignments(
+            role_assignment_ids
+        )
+      except change_client_interface.BulkOperationError as e:
+        # The completed deletions are applied before the failure is raised
+        results, failure = e.results, e
+      if self.directory_cache is not None:
+        for role_assignment_id in role_assignment_ids:
+          self.directory_cache.delete('role_assignment', role_assignment_id)
+    if self.ra_snapshot is not None:
+      for role_assignment_id, deleted in results.items():
+        if deleted:
+          self.ra_snapshot.remove(role_assignment_id)
+    if failure is not None:
+      raise failure
+    return results
 
   def insert_member_into_group(
       self, user_email: str, user_id: str, group_email: str
   ) -> None:
-    if self.group_has_member(group_email, user_email):
-      return None
+    # Callers diff the group membership before inserting, an existing member
+    # is handled by the google api client ( 409 ) and dry-run client alike.
     if self.is_dry_run():
       self.dry_run_changes.insert_member_into_group(
           user_email, user_id, group_email
@@ -208,19 +549,67 @@ class MigrationUtilChangeClient(change_client_interface.ChangeClientInterface):
       self.google_api_client.insert_member_into_group(
           user_email, user_id, group_email
       )
+      self._forget_membership_reads(group_email, [user_email])
+
+  def _forget_membership_reads(
+      self, group_email: str, user_emails: Iterable[str]
+  ) -> None:
+    self.in_flight_reads.forget(('members', group_email))
+    for user_email in user_emails:
+      self.in_flight_reads.forget(('member', group_email, user_email))
 
-  def insert_role_assignment(self, role_assignment: Dict[str, Any]) -> None:
+  def insert_members_into_group(
+      self, group_email: str, members: Sequence[Mapping[str, str]]
+  ) -> Mapping[str, bool]:
     if self.is_dry_run():
-      role_assignment['roleAssignmentId'] = 'dummy'
-      self.dry_run_changes.insert_role_assignment(role_assignment)
+      return self.dry_run_changes.insert_members_into_group(
+          group_email, members
+      )
     else:
-      self.google_api_client.insert_role_assignment(role_assignment)
+      try:
+        return self.google_api_client.insert_members_into_group(
+            group_email, members
+        )
+      finally:
+        # Also after a BulkOperationError, some members were inserted
+        self._forget_membership_reads(
+            group_email, [member['email'] for member in members]
+        )
+
+  def insert_role_assignment(
+      self, role_assignment: Dict[str, Any]
+  ) -> Optional[Mapping[str, Any]]:
+    if self.is_dry_run():
+      # Unique ids keep dry-run role-assignments apart in the snapshot
+      role_assignment['roleAssignmentId'] = 'dummy-{}'.format(
+          next(self._dry_run_ra_ids)
+      )
+      inserted_ra = self.dry_run_changes.insert_role_assignment(
+          role_assignment
+      )
+    else:
+      inserted_ra = self.google_api_client.insert_role_assignment(
+          role_assignment
+      )
+      if inserted_ra is not None and self.directory_cache is not None:
+        self.directory_cache.put(
+            'role_assignment', inserted_ra['roleAssignmentId'], inserted_ra
+        )
+    if inserted_ra is not None and self.ra_snapshot is not None:
+      self.ra_snapshot.add(inserted_ra)
+    return inserted_ra
 
   def get_role(self, role_id: str) -> Optional[Mapping[str, Any]]:
-    return self.google_api_client.get_role(role_id=role_id)
+    return self._read_through(
+        'role',
+        role_id,
+        lambda: self.google_api_client.get_role(role_id=role_id),
+    )
 
   def get_customer(self) -> Optional[Mapping[str, Any]]:
-    return self.google_api_client.get_customer()
+    return self._read_through(
+        'customer', 'my_customer', self.google_api_client.get_customer
+    )
   
   def get_primary_email(self) -> str:
     return self.google_api_client.get_primary_email()
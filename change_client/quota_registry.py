@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Registry of the API quota buckets drawn from by each endpoint.
+
+Endpoints sharing a quota ( e.g all Directory API methods count against the
+queries per minute per user quota ) draw from the same token bucket, so that
+together they stay within the quota.
+"""
+
+from typing import Mapping, Optional
+
+from change_client import adaptive_rate_limiter
+
+# Initial calls/second and burst per quota bucket. Rates adapt to quota errors
+# between MIN_REQUESTS_PER_SECOND and MAX_RATE_INCREASE_FACTOR times these.
+QUOTA_BUCKETS = {
+    # Admin SDK Directory API : 2400 queries per minute per user
+    'directory': (40, 40),
+    # Cloud Identity Groups API
+    'cloudidentity': (10, 10),
+    # People API
+    'people': (1, 1),
+}
+MIN_REQUESTS_PER_SECOND = 0.5
+MAX_RATE_INCREASE_FACTOR = 10
+
+ENDPOINT_QUOTA_BUCKETS = {
+    'customers.get': 'directory',
+    'orgunits.get': 'directory',
+    'orgunits.list': 'directory',
+    'users.get': 'directory',
+    'users.list': 'directory',
+    'groups.get': 'directory',
+    'members.get': 'directory',
+    'members.list': 'directory',
+    'members.insert': 'directory',
+    'roles.get': 'directory',
+    'roles.list': 'directory',
+    'roleAssignments.list': 'directory',
+    'roleAssignments.insert': 'directory',
+    'roleAssignments.delete': 'directory',
+    'cloudidentity.groups.create': 'cloudidentity',
+    'people.get': 'people',
+}
+
+
+class QuotaRegistry:
+  """Token buckets per quota bucket, looked up by endpoint."""
+
+  def __init__(
+      self, learned_rates: Optional[Mapping[str, float]] = None
+  ) -> None:
+    learned_rates = learned_rates or {}
+    self.buckets = {
+        name: adaptive_rate_limiter.AdaptiveRateLimiter(
+            name,
+            learned_rates.get(name, rate),
+            MIN_REQUESTS_PER_SECOND,
+            rate * MAX_RATE_INCREASE_FACTOR,
+            burst,
+        )
+        for name, (rate, burst) in QUOTA_BUCKETS.items()
+    }
+
+  def bucket(self, endpoint: str) -> adaptive_rate_limiter.AdaptiveRateLimiter:
+    if endpoint not in ENDPOINT_QUOTA_BUCKETS:
+      raise AssertionError(
+          'Unexpected endpoint without quota bucket : {}'.format(endpoint)
+      )
+    return self.buckets[ENDPOINT_QUOTA_BUCKETS[endpoint]]
+
+  def rates(self) -> Mapping[str, float]:
+    return {name: bucket.rate for name, bucket in self.buckets.items()}
+
+  def learned_rates(self) -> Mapping[str, float]:
+    """Returns the rate of each bucket worth starting the next run at.
+
+    A rate is only trusted up to the one set by the last quota error, or up to
+    the initial rate of the bucket if the quota was never exceeded.
+    """
+    return {
+        name: min(
+            bucket.rate,
+            bucket.confirmed_rate
+            if bucket.confirmed_rate is not None
+            else QUOTA_BUCKETS[name][0],
+        )
+        for name, bucket in self.buckets.items()
+    }
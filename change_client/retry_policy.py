@@ -0,0 +1,198 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Retry policy of the API calls.
+
+Failed calls are classified : exhausted quotas, server errors and transport
+errors are retried, expired credentials are refreshed and every other error
+( bad request, permission denied, not found ... ) fails at once since a retry
+would fail alike. Retries wait the larger of the Retry-After of the error and
+a decorrelated jitter backoff, and draw from a retry budget shared by all
+calls, so that an outage fails the run instead of multiplying its calls.
+"""
+
+import collections
+import email.utils
+import random
+import re
+import threading
+import time
+from typing import Mapping, Optional
+from googleapiclient import errors
+
+MAX_RETRIES = 5
+BASE_DELAY_SECONDS = 1
+MAX_DELAY_SECONDS = 32
+# Status codes of the errors which are retried, besides the 5xx server errors
+RETRYABLE_STATUS_CODES = frozenset([408, 429])
+# Retries available at start, each successful call adds
+# RETRY_BUDGET_PER_SUCCESS up to RETRY_BUDGET_MAX_RETRIES.
+RETRY_BUDGET_MAX_RETRIES = 200
+RETRY_BUDGET_PER_SUCCESS = 0.2
+
+# Classification of a failed call
+RETRY = 'retry'
+REFRESH_CREDENTIALS = 'refresh_credentials'
+FAIL = 'fail'
+
+
+def is_rate_limit_error(e: errors.HttpError) -> bool:
+  """Returns whether the error reports an exhausted quota."""
+  error_code = e.resp.status
+  if error_code == 429:
+    return True
+  content = e.content
+  if isinstance(content, bytes):
+    content = content.decode('utf-8', 'replace')
+  return error_code == 403 and bool(
+      re.search(
+          r'rateLimitExceeded|userRateLimitExceeded|quotaExceeded',
+          '{} {}'.format(e, content),
+      )
+  )
+
+
+def get_retry_after_seconds(e: errors.HttpError) -> Optional[float]:
+  """Returns the delay requested by the Retry-After header, if any."""
+  # httplib2 responses are dicts of lower-cased headers
+  if not isinstance(e.resp, dict) or 'retry-after' not in e.resp:
+    return None
+  retry_after = e.resp['retry-after']
+  try:
+    return max(float(retry_after), 0.0)
+  except ValueError:
+    pass
+  try:
+    retry_at = email.utils.parsedate_to_datetime(retry_after)
+  except (TypeError, ValueError):
+    return None
+  return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+def classify(e: Exception) -> str:
+  """Returns RETRY, REFRESH_CREDENTIALS or FAIL for the error of a call."""
+  if isinstance(e, (TimeoutError, ConnectionError)):
+    # Timed out or dropped connection
+    return RETRY
+  if not isinstance(e, errors.HttpError):
+    return FAIL
+  if e.resp.status == 401:
+    return REFRESH_CREDENTIALS
+  if (
+      e.resp.status in RETRYABLE_STATUS_CODES
+      or e.resp.status >= 500
+      or is_rate_limit_error(e)
+  ):
+    return RETRY
+  return FAIL
+
+
+def get_backoff_seconds(previous_delay: float) -> float:
+  """Returns the next delay of decorrelated jitter backoff.
+
+  Args:
+    previous_delay: The previous delay of the call, 0 before its first retry.
+  """
+  return min(
+      MAX_DELAY_SECONDS,
+      random.uniform(
+          BASE_DELAY_SECONDS, max(previous_delay, BASE_DELAY_SECONDS) * 3
+      ),
+  )
+
+
+class RetryBudget:
+  """Retries available to all calls, refilled by successful calls."""
+
+  def __init__(
+      self,
+      max_retries: float = RETRY_BUDGET_MAX_RETRIES,
+      per_success: float = RETRY_BUDGET_PER_SUCCESS,
+  ):
+    self.max_retries = max_retries
+    self.per_success = per_success
+    self.available = max_retries
+    self._lock = threading.Lock()
+
+  def on_success(self) -> None:
+    with self._lock:
+      self.available = min(self.available + self.per_success, self.max_retries)
+
+  def try_retry(self) -> bool:
+    """Draws a retry from the budget, returns False if none is left."""
+    with self._lock:
+      if self.available < 1:
+        return False
+      self.available -= 1
+      return True
+
+
+class RetryPolicy:
+  """Retry decisions of a client, with retry counts and time lost per endpoint.
+
+  The time lost by a retry is the duration of the failed call and of the
+  wait before its retry.
+  """
+
+  def __init__(self, budget: Optional[RetryBudget] = None):
+    self.budget = budget or RetryBudget()
+    self.retries = collections.Counter()
+    self.seconds_lost = collections.Counter()
+    self.failures = collections.Counter()
+    self._lock = threading.Lock()
+
+  def on_success(self) -> None:
+    self.budget.on_success()
+
+  def get_delay_seconds(
+      self, endpoint: str, e: Exception, previous_delay: float
+  ) -> float:
+    """Returns the wait before retrying the retryable error.
+
+    Raises:
+      RuntimeError: The retry budget is exhausted.
+    """
+    if not self.budget.try_retry():
+      self.on_failure(endpoint)
+      raise RuntimeError(
+          'Retry budget exhausted. The operation failed. {}'.format(e)
+      ) from e
+    delay = get_backoff_seconds(previous_delay)
+    if isinstance(e, errors.HttpError):
+      delay = max(delay, get_retry_after_seconds(e) or 0)
+    return delay
+
+  def on_retry(self, endpoint: str, seconds_lost: float) -> None:
+    with self._lock:
+      self.retries[endpoint] += 1
+      self.seconds_lost[endpoint] += seconds_lost
+
+  def on_failure(self, endpoint: str) -> None:
+    """Records a call failing without retry."""
+    with self._lock:
+      self.failures[endpoint] += 1
+
+  def stats(self) -> Mapping[str, Mapping[str, float]]:
+    """Returns the retries, seconds lost and failures per endpoint."""
+    with self._lock:
+      return {
+          endpoint: {
+              'retries': self.retries[endpoint],
+              'seconds_lost': self.seconds_lost[endpoint],
+              'failures': self.failures[endpoint],
+          }
+          for endpoint in sorted(set(self.retries) | set(self.failures))
+      }
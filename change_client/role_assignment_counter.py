@@ -0,0 +1,89 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental counts of role-assignments per scope and per role-scope.
+
+Role-assignments are counted as they stream in from a paginated listing, so
+that scopes exceeding the per-scope limit are reported while the listing is
+still in progress.
+"""
+import collections
+from typing import Any, Callable, Iterable, Iterator, Mapping, Optional, Tuple
+
+_ORG_UNIT_SCOPE_STRING = 'ORG_UNIT'
+
+# ( scopeType, orgUnitId ) , orgUnitId is '' unless the scope is an org unit
+ScopeKey = Tuple[str, str]
+# ( roleId, scopeType, orgUnitId )
+RoleScopeKey = Tuple[str, str, str]
+
+
+def get_scope_key(role_assignment: Mapping[str, Any]) -> ScopeKey:
+  """Returns the scope of a role-assignment.
+
+  Scopes are told apart as by GbraMigrationUtil.get_scope_name_for_ra : only
+  org-unit scopes by orgUnitId, as role-assignments at the customer scope may
+  carry the id of the root org unit or none.
+  """
+  scope_type = role_assignment.get('scopeType', '')
+  if scope_type == _ORG_UNIT_SCOPE_STRING:
+    return scope_type, role_assignment.get('orgUnitId', '')
+  return scope_type, ''
+
+
+class RoleAssignmentCounter:
+  """Counts role-assignments per scope and per role-scope.
+
+  on_scope_over_limit is called with the scope key and its count once, when
+  the number of role-assignments at the scope first exceeds ra_limit.
+  """
+
+  def __init__(
+      self,
+      ra_limit: int,
+      on_scope_over_limit: Optional[Callable[[ScopeKey, int], None]] = None,
+  ):
+    self.ra_limit = ra_limit
+    self._on_scope_over_limit = on_scope_over_limit
+    self.scope_counts = collections.Counter()
+    self.role_scope_counts = collections.Counter()
+
+  def add(self, role_assignment: Mapping[str, Any]) -> None:
+    scope_key = get_scope_key(role_assignment)
+    role_scope_key = (role_assignment.get('roleId', ''),) + scope_key
+    self.scope_counts[scope_key] += 1
+    self.role_scope_counts[role_scope_key] += 1
+    if (
+        self.scope_counts[scope_key] == self.ra_limit + 1
+        and self._on_scope_over_limit is not None
+    ):
+      self._on_scope_over_limit(scope_key, self.scope_counts[scope_key])
+
+  def counted(
+      self, role_assignments: Iterable[Mapping[str, Any]]
+  ) -> Iterator[Mapping[str, Any]]:
+    """Yields the given role-assignments, counting each one on the way."""
+    for role_assignment in role_assignments:
+      self.add(role_assignment)
+      yield role_assignment
+
+  def scopes_over_limit(self) -> Mapping[ScopeKey, int]:
+    """Returns the count of each scope exceeding ra_limit, largest first."""
+    return collections.OrderedDict(
+        (scope_key, count)
+        for scope_key, count in self.scope_counts.most_common()
+        if count > self.ra_limit
+    )
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-memory snapshot of the customer's role-assignments.
+
+The snapshot is loaded from a single listing of all role-assignments and is
+kept current by applying the role-assignments inserted / deleted by the
+utility as deltas, rather than re-listing them.
+"""
+import collections
+import threading
+from typing import Any, Dict, Iterable, Mapping, Optional, Sequence, Tuple
+
+
+def _scope_key(role_assignment: Mapping[str, Any]) -> Tuple[str, str]:
+  return (
+      role_assignment.get('scopeType', ''),
+      role_assignment.get('orgUnitId', ''),
+  )
+
+
+class RoleAssignmentSnapshot:
+  """Role-assignments indexed by scope, role-scope, role and assignee."""
+
+  def __init__(self, role_assignments: Iterable[Mapping[str, Any]]):
+    # Each index maps its key to role-assignments keyed by roleAssignmentId,
+    # preserving the listing order and allowing constant time removal.
+    self._by_id = {}
+    self._by_scope = collections.defaultdict(dict)
+    self._by_role_scope = collections.defaultdict(dict)
+    self._by_role = collections.defaultdict(dict)
+    self._by_assignee = collections.defaultdict(dict)
+    # Deltas may be applied by concurrent workers
+    self._lock = threading.RLock()
+    for role_assignment in role_assignments:
+      self.add(role_assignment)
+
+  def __len__(self) -> int:
+    return len(self._by_id)
+
+  def _indexes(
+      self, role_assignment: Mapping[str, Any]
+  ) -> Sequence[Tuple[Dict[Any, Dict[str, Mapping[str, Any]]], Any]]:
+    scope_key = _scope_key(role_assignment)
+    return [
+        (self._by_scope, scope_key),
+        (self._by_role_scope, (role_assignment.get('roleId'),) + scope_key),
+        (self._by_role, role_assignment.get('roleId')),
+        (self._by_assignee, role_assignment.get('assignedTo')),
+    ]
+
+  def add(self, role_assignment: Mapping[str, Any]) -> None:
+    """Adds ( or replaces ) the given role-assignment."""
+    ra_id = role_assignment['roleAssignmentId']
+    with self._lock:
+      self.remove(ra_id)
+      self._by_id[ra_id] = role_assignment
+      for index, key in self._indexes(role_assignment):
+        index[key][ra_id] = role_assignment
+
+  def remove(self, role_assignment_id: str) -> bool:
+    """Removes the given role-assignment, returns whether it was present."""
+    with self._lock:
+      role_assignment = self._by_id.pop(role_assignment_id, None)
+      if role_assignment is None:
+        return False
+      for index, key in self._indexes(role_assignment):
+        index[key].pop(role_assignment_id, None)
+        if not index[key]:
+          del index[key]
+      return True
+
+  def get(self, role_assignment_id: str) -> Optional[Mapping[str, Any]]:
+    return self._by_id.get(role_assignment_id)
+
+  def has_assignee(self, assignee_id: str) -> bool:
+    return assignee_id in self._by_assignee
+
+  def list_role_assignments(
+      self, role_id: Optional[str] = None, user_id: Optional[str] = None
+  ) -> Sequence[Mapping[str, Any]]:
+    """Returns role-assignments filtered by role or assignee, like the API."""
+    if role_id is not None and user_id is not None:
+      raise AssertionError(
+          'RoleAssignmentSnapshot.list_role_assignments role_id and user_id'
+          ' may not be both specified'
+      )
+    with self._lock:
+      if role_id is not None:
+        return list(self._by_role.get(role_id, {}).values())
+      if user_id is not None:
+        return list(self._by_assignee.get(user_id, {}).values())
+      return list(self._by_id.values())
+
+  def list_role_assignments_at_scope(
+      self, scope_type: str, org_unit_id: str = ''
+  ) -> Sequence[Mapping[str, Any]]:
+    with self._lock:
+      return list(self._by_scope.get((scope_type, org_unit_id), {}).values())
+
+  def list_role_assignments_at_role_scope(
+      self, role_id: str, scope_type: str, org_unit_id: str = ''
+  ) -> Sequence[Mapping[str, Any]]:
+    with self._lock:
+      return list(
+          self._by_role_scope.get(
+              (role_id, scope_type, org_unit_id), {}
+          ).values()
+      )
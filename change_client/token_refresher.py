@@ -0,0 +1,119 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Background refresh of the oauth token ahead of its expiry.
+
+Oauth tokens expire hourly. Refreshing the token a margin before its expiry,
+off the calling threads, spares the in-flight calls of long phases the failed
+request and retry of a refresh on 401.
+"""
+
+import datetime
+import threading
+import time
+from typing import Any, Callable, Mapping, Optional
+from utils import logger
+
+# Default margin before the token expiry at which it is refreshed.
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+# Delay before checking again when the expiry is unknown or a refresh failed.
+RECHECK_SECONDS = 60
+# Minimum delay between two refreshes, should a token expire within the
+# margin right after its refresh.
+MIN_REFRESH_INTERVAL_SECONDS = 10
+
+
+def _utcnow() -> datetime.datetime:
+  # google-auth credential expiries are naive UTC datetimes
+  return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class TokenRefresher:
+  """Daemon thread calling refresh a margin before the token expiry.
+
+  The refresh latency is logged and kept in the stats, it is only paid by
+  the refresher thread.
+  """
+
+  def __init__(
+      self,
+      get_expiry: Callable[[], Optional[datetime.datetime]],
+      refresh: Callable[[], None],
+      margin_seconds: float = TOKEN_REFRESH_MARGIN_SECONDS,
+  ):
+    self._get_expiry = get_expiry
+    self._refresh = refresh
+    self._margin_seconds = margin_seconds
+    self._stopped = threading.Event()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self.refreshes = 0
+    self.failures = 0
+    self.last_refresh_seconds = 0.0
+    self.max_refresh_seconds = 0.0
+
+  def start(self) -> None:
+    self._thread.start()
+
+  def stop(self) -> None:
+    self._stopped.set()
+    self._thread.join()
+
+  def seconds_until_refresh(self) -> float:
+    """Returns the delay until the token is within the margin of expiry."""
+    expiry = self._get_expiry()
+    if expiry is None:
+      return RECHECK_SECONDS
+    return max(
+        (expiry - _utcnow()).total_seconds() - self._margin_seconds, 0.0
+    )
+
+  def _run(self) -> None:
+    delay = self.seconds_until_refresh()
+    while not self._stopped.wait(delay):
+      if self.seconds_until_refresh() > 0:
+        # Refreshed meanwhile, e.g after a 401
+        delay = self.seconds_until_refresh()
+        continue
+      start_time = time.monotonic()
+      try:
+        self._refresh()
+      except Exception as e:  # pylint: disable=broad-except
+        self.failures += 1
+        logger.Logger.get_instance().log(
+            'Failed to refresh oauth token ahead of expiry , will retry'
+            ' {}'.format(repr(e))
+        )
+        delay = RECHECK_SECONDS
+        continue
+      self.last_refresh_seconds = time.monotonic() - start_time
+      self.max_refresh_seconds = max(
+          self.max_refresh_seconds, self.last_refresh_seconds
+      )
+      self.refreshes += 1
+      logger.Logger.get_instance().debug(
+          'Refreshed oauth token ahead of expiry in {:.2f} seconds'.format(
+              self.last_refresh_seconds
+          )
+      )
+      delay = max(self.seconds_until_refresh(), MIN_REFRESH_INTERVAL_SECONDS)
+
+  def stats(self) -> Mapping[str, Any]:
+    return {
+        'refreshes': self.refreshes,
+        'failures': self.failures,
+        'last_refresh_seconds': self.last_refresh_seconds,
+        'max_refresh_seconds': self.max_refresh_seconds,
+    }
@@ -0,0 +1,50 @@
+from concurrent import futures
+import threading
+import unittest
+from unittest.mock import MagicMock
+from change_client import client_pool
+
+
+class TestClientPool(unittest.TestCase):
+
+  def setUp(self):
+    self.build_client = MagicMock(side_effect=lambda service: MagicMock())
+    self.pool = client_pool.ClientPool(self.build_client)
+
+  def test_clients_kept_per_thread(self):
+    client = self.pool.get('admin_sdk')
+    self.assertIs(self.pool.get('admin_sdk'), client)
+    self.build_client.assert_called_once_with('admin_sdk')
+
+  def test_each_service_built_on_first_use(self):
+    self.pool.get('admin_sdk')
+    self.assertIsNot(self.pool.get('people'), self.pool.get('admin_sdk'))
+    self.assertEqual(self.pool.clients_built, 2)
+
+  def test_each_worker_thread_own_clients(self):
+    both_started = threading.Barrier(2, timeout=5)
+
+    def get_client(_):
+      both_started.wait()
+      return self.pool.get('admin_sdk')
+
+    with futures.ThreadPoolExecutor(max_workers=2) as executor:
+      first, second = executor.map(get_client, range(2))
+    self.assertIsNot(first, second)
+    self.assertEqual(self.pool.clients_built, 2)
+
+  def test_clients_of_exited_threads_reused(self):
+    clients = []
+    for _ in range(50):
+      thread = threading.Thread(
+          target=lambda: clients.append(self.pool.get('admin_sdk'))
+      )
+      thread.start()
+      thread.join()
+    self.assertEqual(self.pool.clients_built, 1)
+    self.assertEqual(self.pool.clients_reused, 49)
+    self.assertEqual(len({id(client) for client in clients}), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,78 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+from google.auth.exceptions import RefreshError
+from google.oauth2 import credentials
+
+sys.modules['google_auth_oauthlib'] = Mock()
+sys.modules['utils.logger'] = Mock()
+
+from utils import credential_store
+from utils.credential_store import CredentialStore
+
+_AUTHORIZED_USER_INFO = {
+    'token': 'token',
+    'refresh_token': 'refresh-token',
+    'client_id': 'client-id',
+    'client_secret': 'client-secret',
+    'expiry': '2999-01-01T00:00:00Z',
+}
+
+
+class TestCredentialStore(unittest.TestCase):
+
+  def setUp(self):
+    self.output_dir = tempfile.TemporaryDirectory()
+    self.token_path = os.path.join(
+        self.output_dir.name, credential_store.OA_TOKEN_FILE_NAME
+    )
+    with open(self.token_path, 'w') as f:
+      json.dump(_AUTHORIZED_USER_INFO, f)
+    self.installed_flow = (
+        credential_store.flow.InstalledAppFlow.from_client_secrets_file
+    )
+    self.installed_flow.reset_mock()
+    self.store = CredentialStore(self.output_dir.name, 'client-secrets')
+
+  def tearDown(self):
+    self.output_dir.cleanup()
+
+  def _saved_token(self):
+    with open(self.token_path, 'r') as f:
+      return json.load(f)['token']
+
+  def test_refresh_replaces_and_saves_token(self):
+    def refresh(creds, request):
+      del request
+      creds.token = 'refreshed'
+
+    with patch.object(
+        credentials.Credentials, 'refresh', autospec=True, side_effect=refresh
+    ):
+      self.store.refresh()
+    self.assertEqual(self.store.get_oauth_token().token, 'refreshed')
+    self.assertEqual(self._saved_token(), 'refreshed')
+    self.installed_flow.assert_not_called()
+
+  def test_refresh_revoked_presents_consent_screen(self):
+    self.installed_flow.return_value.run_local_server.return_value = (
+        credentials.Credentials.from_authorized_user_info(
+            dict(_AUTHORIZED_USER_INFO, token='consented')
+        )
+    )
+    with patch.object(
+        credentials.Credentials,
+        'refresh',
+        side_effect=RefreshError('invalid_grant: Token has been revoked.'),
+    ):
+      self.store.refresh()
+    self.installed_flow.assert_called_once()
+    self.assertEqual(self.store.get_oauth_token().token, 'consented')
+    self.assertEqual(self._saved_token(), 'consented')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,56 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+from utils.directory_cache import DirectoryCache
+
+
+class TestDirectoryCache(unittest.TestCase):
+
+  def setUp(self):
+    self.output_dir = tempfile.TemporaryDirectory()
+    self.cache = DirectoryCache(self.output_dir.name, max_age_seconds=60)
+
+  def tearDown(self):
+    self.output_dir.cleanup()
+
+  def test_get_put_delete(self):
+    self.assertEqual(self.cache.get("user", "u1"), (False, None))
+    self.cache.put("user", "u1", {"id": "1"})
+    self.cache.put("user", "u2", None)
+    self.assertEqual(self.cache.get("user", "u1"), (True, {"id": "1"}))
+    # Not found entities are cached too
+    self.assertEqual(self.cache.get("user", "u2"), (True, None))
+    self.cache.delete("user", "u1")
+    self.assertEqual(self.cache.get("user", "u1"), (False, None))
+
+  def test_persisted_across_instances(self):
+    self.cache.put("group", "g1@example.com", {"id": "g1"})
+    cache = DirectoryCache(self.output_dir.name, max_age_seconds=60)
+    self.assertEqual(cache.get("group", "g1@example.com"), (True, {"id": "g1"}))
+
+  def test_stale_entries_are_misses(self):
+    with patch("utils.directory_cache.time.time", return_value=1000):
+      self.cache.put("role", "r1", {"roleId": "r1"})
+      self.cache.put_all("roles", {"r1": {"roleId": "r1"}})
+    with patch("utils.directory_cache.time.time", return_value=1061):
+      self.assertEqual(self.cache.get("role", "r1"), (False, None))
+      self.assertIsNone(self.cache.get_all("roles"))
+
+  def test_listing_with_deltas(self):
+    self.assertIsNone(self.cache.get_all("role_assignment"))
+    self.cache.put_all(
+        "role_assignment",
+        {"1": {"roleAssignmentId": "1"}, "2": {"roleAssignmentId": "2"}},
+    )
+    self.cache.put("role_assignment", "3", {"roleAssignmentId": "3"})
+    self.cache.delete("role_assignment", "1")
+    self.assertEqual(
+        self.cache.get_all("role_assignment"),
+        [{"roleAssignmentId": "2"}, {"roleAssignmentId": "3"}],
+    )
+    self.cache.put_all("role_assignment", {})
+    self.assertEqual(self.cache.get_all("role_assignment"), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
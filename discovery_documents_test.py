@@ -0,0 +1,78 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import Mock
+import httplib2
+
+sys.modules['utils.logger'] = Mock()
+
+from change_client import discovery_documents
+
+
+def _document(api, version, revision):
+  return {'name': api, 'version': version, 'revision': revision}
+
+
+class TestDiscoveryDocuments(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.cache_dir = os.path.join(self.temp_dir.name, 'discovery_cache')
+    self.fetch = Mock()
+    self.documents = discovery_documents.DiscoveryDocuments(
+        self.cache_dir, self.fetch
+    )
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+
+  def write_cached(self, api, version, content):
+    os.makedirs(self.cache_dir, exist_ok=True)
+    with open(
+        os.path.join(self.cache_dir, '{}.{}.json'.format(api, version)), 'w'
+    ) as f:
+      f.write(content)
+
+  def test_bundled_document_loaded_once(self):
+    content = self.documents.get('admin', 'directory_v1')
+    self.assertEqual(json.loads(content)['name'], 'admin')
+    self.assertIs(self.documents.get('admin', 'directory_v1'), content)
+    self.fetch.assert_not_called()
+
+  def test_newer_cached_revision_preferred(self):
+    self.write_cached(
+        'people', 'v1', json.dumps(_document('people', 'v1', '99991231'))
+    )
+    self.assertEqual(
+        json.loads(self.documents._load('people', 'v1'))['revision'], '99991231'
+    )
+
+  def test_cached_document_of_other_version_ignored(self):
+    self.write_cached(
+        'people', 'v1', json.dumps(_document('people', 'v2', '99991231'))
+    )
+    self.assertNotEqual(
+        json.loads(self.documents._load('people', 'v1'))['revision'], '99991231'
+    )
+
+  def test_fetched_and_cached_when_not_bundled(self):
+    content = json.dumps(_document('unbundled', 'v1', '20230101'))
+    self.fetch.side_effect = [
+        (httplib2.Response({'status': 404}), b'Not found'),
+        (httplib2.Response({'status': 200}), content.encode('utf-8')),
+    ]
+    self.assertEqual(self.documents._load('unbundled', 'v1'), content)
+    # Read from the on-disk cache by later runs
+    later_run = discovery_documents.DiscoveryDocuments(self.cache_dir, Mock())
+    self.assertEqual(later_run._load('unbundled', 'v1'), content)
+
+  def test_no_document_found(self):
+    self.fetch.return_value = (httplib2.Response({'status': 404}), b'')
+    with self.assertRaises(RuntimeError):
+      self.documents._load('unbundled', 'v1')
+
+
+if __name__ == '__main__':
+  unittest.main()
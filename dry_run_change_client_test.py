@@ -40,6 +40,36 @@ class TestDryRunChangeClient(unittest.TestCase):
         any(member["email"] == user_email for member in group_members)
     )
 
+  def test_insert_member_into_group_existing_member_not_duplicated(self):
+    self.client.insert_member_into_group(
+        "user@example.com", "67890", "group@example.com"
+    )
+    self.client.insert_member_into_group(
+        "user@example.com", "67890", "group@example.com"
+    )
+    self.assertEqual(
+        len(self.client.get_group_members("group@example.com")), 1
+    )
+
+  def test_insert_members_into_group(self):
+    self.client.insert_member_into_group(
+        "user1@example.com", "1", "group@example.com"
+    )
+    results = self.client.insert_members_into_group(
+        "group@example.com",
+        [
+            {"email": "user1@example.com", "id": "1"},
+            {"email": "user2@example.com", "id": "2"},
+        ],
+    )
+    self.assertEqual(
+        results, {"user1@example.com": False, "user2@example.com": True}
+    )
+    self.assertEqual(
+        [m["id"] for m in self.client.get_group_members("group@example.com")],
+        ["1", "2"],
+    )
+
   def test_insert_and_delete_role_assignment(self):
     role_assignment = {
         "roleAssignmentId": "123",
@@ -64,6 +94,19 @@ class TestDryRunChangeClient(unittest.TestCase):
     )
     self.assertTrue("123" in self.client.list_deleted_role_assignments())
 
+  def test_delete_role_assignments(self):
+    self.client.insert_role_assignment({"roleAssignmentId": "1"})
+    self.client.insert_role_assignment({"roleAssignmentId": "2"})
+    self.client.insert_role_assignment({"roleAssignmentId": "3"})
+    self.assertEqual(
+        self.client.delete_role_assignments(["1", "3"]), {"1": True, "3": True}
+    )
+    self.assertEqual(
+        [ra["roleAssignmentId"] for ra in self.client.list_role_assignments()],
+        ["2"],
+    )
+    self.assertEqual(self.client.list_deleted_role_assignments(), ["1", "3"])
+
   def test_list_role_assignments_with_role_id(self):
     role_assignment1 = {
         "roleAssignmentId": "1",
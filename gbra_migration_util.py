@@ -19,9 +19,11 @@ from __future__ import print_function
 
 import collections
 import re
-from typing import Any, Dict, List, Mapping, Optional, Sequence
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Set
 
+from change_client import change_client_interface
 from change_client import migration_util_change_client
+import role_scope_planner
 from utils import logger
 
 _ORG_UNIT_SCOPE_STRING = 'ORG_UNIT'
@@ -83,10 +85,19 @@ class MigrationUtility:
       roles_to_skip_gbra: List[int],
       dry_run: bool,
       is_test_env: bool,
+      cache_max_age_hours: Optional[float] = None,
+      ra_listing_workers: int = 1,
+      token_refresh_margin_seconds: Optional[float] = None,
   ):
     self.migration_util_change_util = (
         migration_util_change_client.MigrationUtilChangeClient(
-            output_path, oa_client_id_creds, dry_run, is_test_env
+            output_path,
+            oa_client_id_creds,
+            dry_run,
+            is_test_env,
+            cache_max_age_hours,
+            ra_listing_workers,
+            token_refresh_margin_seconds,
         )
     )
     self.ra_limit = ra_limit
@@ -169,6 +180,13 @@ class MigrationUtility:
         be converted to group-based role-assignments , such that the number of
         role-assignments for the scope falls under the limit.
     """
+    # Resolve the distinct user assignees at the scope in a few batch requests
+    # so that the get_user checks below are served from the user cache.
+    self.migration_util_change_util.get_users([
+        role_assignment['assignedTo']
+        for role_assignment in role_assignments_at_scope
+        if role_assignment.get('assigneeType', None) == 'user'
+    ])
     role_scope_to_ra_map = {}
     for role_assignment in role_assignments_at_scope:
       scope_type = role_assignment['scopeType']
@@ -194,62 +212,70 @@ class MigrationUtility:
       else:
         role_scope_to_ra_map[role_scope].append(role_assignment)
 
-    # Order the map by the number of role-assignments in each scope
-    ordered_ra_scope_to_ra_map = collections.OrderedDict(
-        sorted(
-            role_scope_to_ra_map.items(), key=lambda x: len(x[1]), reverse=True
+    if not filtered:
+      # Order the map by the number of role-assignments in each scope
+      return collections.OrderedDict(
+          sorted(
+              role_scope_to_ra_map.items(),
+              key=lambda x: len(x[1]),
+              reverse=True,
+          )
+      )
+
+    plan = role_scope_planner.plan_role_scopes(
+        {key: len(value) for key, value in role_scope_to_ra_map.items()},
+        len(role_assignments_at_scope),
+        self.ra_limit,
+        self._get_eligible_role_ids(
+            role_scope_to_ra_map, len(role_assignments_at_scope)
+        ),
+        self.roles_to_force_gbra,
+        self.roles_to_skip_gbra,
+    )
+    logger.Logger.get_instance().debug(
+        '... Selected {} of {} role-scopes , reducing the {} role-assignments'
+        ' of the scope by {}'.format(
+            len(plan.selected),
+            len(role_scope_to_ra_map),
+            len(role_assignments_at_scope),
+            plan.reduced_ra_count,
         )
     )
-    if  not filtered:
-      return ordered_ra_scope_to_ra_map
+    return {key: role_scope_to_ra_map[key] for key in plan.selected}
 
-    filtered_role_scope_to_ra_map = {}
-    for key, value in ordered_ra_scope_to_ra_map.items():
-      logger.Logger.get_instance().debug(
-          '..Processing role-scope:{}'.format(key)
-      )
-      # each filtered_role_scope_to_ra_map entry results in the reduction of
-      # Role assignments by len( filtered_role_scope_to_ra_map[RoleScope]) - 1
-      # -1 because one group role-assignment would be created
-      # When the remaining role-assignent count is less than the limit defined
-      # we may safely quit
-      reduced_ra_count_for_scope = sum(
-          len(values) for values in filtered_role_scope_to_ra_map.values()
-      ) - len(filtered_role_scope_to_ra_map)
-
-      remaining_ra_count_for_scope = (
-          len(role_assignments_at_scope) - reduced_ra_count_for_scope
-      )
-      if self.roles_to_force_gbra and int(key.roleId) in self.roles_to_force_gbra:
+  def _get_eligible_role_ids(
+      self,
+      role_scope_to_ra_map: Mapping[RoleScope, Sequence[Mapping[str, Any]]],
+      ra_count: int,
+  ) -> Set[str]:
+    """Returns the ids of the roles of the role-scopes which can be converted.
+
+    Only the roles neither forced nor skipped are checked, and none when the
+    scope is under the limit since only forced role-scopes are then converted.
+    Roles are checked from the listing of all roles , which is cached.
+    """
+    if ra_count < self.ra_limit:
+      return set()
+    roles = {
+        role['roleId']: role
+        for role in self.migration_util_change_util.list_roles()
+    }
+    eligible_role_ids = set()
+    for role_id in dict.fromkeys(key.roleId for key in role_scope_to_ra_map):
+      if self.roles_to_force_gbra and int(role_id) in self.roles_to_force_gbra:
         logger.Logger.get_instance().debug(
             '.. NOT filtering roleId = {} in the list --roles_to_force_gbra'
-            .format(key.roleId)
+            .format(role_id)
         )
-        filtered_role_scope_to_ra_map[key] = value
-        continue
-
-      if self.roles_to_skip_gbra and int(key.roleId) in self.roles_to_skip_gbra:
+      elif self.roles_to_skip_gbra and int(role_id) in self.roles_to_skip_gbra:
         logger.Logger.get_instance().debug(
             '.. FILTERING roleId = {} in the list --roles_to_skip_gbra'.format(
-                key.roleId
-            )
-        )
-        continue
-      if remaining_ra_count_for_scope < self.ra_limit:
-        logger.Logger.get_instance().debug(
-            '... Reached reduction of ras per-scope by ={} for the given scope'
-            ' which started with = {} role-assignments , not adding further'
-            ' role-assignments to map  '.format(
-                remaining_ra_count_for_scope, len(role_assignments_at_scope)
+                role_id
             )
         )
-        continue
-
-      if not self._can_role_be_processed(key.roleId):
-        continue
-
-      filtered_role_scope_to_ra_map[key] = value
-    return filtered_role_scope_to_ra_map
+      elif self._can_role_be_processed(role_id, roles.get(role_id)):
+        eligible_role_ids.add(role_id)
+    return eligible_role_ids
 
   def get_scope_to_ra_map(
       self, filter_under_ra_limit=False, human_readable_scope_name=False
@@ -377,7 +403,17 @@ class MigrationUtility:
                 util_created_sec_groups
             )
         )
+      # Fetch the group membership once and insert only the missing members
+      # rather than probing the membership of each user.
+      group_members = self.migration_util_change_util.get_group_members(
+          group_email
+      )
+      member_ids = {member.get('id') for member in group_members}
+      member_emails = {
+          member.get('email', '').lower() for member in group_members
+      }
       # add the user-role-assignments to the created-security-group
+      members_to_insert = []
       for user_ra in user_ras:
         user = self.migration_util_change_util.get_user(user_ra['assignedTo'])
         logger.Logger.get_instance().debug(
@@ -389,18 +425,36 @@ class MigrationUtility:
           continue
         user_email = user['primaryEmail']
         user_id = user['id']
-        if self.migration_util_change_util.group_has_member(
-            group_email, user_email
-        ):
+        if user_id in member_ids or user_email.lower() in member_emails:
           logger.Logger.get_instance().debug('...Group already has member')
           continue
-        if self.migration_util_change_util.insert_member_into_group(
-            user_email, user_id, group_email
-        ):
-          logger.Logger.get_instance().log_indented(
-              'Inserted user with userEmail={} into group with groupName={}'
-              .format(user_email, group_email)
+        members_to_insert.append({'email': user_email, 'id': user_id})
+        member_ids.add(user_id)
+        member_emails.add(user_email.lower())
+      if not members_to_insert:
+        continue
+      failure = None
+      try:
+        inserted_members = (
+            self.migration_util_change_util.insert_members_into_group(
+                group_email, members_to_insert
+            )
+        )
+      except change_client_interface.BulkOperationError as e:
+        # The completed insertions are logged before the failure is raised
+        inserted_members, failure = e.results, e
+      for user_email, inserted in inserted_members.items():
+        if not inserted:
+          logger.Logger.get_instance().debug(
+              '...Group already has member {}'.format(user_email)
           )
+          continue
+        logger.Logger.get_instance().log_indented(
+            'Inserted user with userEmail={} into group with groupName={}'
+            .format(user_email, group_email)
+        )
+      if failure is not None:
+        raise failure
 
   def make_ra_to_groups(
       self,
@@ -464,11 +518,56 @@ class MigrationUtility:
           )
       )
 
-  def _can_role_be_processed(self, role_id: str) -> bool:
+  def get_role_assignments_at_role_scope(
+      self, role_scope: RoleScope
+  ) -> Sequence[Mapping[str, Any]]:
+    """Lists the current role-assignments at the given role-scope."""
+    return [
+        role_assignment
+        for role_assignment in (
+            self.migration_util_change_util.list_role_assignments(
+                role_scope.roleId, None
+            )
+        )
+        if role_assignment['scopeType'] == role_scope.scopeType
+        # Group role-assignments at the customer scope are made at the root OU
+        and (
+            role_scope.scopeType != _ORG_UNIT_SCOPE_STRING
+            or role_assignment.get('orgUnitId', '') == role_scope.orgUnit
+        )
+    ]
+
+  def migrate_role_scope(
+      self,
+      role_scope: RoleScope,
+      role_assignments: Sequence[Mapping[str, Any]],
+  ) -> None:
+    """Migrates the role-assignments at a role-scope to a group.
+
+    Creates the group for the role-scope, assigns the role to the group and
+    then inserts the user assignees into the group, in that order. Role-scopes
+    are independent of each other and may be migrated concurrently.
+
+    Args:
+        role_scope: The role-scope to be migrated.
+        role_assignments: The role-assignments at the role-scope.
+    """
+    self.create_groups({role_scope: role_assignments})
+    self.make_ra_to_groups({role_scope: role_assignments})
+    # Re-list since the group role-assignment was made above
+    self.add_assignees_to_group_at_scope(
+        role_scope, self.get_role_assignments_at_role_scope(role_scope)
+    )
+
+  def _can_role_be_processed(
+      self, role_id: str, role: Optional[Mapping[str, Any]] = None
+  ) -> bool:
     """Returns whether the given role can be processed.
 
     Args:
         role_id: The ID of the role.
+        role: The role if already fetched , e.g from the listing of all roles.
+          Looked up by role_id otherwise.
 
     Returns:
         True if the role can be processed, False otherwise.
@@ -478,7 +577,8 @@ class MigrationUtility:
         # Check if the role with ID '1234567890' can be processed.
         can_process = _can_role_be_processed('1234567890')
     """
-    role = self.migration_util_change_util.get_role(role_id)
+    if role is None:
+      role = self.migration_util_change_util.get_role(role_id)
 
     if role and role.get('isSuperAdminRole', False):
       logger.Logger.get_instance().debug(
@@ -560,6 +660,7 @@ class MigrationUtility:
               group_email
           )
       )
+      user_ras_to_delete_by_id = {}
       for group_member in group_members:
         user_ras_to_delete = _get_list_of_dicts_matching(
             'assignedTo', group_member['id'], user_ras
@@ -580,11 +681,24 @@ class MigrationUtility:
         # Should have found exactly one duplicate user-role-assignment
         # to be deleted
         user_ra_to_delete = user_ras_to_delete[0]
-
-        self.migration_util_change_util.delete_role_assignment(
-            user_ra_to_delete['roleAssignmentId']
+        user_ras_to_delete_by_id[user_ra_to_delete['roleAssignmentId']] = (
+            user_ra_to_delete
         )
+      if not user_ras_to_delete_by_id:
+        continue
 
+      failure = None
+      try:
+        deleted_ras = self.migration_util_change_util.delete_role_assignments(
+            list(user_ras_to_delete_by_id)
+        )
+      except change_client_interface.BulkOperationError as e:
+        # The completed deletions are logged before the failure is raised
+        deleted_ras, failure = e.results, e
+      for ra_id, deleted in deleted_ras.items():
+        if not deleted:
+          continue
+        user_ra_to_delete = user_ras_to_delete_by_id[ra_id]
         user_ra_to_delete_user = self.migration_util_change_util.get_user(
             user_ra_to_delete['assignedTo']
         )
@@ -603,6 +717,8 @@ class MigrationUtility:
                 user_ra_to_delete_key_or_email, role_scope.roleId, group_email
             )
         )
+      if failure is not None:
+        raise failure
 
   def _delete_dup_ra_to_sa_user(
       self, sa_user_key: str, super_admin_role_id: str
@@ -627,6 +743,7 @@ class MigrationUtility:
     scope_to_ra_exceeding_map = self.get_scope_to_ra_map(
         filter_under_ra_limit=True, human_readable_scope_name=False
     )
+    ras_to_delete_by_id = {}
     for ra_to_sa_user in all_ra_to_sa_user:
       if (
           self.get_scope_name_for_ra(ra_to_sa_user)
@@ -634,26 +751,40 @@ class MigrationUtility:
       ):
         continue
       if ra_to_sa_user['roleId'] != super_admin_role_id:
-        if not self.migration_util_change_util.delete_role_assignment(
-            ra_to_sa_user['roleAssignmentId']
-        ):
-          continue
-        duplicate_role_info = self.migration_util_change_util.get_role(
-            ra_to_sa_user['roleId']
-        )
-        sa_email = self.migration_util_change_util.get_user(sa_user_key)[
-            'primaryEmail'
-        ]
-        logger.Logger.get_instance().log_indented(
-            'Deleted duplicate role-assignment from super-admin-user={} to'
-            ' non-super-admin-role with roleId={} role-name={}'
-            ' role-assignment-id={}'.format(
-                sa_email,
-                duplicate_role_info['roleId'],
-                duplicate_role_info['roleName'],
-                ra_to_sa_user['roleAssignmentId'],
-            )
-        )
+        ras_to_delete_by_id[ra_to_sa_user['roleAssignmentId']] = ra_to_sa_user
+    if not ras_to_delete_by_id:
+      return
+
+    failure = None
+    try:
+      deleted_ras = self.migration_util_change_util.delete_role_assignments(
+          list(ras_to_delete_by_id)
+      )
+    except change_client_interface.BulkOperationError as e:
+      # The completed deletions are logged before the failure is raised
+      deleted_ras, failure = e.results, e
+    for ra_id, deleted in deleted_ras.items():
+      if not deleted:
+        continue
+      ra_to_sa_user = ras_to_delete_by_id[ra_id]
+      duplicate_role_info = self.migration_util_change_util.get_role(
+          ra_to_sa_user['roleId']
+      )
+      sa_email = self.migration_util_change_util.get_user(sa_user_key)[
+          'primaryEmail'
+      ]
+      logger.Logger.get_instance().log_indented(
+          'Deleted duplicate role-assignment from super-admin-user={} to'
+          ' non-super-admin-role with roleId={} role-name={}'
+          ' role-assignment-id={}'.format(
+              sa_email,
+              duplicate_role_info['roleId'],
+              duplicate_role_info['roleName'],
+              ra_to_sa_user['roleAssignmentId'],
+          )
+      )
+    if failure is not None:
+      raise failure
 
   def delete_dup_ra_to_sas(self) -> None:
     """Deletes duplicate role assignments to all super admins."""
@@ -4,6 +4,8 @@ from unittest.mock import ANY, MagicMock, Mock, call
 
 sys.modules["change_client.migration_util_change_client"] = Mock()
 sys.modules["utils.logger"] = Mock()
+from change_client import change_client_interface
+import gbra_migration_util
 from gbra_migration_util import MigrationUtility, RoleScope
 
 ROLE_TO_FORCE_GBRA_1 = 100
@@ -446,42 +448,47 @@ class TestMigrationUtility(unittest.TestCase):
     self.mock_migration_util_change_client.list_role_assignments.return_value = (
         role_assignments
     )
-    self.mock_migration_util_change_client.get_role.return_value = {
+    self.mock_migration_util_change_client.list_roles.return_value = [{
+        "roleId": invalid_role_id,
         "isSuperAdminRole": True,
         "roleName": "SA_ROLE_NAME",
         "rolePrivileges": [{
             "privilegeName": "SA_PRIV1",
             "serviceId": "dummyServiceId",
         }],
-    }
+    }]
     self.assertEqual(self.migration_util.get_rolescope_to_ra_map(), {})
-    self.mock_migration_util_change_client.get_role.return_value = {
+    self.mock_migration_util_change_client.list_roles.return_value = [{
+        "roleId": invalid_role_id,
         "isSuperAdminRole": False,
         "roleName": "_RESELLER_ADMIN_ROLE",
         "rolePrivileges": [{
             "privilegeName": "DEF_PRIV",
             "serviceId": "dummyServiceId",
         }],
-    }
+    }]
     self.assertEqual(self.migration_util.get_rolescope_to_ra_map(), {})
-    self.mock_migration_util_change_client.get_role.return_value = {
+    self.mock_migration_util_change_client.list_roles.return_value = [{
+        "roleId": invalid_role_id,
         "isSuperAdminRole": False,
         "roleName": "_GCP_RESELLER_ADMIN_ROLE",
         "rolePrivileges": [{
             "privilegeName": "DEF_PRIV",
             "serviceId": "dummyServiceId",
         }],
-    }
+    }]
     self.assertEqual(self.migration_util.get_rolescope_to_ra_map(), {})
-    self.mock_migration_util_change_client.get_role.return_value = {
+    self.mock_migration_util_change_client.list_roles.return_value = [{
+        "roleId": invalid_role_id,
         "isSuperAdminRole": False,
         "roleName": "DEF_ROLE",
         "rolePrivileges": [{
             "privilegeName": "MANAGE_HANGOUTS_SERVICE",
             "serviceId": "02w5ecyt3laroi5",
         }],
-    }
+    }]
     self.assertEqual(self.migration_util.get_rolescope_to_ra_map(), {})
+    self.mock_migration_util_change_client.get_role.assert_not_called()
 
   def test_create_groups_ou_scoped(self):
     role_id = "role1"
@@ -673,20 +680,175 @@ class TestMigrationUtility(unittest.TestCase):
         else None
     )
 
+    self.mock_migration_util_change_client.delete_role_assignments.side_effect = (
+        lambda ra_ids: {ra_id: True for ra_id in ra_ids}
+    )
+
     self.migration_util.cleanup_role_assignments(
         input_role_scope, input_role_assignments
     )
-    self.migration_util.migration_util_change_util.delete_role_assignment.assert_has_calls(
-        [
-            call("raId1"),
-            call("raId2"),
-            call("raId3"),
-            call("raId4"),
-            call("raId5"),
-        ],
-        any_order=True,
+    self.migration_util.migration_util_change_util.delete_role_assignments.assert_called_once_with(
+        ["raId1", "raId2", "raId3", "raId4", "raId5"]
+    )
+
+  def test_cleanup_role_assignments_logs_completed_before_failure(self):
+    role_scope = RoleScope(roleId="111", scopeType="ORG_UNIT", orgUnit="222")
+    role_assignments = [
+        {
+            "roleId": "111",
+            "scopeType": "ORG_UNIT",
+            "orgUnitId": "222",
+            "assignedTo": "gaiaUser{}".format(i),
+            "assigneeType": "user",
+            "roleAssignmentId": "raId{}".format(i),
+        }
+        for i in range(1, 3)
+    ] + [{
+        "roleId": "111",
+        "scopeType": "ORG_UNIT",
+        "orgUnitId": "222",
+        "assignedTo": "111-ORG_UNIT-222@domain.com",
+        "assigneeType": "group",
+        "roleAssignmentId": "raId3",
+    }]
+    self.mock_migration_util_change_client.get_group.return_value = {
+        "id": "groupId1",
+        "email": "111-ORG_UNIT-222@domain.com",
+        "name": "111-ORG_UNIT-222",
+    }
+    self.mock_migration_util_change_client.get_group_members.return_value = [
+        {"id": "gaiaUser1"},
+        {"id": "gaiaUser2"},
+    ]
+    self.mock_migration_util_change_client.get_user.side_effect = (
+        lambda user_key: {"primaryEmail": user_key + "@domain.com"}
+    )
+    failure = change_client_interface.BulkOperationError(
+        {"raId1": True}, {"raId2": RuntimeError("Forbidden")}
+    )
+    self.mock_migration_util_change_client.delete_role_assignments.side_effect = (
+        failure
+    )
+    log_indented = (
+        gbra_migration_util.logger.Logger.get_instance().log_indented
+    )
+    log_indented.reset_mock()
+
+    with self.assertRaises(change_client_interface.BulkOperationError):
+      self.migration_util.cleanup_role_assignments(
+          role_scope, role_assignments
+      )
+    logged = " ".join(str(c) for c in log_indented.call_args_list)
+    self.assertIn("gaiaUser1@domain.com", logged)
+    self.assertNotIn("gaiaUser2@domain.com", logged)
+
+  def test_add_assignees_to_group_at_scope_inserts_missing_members(self):
+    input_role_scope = RoleScope(
+        roleId="111", scopeType="ORG_UNIT", orgUnit="222"
+    )
+    input_role_assignments = [
+        {
+            "roleId": "111",
+            "scopeType": "ORG_UNIT",
+            "orgUnitId": "222",
+            "assignedTo": "gaiaUser{}".format(i),
+            "assigneeType": "user",
+            "roleAssignmentId": "raId{}".format(i),
+        }
+        for i in range(1, 4)
+    ] + [{
+        "roleId": "111",
+        "scopeType": "ORG_UNIT",
+        "orgUnitId": "222",
+        "assignedTo": "groupId1",
+        "assigneeType": "group",
+        "roleAssignmentId": "raId4",
+    }]
+    self.mock_migration_util_change_client.get_group.return_value = {
+        "id": "groupId1",
+        "email": "111-ORG_UNIT-222@domain.com",
+        "name": "111-ORG_UNIT-222",
+    }
+    self.mock_migration_util_change_client.get_user.side_effect = (
+        lambda user_key: {
+            "id": user_key,
+            "primaryEmail": user_key + "@domain.com",
+        }
+    )
+    self.mock_migration_util_change_client.get_group_members.return_value = [
+        {"id": "gaiaUser1", "email": "gaiauser1@domain.com"},
+        {"id": "otherId", "email": "gaiaUser2@domain.com"},
+    ]
+
+    self.mock_migration_util_change_client.insert_members_into_group.return_value = {
+        "gaiaUser3@domain.com": True
+    }
+
+    self.migration_util.add_assignees_to_group_at_scope(
+        input_role_scope, input_role_assignments
+    )
+    self.mock_migration_util_change_client.get_group_members.assert_called_once_with(
+        "111-ORG_UNIT-222@domain.com"
+    )
+    self.mock_migration_util_change_client.group_has_member.assert_not_called()
+    self.mock_migration_util_change_client.insert_member_into_group.assert_not_called()
+    self.mock_migration_util_change_client.insert_members_into_group.assert_called_once_with(
+        "111-ORG_UNIT-222@domain.com",
+        [{"email": "gaiaUser3@domain.com", "id": "gaiaUser3"}],
     )
 
+  def test_add_assignees_to_group_logs_completed_before_failure(self):
+    role_scope = RoleScope(roleId="111", scopeType="ORG_UNIT", orgUnit="222")
+    role_assignments = [
+        {
+            "roleId": "111",
+            "scopeType": "ORG_UNIT",
+            "orgUnitId": "222",
+            "assignedTo": "gaiaUser{}".format(i),
+            "assigneeType": "user",
+            "roleAssignmentId": "raId{}".format(i),
+        }
+        for i in range(1, 3)
+    ] + [{
+        "roleId": "111",
+        "scopeType": "ORG_UNIT",
+        "orgUnitId": "222",
+        "assignedTo": "groupId1",
+        "assigneeType": "group",
+        "roleAssignmentId": "raId3",
+    }]
+    self.mock_migration_util_change_client.get_group.return_value = {
+        "id": "groupId1",
+        "email": "111-ORG_UNIT-222@domain.com",
+        "name": "111-ORG_UNIT-222",
+    }
+    self.mock_migration_util_change_client.get_user.side_effect = (
+        lambda user_key: {
+            "id": user_key,
+            "primaryEmail": user_key + "@domain.com",
+        }
+    )
+    self.mock_migration_util_change_client.get_group_members.return_value = []
+    failure = change_client_interface.BulkOperationError(
+        {"gaiaUser1@domain.com": True},
+        {"gaiaUser2@domain.com": RuntimeError("Forbidden")},
+    )
+    self.mock_migration_util_change_client.insert_members_into_group.side_effect = (
+        failure
+    )
+    log_indented = (
+        gbra_migration_util.logger.Logger.get_instance().log_indented
+    )
+    log_indented.reset_mock()
+
+    with self.assertRaises(change_client_interface.BulkOperationError):
+      self.migration_util.add_assignees_to_group_at_scope(
+          role_scope, role_assignments
+      )
+    logged = " ".join(str(c) for c in log_indented.call_args_list)
+    self.assertIn("gaiaUser1@domain.com", logged)
+    self.assertNotIn("gaiaUser2@domain.com", logged)
+
   def test_delete_dup_ra_to_sas(
       self,
   ):
@@ -770,10 +932,13 @@ class TestMigrationUtility(unittest.TestCase):
         if args == "OU1"
         else None
     )
+    self.migration_util.migration_util_change_util.delete_role_assignments.side_effect = (
+        lambda ra_ids: {ra_id: True for ra_id in ra_ids}
+    )
     self.migration_util.delete_dup_ra_to_sas()
 
-    self.migration_util.migration_util_change_util.delete_role_assignment.assert_has_calls(
-        [call("2")], any_order=True
+    self.migration_util.migration_util_change_util.delete_role_assignments.assert_called_once_with(
+        ["2"]
     )
 
   def test_scope_to_ra_map(
@@ -999,6 +1164,7 @@ class TestMigrationUtility(unittest.TestCase):
     self.migration_util.delete_dup_ra_to_sas()
 
     self.migration_util.migration_util_change_util.delete_role_assignment.assert_not_called()
+    self.migration_util.migration_util_change_util.delete_role_assignments.assert_not_called()
 
   def test_create_groups_customer_scoped_ra_to_group_exists(self):
     input_role_map = {
@@ -1055,6 +1221,8 @@ class TestMigrationUtility(unittest.TestCase):
     )
     filtered_map = self.migration_util.get_rolescope_to_ra_map()
     self.assertEqual(filtered_map, {})
+    # Roles are not checked for scopes under the limit
+    self.mock_migration_util_change_client.get_role.assert_not_called()
 
   def test_get_rolescope_to_ra_map_gt_limit(self):
     self.maxDiff = None
@@ -1099,6 +1267,12 @@ class TestMigrationUtility(unittest.TestCase):
     self.mock_migration_util_change_client.list_role_assignments.return_value = (
         role_assignments
     )
+    self.mock_migration_util_change_client.list_roles.return_value = [{
+        "roleId": "111",
+        "isSuperAdminRole": False,
+        "roleName": "DEFAULT_ROLE",
+        "rolePrivileges": [],
+    }]
     filtered_map = self.migration_util.get_rolescope_to_ra_map()
     self.assertEqual(
         filtered_map,
@@ -1108,6 +1282,33 @@ class TestMigrationUtility(unittest.TestCase):
             ): role_assignments
         },
     )
+    # Eligibility is checked from the listing of the roles
+    self.mock_migration_util_change_client.get_role.assert_not_called()
+
+  def test_get_rolescope_to_ra_map_resolves_users_in_bulk(self):
+    role_assignments = [
+        {
+            "roleId": "111",
+            "scopeType": "ORG_UNIT",
+            "orgUnitId": "OU1",
+            "assignedTo": "gaiaUser{}".format(i),
+            "assigneeType": "user",
+        }
+        for i in range(6)
+    ] + [{
+        "roleId": "111",
+        "scopeType": "ORG_UNIT",
+        "orgUnitId": "OU1",
+        "assignedTo": "group1",
+        "assigneeType": "group",
+    }]
+    self.mock_migration_util_change_client.list_role_assignments.return_value = (
+        role_assignments
+    )
+    self.migration_util.get_rolescope_to_ra_map()
+    self.mock_migration_util_change_client.get_users.assert_called_once_with(
+        ["gaiaUser{}".format(i) for i in range(6)]
+    )
 
   def test_principal_is_super_admin(self):
     self.mock_migration_util_change_client.get_primary_email.return_value = (
@@ -1145,6 +1346,57 @@ class TestMigrationUtility(unittest.TestCase):
     result = self.migration_util.check_principal_is_super_admin()
     self.assertFalse(result)
 
+  def test_get_role_assignments_at_role_scope(self):
+    self.mock_migration_util_change_client.list_role_assignments.return_value = [
+        {"roleAssignmentId": "1", "scopeType": "ORG_UNIT", "orgUnitId": "222"},
+        {"roleAssignmentId": "2", "scopeType": "ORG_UNIT", "orgUnitId": "333"},
+        {"roleAssignmentId": "3", "scopeType": "CUSTOMER"},
+        {"roleAssignmentId": "4", "scopeType": "CUSTOMER", "orgUnitId": "root"},
+    ]
+    ou_ras = self.migration_util.get_role_assignments_at_role_scope(
+        RoleScope(roleId="111", scopeType="ORG_UNIT", orgUnit="222")
+    )
+    customer_ras = self.migration_util.get_role_assignments_at_role_scope(
+        RoleScope(roleId="111", scopeType="CUSTOMER", orgUnit="")
+    )
+    self.assertEqual([ra["roleAssignmentId"] for ra in ou_ras], ["1"])
+    self.assertEqual(
+        [ra["roleAssignmentId"] for ra in customer_ras], ["3", "4"]
+    )
+    self.mock_migration_util_change_client.list_role_assignments.assert_called_with(
+        "111", None
+    )
+
+  def test_migrate_role_scope_in_order(self):
+    role_scope = RoleScope(roleId="111", scopeType="ORG_UNIT", orgUnit="222")
+    role_assignments = [{"roleAssignmentId": "1"}]
+    current_role_assignments = [
+        {"roleAssignmentId": "1"},
+        {"roleAssignmentId": "2"},
+    ]
+    steps = MagicMock()
+    self.migration_util.create_groups = steps.create_groups
+    self.migration_util.make_ra_to_groups = steps.make_ra_to_groups
+    self.migration_util.get_role_assignments_at_role_scope = MagicMock(
+        return_value=current_role_assignments
+    )
+    self.migration_util.add_assignees_to_group_at_scope = (
+        steps.add_assignees_to_group_at_scope
+    )
+
+    self.migration_util.migrate_role_scope(role_scope, role_assignments)
+
+    self.assertEqual(
+        steps.mock_calls,
+        [
+            call.create_groups({role_scope: role_assignments}),
+            call.make_ra_to_groups({role_scope: role_assignments}),
+            call.add_assignees_to_group_at_scope(
+                role_scope, current_role_assignments
+            ),
+        ],
+    )
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -1,18 +1,51 @@
+from concurrent import futures
+import re
 import sys
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import MagicMock, Mock, call
+from unittest.mock import MagicMock, Mock, call, patch
+from google.oauth2 import credentials as oauth2_credentials
 from googleapiclient import errors
+import httplib2
 import pytest
 
 sys.modules['google_auth_oauthlib'] = Mock()
 sys.modules['utils.logger'] = Mock()
 sys.modules['utils.credential_store'] = Mock()
 
+from change_client import change_client_interface
+from change_client import google_api_client
+from change_client import quota_registry
+from change_client import retry_policy
 from change_client.google_api_client import GoogleApiClient
 
 
+class FakeBatchHttpRequest:
+  """Executes the added requests in order, reporting to the batch callback."""
+
+  def __init__(self, callback):
+    self._callback = callback
+    self._requests = []
+
+  def add(self, request, request_id=None):
+    self._requests.append((request_id, request))
+
+  def execute(self):
+    for request_id, request in self._requests:
+      try:
+        response, exception = request.execute(), None
+      except errors.HttpError as e:
+        response, exception = None, e
+      self._callback(request_id, response, exception)
+
+
 class TestGoogleApiClient(unittest.TestCase):
 
+  def assertLen(self, container, expected_len):
+    self.assertEqual(len(container), expected_len)
+
   def setUp(self):
     self.client = GoogleApiClient(
         output_path='output',
@@ -37,7 +70,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_admin_sdk_client = MagicMock()
     mock_users = MagicMock()
     mock_get = MagicMock()
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.users.return_value = mock_users
     mock_users.get.return_value = mock_get
     mock_get.execute.side_effect = errors.HttpError(
@@ -50,7 +85,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_admin_sdk_client = MagicMock()
     mock_users = MagicMock()
     mock_get = MagicMock()
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.users.return_value = mock_users
     mock_users.get.return_value = mock_get
     with pytest.raises(RuntimeError):
@@ -60,32 +97,124 @@ class TestGoogleApiClient(unittest.TestCase):
       result = self.client.get_user('user@example.com')
     self.assert_mock_retries_n_times(mock_get)
 
+  def mock_batched_users_get(self, user_get):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    batches = []
+
+    def new_batch_http_request(callback):
+      batches.append(FakeBatchHttpRequest(callback))
+      return batches[-1]
+
+    mock_admin_sdk_client.new_batch_http_request.side_effect = (
+        new_batch_http_request
+    )
+    mock_admin_sdk_client.users.return_value.get.side_effect = (
+        lambda userKey, fields: Mock(execute=lambda: user_get(userKey))
+    )
+    return batches
+
+  def test_get_users_404_returned_as_none(self):
+    def user_get(user_key):
+      if user_key == 'missing':
+        raise errors.HttpError(Mock(status=404), 'Not found'.encode('utf-8'))
+      return {'id': user_key, 'primaryEmail': user_key + '@example.com'}
+
+    batches = self.mock_batched_users_get(user_get)
+    result = self.client.get_users(['user1', 'missing', 'user2'])
+    self.assertEqual(
+        result,
+        {
+            'user1': {'id': 'user1', 'primaryEmail': 'user1@example.com'},
+            'missing': None,
+            'user2': {'id': 'user2', 'primaryEmail': 'user2@example.com'},
+        },
+    )
+    self.assertLen(batches, 1)
+
+  def test_get_users_split_into_batches(self):
+    batches = self.mock_batched_users_get(lambda user_key: {'id': user_key})
+    user_keys = [
+        'user{}'.format(i) for i in range(2 * google_api_client.BATCH_SIZE + 1)
+    ]
+    result = self.client.get_users(user_keys)
+    self.assertEqual(list(result.keys()), user_keys)
+    self.assertLen(batches, 3)
+
+  def test_get_users_item_error_retried(self):
+    failures = {'user2': 1}
+
+    def user_get(user_key):
+      if failures.get(user_key):
+        failures[user_key] -= 1
+        raise errors.HttpError(Mock(status=503), 'Unavailable'.encode('utf-8'))
+      return {'id': user_key}
+
+    batches = self.mock_batched_users_get(user_get)
+    result = self.client.get_users(['user1', 'user2'])
+    self.assertEqual(
+        result, {'user1': {'id': 'user1'}, 'user2': {'id': 'user2'}}
+    )
+    # Only the failed item is re-sent in the second batch
+    self.assertLen(batches, 2)
+    self.assertLen(batches[1]._requests, 1)
+
+  def test_list_users_pagination(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    mock_list = mock_admin_sdk_client.users.return_value.list
+    mock_list.return_value.execute.side_effect = [
+        {
+            'users': [{'id': 'user1', 'primaryEmail': 'user1@example.com'}],
+            'nextPageToken': 'next_page',
+        },
+        {'users': [{'id': 'user2', 'primaryEmail': 'user2@example.com'}]},
+    ]
+    users = self.client.list_users()
+    self.assertEqual(
+        users,
+        [
+            {'id': 'user1', 'primaryEmail': 'user1@example.com'},
+            {'id': 'user2', 'primaryEmail': 'user2@example.com'},
+        ],
+    )
+    self.assertEqual(
+        mock_list.call_args.kwargs['fields'],
+        'nextPageToken,users(id,primaryEmail)',
+    )
+
   def test_get_group_credential_expired_retry_once_nothrow(self):
     mock_admin_sdk_client = MagicMock()
     mock_groups = MagicMock()
     mock_get = MagicMock()
-    mock_reauth_and_refresh_clients = MagicMock()
+    mock_refresh_credentials = MagicMock()
     self.client.get_admin_sdk_client = MagicMock(
         return_value=mock_admin_sdk_client
     )
-    self.client.reauth_and_refresh_clients = mock_reauth_and_refresh_clients
+    self.client.refresh_credentials = mock_refresh_credentials
     mock_admin_sdk_client.groups.return_value = mock_groups
     mock_groups.get.return_value = mock_get
     # mock substution is lost in retry_with_credential_refresh
-    # instead test that at least reauth_and_refresh_clients invoked
+    # instead test that at least refresh_credentials invoked
     mock_get.execute.side_effect = [
         errors.HttpError(Mock(status=401), 'Group not found'.encode('utf-8')),
         None,
     ]
     result = self.client.get_group('group@example.com')
-    mock_reauth_and_refresh_clients.assert_called_once()
+    mock_refresh_credentials.assert_called_once_with(0)
 
   def test_group_has_member_found(self):
     mock_admin_sdk_client = MagicMock()
     mock_members = MagicMock()
     mock_get = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.members.return_value = mock_members
     mock_members.get.return_value = mock_get
     mock_get.execute.return_value = {
@@ -105,7 +234,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_members = MagicMock()
     mock_get = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.members.return_value = mock_members
     mock_members.get.return_value = mock_get
     mock_get.execute.side_effect = errors.HttpError(
@@ -122,7 +253,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_members = MagicMock()
     mock_get = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.members.return_value = mock_members
     mock_members.get.return_value = mock_get
 
@@ -138,7 +271,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_members = MagicMock()
     mock_list = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.members.return_value = mock_members
     mock_members.list.return_value = mock_list
     mock_list.execute.return_value = {
@@ -157,7 +292,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_admin_sdk_client = MagicMock()
     mock_members = MagicMock()
     mock_list = MagicMock()
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.members.return_value = mock_members
     mock_members.list.return_value = mock_list
     mock_list.execute.return_value = {}
@@ -170,7 +307,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_members = MagicMock()
     mock_list = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.members.return_value = mock_members
     mock_members.list.return_value = mock_list
 
@@ -296,7 +435,9 @@ class TestGoogleApiClient(unittest.TestCase):
         'items': [{'roleId': 'role1', 'assignedTo': 'user@example.com'}]
     }
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.list.return_value.execute.return_value = (
         role_assignments_response
@@ -311,7 +452,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_role_assignments = MagicMock()
     role_assignments_response = {'items': [{'roleId': 'role1'}]}
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.list.return_value.execute.return_value = (
         role_assignments_response
@@ -325,7 +468,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_role_assignments = MagicMock()
     role_assignments_response = {'items': [{'assignedTo': 'user@example.com'}]}
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.list.return_value.execute.return_value = (
         role_assignments_response
@@ -339,7 +484,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_role_assignments = MagicMock()
     role_assignments_response = {}
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.list.return_value.execute.return_value = (
         role_assignments_response
@@ -353,7 +500,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_role_assignments = MagicMock()
     mock_execute = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.list.return_value = mock_execute
     mock_execute.execute.side_effect = errors.HttpError(
@@ -362,14 +511,16 @@ class TestGoogleApiClient(unittest.TestCase):
 
     with pytest.raises(RuntimeError):
       self.client.list_role_assignments()
-    self.assert_mock_retries_n_times(mock_execute)
+    mock_execute.execute.assert_called_once()
 
   def test_list_role_assignments_not_found(self):
     mock_admin_sdk_client = MagicMock()
     mock_role_assignments = MagicMock()
     mock_execute = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.list.return_value = mock_execute
     mock_execute.execute.side_effect = errors.HttpError(
@@ -378,7 +529,7 @@ class TestGoogleApiClient(unittest.TestCase):
 
     with pytest.raises(RuntimeError):
       self.client.list_role_assignments()
-    self.assert_mock_retries_n_times(mock_execute)
+    mock_execute.execute.assert_called_once()
 
   def test_list_role_assignments_paginated_response(self):
     mock_admin_sdk_client = MagicMock()
@@ -391,7 +542,9 @@ class TestGoogleApiClient(unittest.TestCase):
         'items': [{'roleId': 'role2', 'assignedTo': 'user2@example.com'}]
     }
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.list.side_effect = [
         Mock(execute=Mock(return_value=first_page_response)),
@@ -404,11 +557,142 @@ class TestGoogleApiClient(unittest.TestCase):
     )
     self.assertEqual(assignments, combined_response)
 
+  def test_list_role_assignments_by_role(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    pages = {
+        ('role1', None): {
+            'items': [{'roleAssignmentId': '1', 'roleId': 'role1'}],
+            'nextPageToken': 'role1-page2',
+        },
+        ('role1', 'role1-page2'): {
+            'items': [{'roleAssignmentId': '2', 'roleId': 'role1'}]
+        },
+        ('role2', None): {
+            'items': [{'roleAssignmentId': '3', 'roleId': 'role2'}]
+        },
+        ('role3', None): {},
+    }
+
+    def list_role_assignments(customer, roleId, pageToken, maxResults, fields):
+      del customer, maxResults, fields
+      return Mock(execute=Mock(return_value=pages[(roleId, pageToken)]))
+
+    mock_admin_sdk_client.roleAssignments.return_value.list.side_effect = (
+        list_role_assignments
+    )
+
+    assignments = self.client.list_role_assignments_by_role(
+        ['role1', 'role2', 'role3'], max_workers=3
+    )
+    self.assertEqual(
+        [ra['roleAssignmentId'] for ra in assignments], ['1', '2', '3']
+    )
+
+  def test_iter_users_streams_pages(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    mock_list = mock_admin_sdk_client.users.return_value.list
+    mock_list.return_value.execute.side_effect = [
+        {'users': [{'id': '1'}], 'nextPageToken': 'page2'},
+        {'users': [{'id': '2'}]},
+    ]
+    users = self.client.iter_users()
+    self.assertEqual(next(users), {'id': '1'})
+    # The second page is only fetched once the first one is consumed
+    self.assertEqual(mock_list.return_value.execute.call_count, 1)
+    self.assertEqual(list(users), [{'id': '2'}])
+
+  def test_iter_role_assignments_pipelined(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    mock_list = mock_admin_sdk_client.roleAssignments.return_value.list
+    second_page_requested = threading.Event()
+
+    def execute_second_page():
+      second_page_requested.set()
+      return {'items': [{'roleAssignmentId': '2'}]}
+
+    responses = [
+        lambda: {
+            'items': [{'roleAssignmentId': '1'}],
+            'nextPageToken': 'page2',
+        },
+        execute_second_page,
+    ]
+    mock_list.return_value.execute.side_effect = lambda: responses.pop(0)()
+
+    role_assignments = self.client.iter_role_assignments()
+    self.assertEqual(next(role_assignments), {'roleAssignmentId': '1'})
+    # The second page is requested while the first one is being processed
+    self.assertTrue(second_page_requested.wait(timeout=5))
+    self.assertEqual(list(role_assignments), [{'roleAssignmentId': '2'}])
+
+  def test_prefetched_buffer_bounded(self):
+    produced = []
+
+    def items():
+      for i in range(10):
+        produced.append(i)
+        yield i
+
+    prefetched = google_api_client._prefetched(items(), 2)
+    self.assertEqual(next(prefetched), 0)
+    time.sleep(0.2)
+    # One item consumed, two buffered and one blocked on the full buffer
+    self.assertLessEqual(len(produced), 4)
+    prefetched.close()
+
+  def test_prefetched_error_raised_to_consumer(self):
+    def items():
+      yield 1
+      raise RuntimeError('Max retries exceeded. The operation failed.')
+
+    prefetched = google_api_client._prefetched(items(), 2)
+    self.assertEqual(next(prefetched), 1)
+    with self.assertRaises(RuntimeError):
+      next(prefetched)
+
+  def test_reads_request_partial_responses(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    mock_ra_list = mock_admin_sdk_client.roleAssignments.return_value.list
+    mock_ra_list.return_value.execute.return_value = {}
+    self.client.get_user('user@example.com')
+    self.client.get_group('group@example.com')
+    self.client.get_role('role')
+    self.client.list_role_assignments(role_id='role')
+    mock_admin_sdk_client.users.return_value.get.assert_called_with(
+        userKey='user@example.com', fields='id,primaryEmail'
+    )
+    mock_admin_sdk_client.groups.return_value.get.assert_called_with(
+        groupKey='group@example.com', fields='id,email,name'
+    )
+    self.assertIn(
+        'rolePrivileges(privilegeName,serviceId)',
+        mock_admin_sdk_client.roles.return_value.get.call_args.kwargs['fields'],
+    )
+    self.assertEqual(
+        mock_ra_list.call_args.kwargs['fields'],
+        'nextPageToken,items(roleAssignmentId,roleId,assignedTo,assigneeType,'
+        'scopeType,orgUnitId)',
+    )
+
   def test_delete_role_assignment_success(self):
     mock_admin_sdk_client = MagicMock()
     mock_role_assignments = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.delete.return_value.execute.return_value = None
 
@@ -432,7 +716,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_role_assignments = MagicMock()
     mock_execute = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.delete.return_value = mock_execute
     mock_execute.execute.side_effect = errors.HttpError(
@@ -445,7 +731,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_role_assignments = MagicMock()
     mock_execute = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.delete.return_value = mock_execute
     mock_execute.execute.side_effect = errors.HttpError(
@@ -458,7 +746,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_role_assignments = MagicMock()
     mock_execute = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.delete.return_value = mock_execute
     mock_execute.execute.side_effect = errors.HttpError(
@@ -467,14 +757,16 @@ class TestGoogleApiClient(unittest.TestCase):
 
     with pytest.raises(RuntimeError):
       self.client.delete_role_assignment('role_assignment_id_1')
-    self.assertFalse(self.assert_mock_retries_n_times(mock_execute))
+    mock_execute.execute.assert_called_once()
 
   def test_delete_role_assignment_generic_error(self):
     mock_admin_sdk_client = MagicMock()
     mock_role_assignments = MagicMock()
     mock_execute = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.roleAssignments.return_value = mock_role_assignments
     mock_role_assignments.delete.return_value = mock_execute
     mock_execute.execute.side_effect = errors.HttpError(
@@ -489,7 +781,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_admin_sdk_client = MagicMock()
     mock_members = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.members.return_value = mock_members
     mock_members.insert.return_value.execute.return_value = None
 
@@ -519,7 +813,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_members = MagicMock()
     mock_execute = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.members.return_value = mock_members
     mock_members.insert.return_value = mock_execute
     mock_execute.execute.side_effect = errors.HttpError(
@@ -535,7 +831,9 @@ class TestGoogleApiClient(unittest.TestCase):
     mock_members = MagicMock()
     mock_execute = MagicMock()
 
-    self.client._adminsdk_client = mock_admin_sdk_client
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
     mock_admin_sdk_client.members.return_value = mock_members
     mock_members.insert.return_value = mock_execute
     mock_execute.execute.side_effect = errors.HttpError(
@@ -548,5 +846,472 @@ class TestGoogleApiClient(unittest.TestCase):
       )
     self.assert_mock_retries_n_times(mock_execute)
 
+  def test_insert_members_into_group_batched(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    batches = []
+
+    def new_batch_http_request(callback):
+      batches.append(FakeBatchHttpRequest(callback))
+      return batches[-1]
+
+    def member_insert(groupKey, body):
+      if body['email'] == 'member@example.com':
+        return Mock(
+            execute=Mock(
+                side_effect=errors.HttpError(
+                    Mock(status=409), 'Conflict'.encode('utf-8')
+                )
+            )
+        )
+      return Mock(execute=Mock(return_value=body))
+
+    mock_admin_sdk_client.new_batch_http_request.side_effect = (
+        new_batch_http_request
+    )
+    mock_admin_sdk_client.members.return_value.insert.side_effect = (
+        member_insert
+    )
+    results = self.client.insert_members_into_group(
+        'group@example.com',
+        [
+            {'email': 'member@example.com', 'id': '1'},
+            {'email': 'user@example.com', 'id': '2'},
+        ],
+    )
+    self.assertEqual(
+        results, {'member@example.com': False, 'user@example.com': True}
+    )
+    self.assertLen(batches, 1)
+
+  def test_insert_members_into_group_failure_reported_with_completed(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    mock_admin_sdk_client.new_batch_http_request.side_effect = (
+        FakeBatchHttpRequest
+    )
+
+    def insert(groupKey, body):
+      del groupKey
+      request = Mock()
+      if body['email'] == 'forbidden@example.com':
+        request.execute.side_effect = errors.HttpError(
+            Mock(status=403), 'Forbidden Action'.encode('utf-8')
+        )
+      else:
+        request.execute.return_value = {}
+      return request
+
+    mock_admin_sdk_client.members.return_value.insert.side_effect = insert
+    with self.assertRaises(change_client_interface.BulkOperationError) as raised:
+      self.client.insert_members_into_group(
+          'group@example.com',
+          [
+              {'email': 'forbidden@example.com', 'id': 'u1'},
+              {'email': 'user@example.com', 'id': 'u2'},
+          ],
+      )
+    self.assertEqual(raised.exception.results, {'user@example.com': True})
+    self.assertEqual(
+        list(raised.exception.failures), ['forbidden@example.com']
+    )
+
+  def test_insert_members_into_group_dry_run(self):
+    self.client.is_dry_run = True
+    with pytest.raises(AssertionError):
+      self.client.insert_members_into_group(
+          'group@example.com', [{'email': 'user@example.com', 'id': '1'}]
+      )
+
+  def test_delete_role_assignments_batched(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    mock_admin_sdk_client.new_batch_http_request.side_effect = (
+        FakeBatchHttpRequest
+    )
+    delete_errors = {
+        'missing': errors.HttpError(
+            Mock(status=404), 'Not Found'.encode('utf-8')
+        ),
+        'self': errors.HttpError(
+            Mock(status=403), 'AdminSelfRevokeNotAllowed'.encode('utf-8')
+        ),
+    }
+
+    def ra_delete(customer, roleAssignmentId):
+      if roleAssignmentId in delete_errors:
+        return Mock(
+            execute=Mock(side_effect=delete_errors[roleAssignmentId])
+        )
+      return Mock(execute=Mock(return_value=''))
+
+    mock_admin_sdk_client.roleAssignments.return_value.delete.side_effect = (
+        ra_delete
+    )
+    results = self.client.delete_role_assignments(['ra1', 'missing', 'self'])
+    self.assertEqual(results, {'ra1': True, 'missing': False, 'self': False})
+
+  def test_delete_role_assignments_forbidden_not_retried(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    mock_admin_sdk_client.new_batch_http_request.side_effect = (
+        FakeBatchHttpRequest
+    )
+    mock_execute = MagicMock()
+    mock_execute.execute.side_effect = errors.HttpError(
+        Mock(status=403), 'Forbidden Action'.encode('utf-8')
+    )
+    mock_admin_sdk_client.roleAssignments.return_value.delete.return_value = (
+        mock_execute
+    )
+    with pytest.raises(RuntimeError):
+      self.client.delete_role_assignments(['ra1'])
+    mock_execute.execute.assert_called_once()
+
+  def test_delete_role_assignments_failure_reported_with_completed(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    mock_admin_sdk_client.new_batch_http_request.side_effect = (
+        FakeBatchHttpRequest
+    )
+
+    def delete(customer, roleAssignmentId):
+      del customer
+      request = Mock()
+      if roleAssignmentId == 'forbidden':
+        request.execute.side_effect = errors.HttpError(
+            Mock(status=403), 'Forbidden Action'.encode('utf-8')
+        )
+      else:
+        request.execute.return_value = {}
+      return request
+
+    mock_admin_sdk_client.roleAssignments.return_value.delete.side_effect = (
+        delete
+    )
+    role_assignment_ids = ['ra{}'.format(i) for i in range(60)]
+    with self.assertRaises(change_client_interface.BulkOperationError) as raised:
+      self.client.delete_role_assignments(['forbidden'] + role_assignment_ids)
+    # The calls of both batches were made despite the failure
+    self.assertEqual(
+        raised.exception.results, {ra_id: True for ra_id in role_assignment_ids}
+    )
+    self.assertEqual(list(raised.exception.failures), ['forbidden'])
+
+  def test_limit_concurrency_caps_in_flight_calls(self):
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    @google_api_client.limit_concurrency('groups')
+    def call_endpoint():
+      with lock:
+        in_flight.append(1)
+        max_in_flight.append(len(in_flight))
+      time.sleep(0.01)
+      with lock:
+        in_flight.pop()
+
+    with futures.ThreadPoolExecutor(max_workers=16) as executor:
+      for _ in range(32):
+        executor.submit(call_endpoint)
+    self.assertEqual(
+        max(max_in_flight), google_api_client.MAX_CONCURRENT_CALLS['groups']
+    )
+
+  def test_bulk_calls_hold_concurrency_slot_per_batch(self):
+    semaphore = google_api_client._ENDPOINT_SEMAPHORES['roleAssignments']
+    free_slots = []
+
+    def execute_batch(keys, request_builders):
+      del request_builders
+      free_slots.append(semaphore._value)
+      return {key: ({}, None) for key in keys}
+
+    self.client._execute_batch = MagicMock(side_effect=execute_batch)
+    # Called for each completed call, once its batch executed
+    free_slots_between_batches = set()
+    self.client.retry_policy.on_success = MagicMock(
+        side_effect=lambda: free_slots_between_batches.add(semaphore._value)
+    )
+    self.client.delete_role_assignments(
+        ['ra{}'.format(i) for i in range(2 * google_api_client.BATCH_SIZE)]
+    )
+    max_calls = google_api_client.MAX_CONCURRENT_CALLS['roleAssignments']
+    # A slot is held while each batch executes, and released in between
+    self.assertEqual(free_slots, [max_calls - 1, max_calls - 1])
+    self.assertEqual(free_slots_between_batches, {max_calls})
+
+  def test_rate_limit_error_lowers_rate_and_honors_retry_after(self):
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    error = errors.HttpError(
+        httplib2.Response({'status': 403, 'retry-after': '2'}),
+        b'{"error": {"code": 403, "message": "Quota exceeded", "errors":'
+        b' [{"reason": "rateLimitExceeded"}]}}',
+    )
+    mock_admin_sdk_client.roles().get().execute.side_effect = [
+        error,
+        {'roleId': '1'},
+    ]
+    limiter = self.client.quota_registry.bucket('roles.get')
+    limiter.on_rate_limited = MagicMock(wraps=limiter.on_rate_limited)
+    self.assertEqual(self.client.get_role('1'), {'roleId': '1'})
+    limiter.on_rate_limited.assert_called_once_with(2.0)
+
+  def test_is_rate_limit_error(self):
+    def http_error(status, reason):
+      return errors.HttpError(
+          httplib2.Response({'status': status}),
+          ('{"error": {"errors": [{"reason": "%s"}]}}' % reason).encode(),
+      )
+
+    self.assertTrue(
+        retry_policy.is_rate_limit_error(http_error(429, 'any'))
+    )
+    self.assertTrue(
+        retry_policy.is_rate_limit_error(
+            http_error(403, 'userRateLimitExceeded')
+        )
+    )
+    self.assertFalse(
+        retry_policy.is_rate_limit_error(http_error(403, 'forbidden'))
+    )
+
+  def test_learned_rates_persisted(self):
+    with tempfile.TemporaryDirectory() as output_path:
+      client = GoogleApiClient(
+          output_path=output_path,
+          oa_client_creds='credentials',
+          is_test_envs=True,
+          is_dry_run=False,
+      )
+      client.quota_registry.buckets['directory'].on_rate_limited()
+      client.save_learned_rates()
+      client = GoogleApiClient(
+          output_path=output_path,
+          oa_client_creds='credentials',
+          is_test_envs=True,
+          is_dry_run=False,
+      )
+      self.assertEqual(
+          client.quota_registry.buckets['directory'].rate,
+          quota_registry.QUOTA_BUCKETS['directory'][0] / 2,
+      )
+
+  def test_worker_threads_own_clients_kept_on_refresh(self):
+    admin_sdk_client = self.client.get_admin_sdk_client()
+    self.assertIs(self.client.get_admin_sdk_client(), admin_sdk_client)
+    with futures.ThreadPoolExecutor(max_workers=1) as executor:
+      worker_client = executor.submit(
+          self.client.get_admin_sdk_client
+      ).result()
+    self.assertIsNot(worker_client, admin_sdk_client)
+    self.client.refresh_credentials(self.client.credential_generation)
+    self.assertIs(self.client.get_admin_sdk_client(), admin_sdk_client)
+
+  def test_concurrent_401_single_credential_refresh(self):
+    refresh = self.client._credential_store.refresh
+    refresh.reset_mock()
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    all_failed = threading.Barrier(4, timeout=5)
+
+    def get(groupKey, fields):
+      del groupKey, fields
+      request = Mock()
+
+      def execute():
+        if self.client.credential_generation == 0:
+          all_failed.wait()
+          raise errors.HttpError(Mock(status=401), b'Token expired')
+        return {'email': 'group@example.com'}
+
+      request.execute.side_effect = execute
+      return request
+
+    mock_admin_sdk_client.groups.return_value.get.side_effect = get
+    with futures.ThreadPoolExecutor(max_workers=4) as executor:
+      groups = list(
+          executor.map(
+              lambda _: self.client.get_group('group@example.com'), range(4)
+          )
+      )
+    self.assertEqual(groups, [{'email': 'group@example.com'}] * 4)
+    refresh.assert_called_once()
+    self.assertEqual(self.client.credential_generation, 1)
+    self.assertEqual(self.client.coalesced_refreshes, 3)
+
+  def test_401_with_valid_token_forces_refresh(self):
+    store = self.client._credential_store
+    store.refresh.reset_mock()
+    store.authenticate.reset_mock()
+    store.get_oauth_token.return_value = Mock(valid=True)
+    mock_admin_sdk_client = MagicMock()
+    self.client.get_admin_sdk_client = MagicMock(
+        return_value=mock_admin_sdk_client
+    )
+    mock_admin_sdk_client.groups().get().execute.side_effect = [
+        errors.HttpError(Mock(status=401), b'Token revoked'),
+        {'email': 'group@example.com'},
+    ]
+    try:
+      group = self.client.get_group('group@example.com')
+    finally:
+      store.get_oauth_token.return_value = Mock()
+    self.assertEqual(group, {'email': 'group@example.com'})
+    store.refresh.assert_called_once()
+    store.authenticate.assert_not_called()
+    self.assertEqual(self.client.credential_generation, 1)
+
+  def test_expired_credential_refreshed_once_across_threads(self):
+    store = self.client._credential_store
+    store.refresh.reset_mock()
+    expired = Mock(valid=False)
+    refreshed = Mock(valid=True)
+    store.get_oauth_token.return_value = expired
+
+    def refresh():
+      # Leaves the other threads time to find the credential expired
+      time.sleep(0.05)
+      store.get_oauth_token.return_value = refreshed
+
+    store.refresh.side_effect = refresh
+    credentials = self.client._build_client('admin_sdk')._http.credentials
+    all_ready = threading.Barrier(4, timeout=5)
+
+    def before_request(_):
+      all_ready.wait()
+      credentials.before_request(None, 'GET', 'https://example.com', {})
+
+    try:
+      with futures.ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(before_request, range(4)))
+    finally:
+      store.refresh.side_effect = None
+      store.get_oauth_token.return_value = Mock()
+    store.refresh.assert_called_once()
+    expired.refresh.assert_not_called()
+    expired.apply.assert_not_called()
+    self.assertEqual(refreshed.apply.call_count, 4)
+    self.assertEqual(self.client.credential_generation, 1)
+
+  def test_clients_authorize_with_current_credential(self):
+    store = self.client._credential_store
+    credentials = self.client._build_client('admin_sdk')._http.credentials
+    store.get_oauth_token.return_value = Mock(token='first')
+    self.assertEqual(credentials.token, 'first')
+    store.get_oauth_token.return_value = Mock(token='refreshed')
+    self.assertEqual(credentials.token, 'refreshed')
+
+  def test_background_refresh_ahead_of_expiry(self):
+    store = google_api_client.credential_store.CredentialStore.return_value
+    refreshed = threading.Event()
+    store.refresh.side_effect = refreshed.set
+    # Expires within the margin
+    store.get_oauth_token.return_value.expiry = (
+        google_api_client.token_refresher._utcnow()
+    )
+    try:
+      client = GoogleApiClient(
+          output_path='output',
+          oa_client_creds='credentials',
+          is_test_envs=True,
+          is_dry_run=False,
+          token_refresh_margin_seconds=300,
+      )
+      self.assertTrue(refreshed.wait(5))
+      client._token_refresher.stop()
+    finally:
+      store.refresh.side_effect = None
+      store.get_oauth_token.return_value = Mock()
+    self.assertEqual(client.credential_generation, 1)
+    self.assertEqual(client.get_credential_stats()['background_refreshes'], 1)
+
+  def test_batch_requests_authorized_by_store_credential(self):
+    store = self.client._credential_store
+    store.get_oauth_token.return_value = oauth2_credentials.Credentials('token')
+
+    def request(uri, method='GET', body=None, headers=None, **kwargs):
+      del uri, method, headers, kwargs
+      parts = [
+          '--batch_boundary\r\nContent-Type: application/http\r\n'
+          'Content-ID: <response-{}>\r\n\r\nHTTP/1.1 200 OK\r\n'
+          'Content-Type: application/json\r\n\r\n'
+          '{{"id": "u{}", "primaryEmail": "user{}@example.com"}}\r\n'.format(
+              content_id, index, index
+          )
+          for index, content_id in enumerate(
+              re.findall(r'Content-ID: <(.+)>', body)
+          )
+      ]
+      return (
+          httplib2.Response({
+              'status': 200,
+              'content-type': 'multipart/mixed; boundary=batch_boundary',
+          }),
+          (''.join(parts) + '--batch_boundary--').encode(),
+      )
+
+    self.client._transport.request = MagicMock(side_effect=request)
+    try:
+      users = self.client.get_users(
+          ['user0@example.com', 'user1@example.com']
+      )
+    finally:
+      store.get_oauth_token.return_value = Mock()
+    self.assertEqual(
+        users,
+        {
+            'user0@example.com': {
+                'id': 'u0', 'primaryEmail': 'user0@example.com'
+            },
+            'user1@example.com': {
+                'id': 'u1', 'primaryEmail': 'user1@example.com'
+            },
+        },
+    )
+    self.client._transport.request.assert_called_once()
+
+  def test_pipelined_listings_reuse_clients(self):
+    page = {'items': [{'roleId': '1'}]}
+    with patch.object(
+        google_api_client.discovery, 'build_from_document'
+    ) as build_from_document:
+      build_from_document.return_value.roles().list().execute.return_value = (
+          page
+      )
+      for _ in range(50):
+        self.assertEqual(self.client.list_roles(), [{'roleId': '1'}])
+    # Each listing runs on a new producer thread, which checks out the
+    # client of the previous ones once they exited.
+    self.assertLess(self.client._client_pool.clients_built, 5)
+
+  def test_clients_built_lazily_from_shared_documents(self):
+    self.client.get_admin_sdk_client()
+    self.assertEqual(self.client._client_pool.clients_built, 1)
+    with futures.ThreadPoolExecutor(max_workers=1) as executor:
+      executor.submit(self.client.get_admin_sdk_client).result()
+    self.assertEqual(self.client._client_pool.clients_built, 2)
+    # Both threads' clients were built from the document parsed once
+    self.assertEqual(
+        list(self.client._discovery_documents._documents),
+        [('admin', 'directory_v1')],
+    )
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,95 @@
+from concurrent import futures
+import http.server
+import threading
+import unittest
+from unittest import mock
+from change_client import http_transport
+
+
+class _KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    self.server.client_ports.add(self.client_address[1])
+    self.server.headers_seen.append(dict(self.headers))
+    body = b'{}'
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    del args
+
+
+class TestPooledHttp(unittest.TestCase):
+
+  def setUp(self):
+    self.server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), _KeepAliveHandler
+    )
+    self.server.client_ports = set()
+    self.server.headers_seen = []
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    self.uri = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+    self.transport = http_transport.PooledHttp(timeout=5)
+
+  def tearDown(self):
+    self.transport.close()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_sequential_requests_reuse_connection(self):
+    for _ in range(5):
+      response, content = self.transport.request(self.uri)
+      self.assertEqual(response.status, 200)
+      self.assertEqual(content, b'{}')
+    self.assertLen(self.server.client_ports, 1)
+    self.assertEqual(self.transport.stats.as_dict()['requests'], 5)
+
+  def test_requests_ask_for_gzip(self):
+    self.transport.request(self.uri, headers={'user-agent': 'client'})
+    headers = {
+        key.lower(): value for key, value in self.server.headers_seen[0].items()
+    }
+    self.assertIn('gzip', headers['accept-encoding'])
+    self.assertEqual(headers['user-agent'], 'client (gzip)')
+
+  def test_concurrent_requests_use_separate_http_objects(self):
+    in_flight = []
+    both_in_flight = threading.Barrier(2, timeout=5)
+
+    def request(http, *args, **kwargs):
+      del args, kwargs
+      in_flight.append(http)
+      both_in_flight.wait()
+      return mock.Mock(status=200), b''
+
+    with mock.patch.object(
+        http_transport.httplib2.Http, 'request', autospec=True
+    ) as mock_request:
+      mock_request.side_effect = request
+      with futures.ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda _: self.transport.request(self.uri), range(2)))
+    self.assertIsNot(in_flight[0], in_flight[1])
+    # Both are pooled for the next requests
+    self.assertLen(self.transport._idle, 2)
+
+  def test_stats_reuse_rate_and_handshake_time_saved(self):
+    stats = http_transport.TransportStats()
+    for _ in range(10):
+      stats.record_request()
+    stats.record_connect(0.2)
+    stats.record_connect(0.1)
+    as_dict = stats.as_dict()
+    self.assertEqual(as_dict['connects'], 2)
+    self.assertAlmostEqual(as_dict['reuse_rate'], 0.8)
+    self.assertAlmostEqual(as_dict['handshake_seconds_saved'], 8 * 0.15)
+
+  def assertLen(self, container, expected_len):
+    self.assertEqual(len(container), expected_len)
+
+
+if __name__ == '__main__':
+  unittest.main()
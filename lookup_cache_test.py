@@ -0,0 +1,55 @@
+import unittest
+from unittest.mock import patch
+from utils.lookup_cache import LookupCache
+
+
+class TestLookupCache(unittest.TestCase):
+
+  def test_hits_and_misses(self):
+    cache = LookupCache(max_entries=10, ttl_seconds=60)
+    self.assertEqual(cache.lookup("u1"), (False, None))
+    cache["u1"] = {"id": "1"}
+    self.assertEqual(cache.lookup("u1"), (True, {"id": "1"}))
+    self.assertEqual(cache["u1"], {"id": "1"})
+    with self.assertRaises(KeyError):
+      cache["u2"]  # pylint: disable=pointless-statement
+    self.assertEqual(
+        cache.stats(), {"size": 1, "hits": 2, "misses": 2, "evictions": 0}
+    )
+
+  def test_lru_eviction(self):
+    cache = LookupCache(max_entries=2, ttl_seconds=60)
+    cache["a"] = 1
+    cache["b"] = 2
+    cache.lookup("a")
+    cache["c"] = 3
+    self.assertIn("a", cache)
+    self.assertNotIn("b", cache)
+    self.assertIn("c", cache)
+    self.assertEqual(cache.evictions, 1)
+
+  def test_ttl_and_negative_ttl(self):
+    cache = LookupCache(max_entries=10, ttl_seconds=60, negative_ttl_seconds=5)
+    with patch("utils.lookup_cache.time.monotonic", return_value=100):
+      cache["found"] = {"id": "1"}
+      cache["not_found"] = None
+    with patch("utils.lookup_cache.time.monotonic", return_value=104):
+      self.assertEqual(cache.lookup("not_found"), (True, None))
+    with patch("utils.lookup_cache.time.monotonic", return_value=105):
+      self.assertEqual(cache.lookup("not_found"), (False, None))
+      self.assertIn("found", cache)
+    with patch("utils.lookup_cache.time.monotonic", return_value=160):
+      self.assertNotIn("found", cache)
+    self.assertEqual(len(cache), 0)
+
+  def test_update_and_invalidate(self):
+    cache = LookupCache(max_entries=10, ttl_seconds=60)
+    cache.update({"a": 1, "b": None})
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    self.assertNotIn("a", cache)
+    self.assertIn("b", cache)
+
+
+if __name__ == "__main__":
+  unittest.main()
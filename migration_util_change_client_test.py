@@ -1,4 +1,8 @@
+from concurrent import futures
 import sys
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import Mock, patch
 
@@ -7,6 +11,8 @@ sys.modules['googleapiclient'] = Mock()
 sys.modules['utils.logger'] = Mock()
 sys.modules['change_client.dry_run_change_client'] = Mock()
 sys.modules['change_client.google_api_client'] = Mock()
+from change_client import change_client_interface
+from change_client import role_assignment_counter
 from change_client.migration_util_change_client import MigrationUtilChangeClient
 
 
@@ -132,6 +138,64 @@ class TestMigrationUtilChangeClient(unittest.TestCase):
     result = self.client.get_user(user_email)
     self.assertIsNone(result)
 
+  def test_get_users_fetches_uncached_users_once(self):
+    self.client.user_cache['cached_user'] = {'id': 'cached_user'}
+    self.mock_google_api_client.get_users.return_value = {
+        'user1': {'id': 'user1'},
+        'missing_user': None,
+    }
+    result = self.client.get_users(
+        ['cached_user', 'user1', 'missing_user', 'user1']
+    )
+    self.mock_google_api_client.get_users.assert_called_once_with(
+        ['user1', 'missing_user']
+    )
+    self.assertEqual(
+        result,
+        {
+            'cached_user': {'id': 'cached_user'},
+            'user1': {'id': 'user1'},
+            'missing_user': None,
+        },
+    )
+    # 404s are cached as well and not looked up again
+    self.assertIsNone(self.client.get_user('missing_user'))
+    self.mock_google_api_client.get_user.assert_not_called()
+
+  def test_preload_users_serves_lookups_from_index(self):
+    self.mock_google_api_client.list_users.return_value = [
+        {'id': 'user1', 'primaryEmail': 'User1@example.com', 'name': 'User 1'},
+        {'id': 'user2', 'primaryEmail': 'user2@example.com'},
+    ]
+    self.assertEqual(self.client.preload_users(), 2)
+    self.assertEqual(
+        self.client.get_user('user1'),
+        {'id': 'user1', 'primaryEmail': 'User1@example.com'},
+    )
+    self.assertEqual(
+        self.client.get_user('user1@example.com'),
+        {'id': 'user1', 'primaryEmail': 'User1@example.com'},
+    )
+    self.client.get_users(['user1', 'user2'])
+    self.mock_google_api_client.get_user.assert_not_called()
+    self.mock_google_api_client.get_users.assert_not_called()
+
+  def test_preload_users_index_miss_not_looked_up(self):
+    self.mock_google_api_client.list_users.return_value = [
+        {'id': 'user1', 'primaryEmail': 'user1@example.com'},
+    ]
+    self.client.preload_users()
+    self.assertIsNone(self.client.get_user('unknown@example.com'))
+    self.assertEqual(
+        self.client.get_users(['user1', 'unknown@example.com']),
+        {
+            'user1': {'id': 'user1', 'primaryEmail': 'user1@example.com'},
+            'unknown@example.com': None,
+        },
+    )
+    self.mock_google_api_client.get_user.assert_not_called()
+    self.mock_google_api_client.get_users.assert_not_called()
+
   def test_get_group_members_dry_run(self):
     self.client.dry_run = True
     group_email = 'test_group@example.com'
@@ -394,8 +458,9 @@ class TestMigrationUtilChangeClient(unittest.TestCase):
     group_email = 'group@example.com'
 
     self.client.insert_member_into_group(user_email, user_id, group_email)
-    self.mock_google_api_client.group_has_member.assert_called_once_with(
-        group_email, user_email
+    self.mock_google_api_client.group_has_member.assert_not_called()
+    self.mock_google_api_client.insert_member_into_group.assert_called_once_with(
+        user_email, user_id, group_email
     )
     self.mock_dry_run_change_client.insert_member_into_group.assert_not_called()
 
@@ -408,10 +473,279 @@ class TestMigrationUtilChangeClient(unittest.TestCase):
 
     self.client.insert_member_into_group(user_email, user_id, group_email)
     self.mock_google_api_client.insert_member_into_group.assert_not_called()
-    self.mock_dry_run_change_client.group_has_member.assert_called_once_with(
-        group_email, user_email
-    )    
+    self.mock_google_api_client.group_has_member.assert_not_called()
+    self.mock_dry_run_change_client.insert_member_into_group.assert_called_once_with(
+        user_email, user_id, group_email
+    )
+
+
+  def test_insert_members_into_group_routed_by_dry_run(self):
+    members = [{'email': 'user@example.com', 'id': 'user_id'}]
+    self.client.dry_run = True
+    self.client.insert_members_into_group('group@example.com', members)
+    self.mock_dry_run_change_client.insert_members_into_group.assert_called_once_with(
+        'group@example.com', members
+    )
+    self.mock_google_api_client.insert_members_into_group.assert_not_called()
+
+    self.client.dry_run = False
+    self.client.insert_members_into_group('group@example.com', members)
+    self.mock_google_api_client.insert_members_into_group.assert_called_once_with(
+        'group@example.com', members
+    )
+
+  def test_role_assignment_snapshot_listed_once(self):
+    self.client.dry_run = False
+    self.mock_google_api_client.iter_role_assignments.return_value = [
+        {'roleAssignmentId': '1', 'roleId': 'r1', 'assignedTo': 'u1',
+         'scopeType': 'CUSTOMER'},
+        {'roleAssignmentId': '2', 'roleId': 'r2', 'assignedTo': 'u2',
+         'scopeType': 'CUSTOMER'},
+    ]
+    self.assertEqual(self.client.load_role_assignment_snapshot(), 2)
+    self.assertEqual(self.client.load_role_assignment_snapshot(), 2)
+
+    ras = self.client.list_role_assignments('r1', None)
+    self.assertEqual([ra['roleAssignmentId'] for ra in ras], ['1'])
+    ras = self.client.list_role_assignments(None, 'u2')
+    self.assertEqual([ra['roleAssignmentId'] for ra in ras], ['2'])
+    self.mock_google_api_client.iter_role_assignments.assert_called_once_with(
+        None, None
+    )
+
+  def test_role_assignment_snapshot_applies_deltas(self):
+    self.client.dry_run = False
+    self.mock_google_api_client.iter_role_assignments.return_value = [
+        {'roleAssignmentId': '1', 'roleId': 'r1', 'assignedTo': 'u1',
+         'assigneeType': 'user', 'scopeType': 'CUSTOMER'},
+        {'roleAssignmentId': '2', 'roleId': 'r1', 'assignedTo': 'u2',
+         'assigneeType': 'user', 'scopeType': 'CUSTOMER'},
+    ]
+    self.client.load_role_assignment_snapshot()
+    group_ra = {'roleAssignmentId': '3', 'roleId': 'r1', 'assignedTo': 'g1',
+                'assigneeType': 'group', 'scopeType': 'CUSTOMER'}
+    self.mock_google_api_client.insert_role_assignment.return_value = group_ra
+    self.mock_google_api_client.delete_role_assignments.return_value = {
+        '1': True
+    }
+
+    self.client.insert_role_assignment(dict(group_ra))
+    self.client.delete_role_assignments(['1'])
+
+    ras = self.client.list_role_assignments('r1', None)
+    self.assertEqual([ra['roleAssignmentId'] for ra in ras], ['2', '3'])
+    self.assertEqual(self.client.get_role_assignment(group_ra), group_ra)
+    self.mock_google_api_client.iter_role_assignments.assert_called_once()
+
+  def test_role_assignment_snapshot_applies_completed_deletions(self):
+    self.client.dry_run = False
+    self.mock_google_api_client.iter_role_assignments.return_value = [
+        {'roleAssignmentId': '1', 'roleId': 'r1', 'assignedTo': 'u1',
+         'assigneeType': 'user', 'scopeType': 'CUSTOMER'},
+        {'roleAssignmentId': '2', 'roleId': 'r1', 'assignedTo': 'u2',
+         'assigneeType': 'user', 'scopeType': 'CUSTOMER'},
+    ]
+    self.client.load_role_assignment_snapshot()
+    failure = change_client_interface.BulkOperationError(
+        {'1': True}, {'2': RuntimeError('Forbidden')}
+    )
+    self.mock_google_api_client.delete_role_assignments.side_effect = failure
+
+    with self.assertRaises(change_client_interface.BulkOperationError):
+      self.client.delete_role_assignments(['1', '2'])
+
+    ras = self.client.list_role_assignments('r1', None)
+    self.assertEqual([ra['roleAssignmentId'] for ra in ras], ['2'])
+
+  def test_insert_role_assignment_dry_run_unique_ids(self):
+    self.client.dry_run = True
+    self.mock_dry_run_change_client.insert_role_assignment.side_effect = (
+        lambda ra: ra
+    )
+    ra1 = self.client.insert_role_assignment({'roleId': 'r1'})
+    ra2 = self.client.insert_role_assignment({'roleId': 'r2'})
+    self.assertNotEqual(ra1['roleAssignmentId'], ra2['roleAssignmentId'])
+
+  def test_directory_cache_warm_start(self):
+    with tempfile.TemporaryDirectory() as output_path:
+      for _ in range(2):
+        client = MigrationUtilChangeClient(
+            output_path=output_path,
+            oa_client_id_creds='oa_client_id_creds',
+            dry_run=False,
+            is_test_envs=True,
+            cache_max_age_hours=1,
+        )
+        client.google_api_client = self.mock_google_api_client
+        self.mock_google_api_client.list_role_assignments.return_value = [
+            {'roleAssignmentId': '1', 'roleId': 'r1'}
+        ]
+        self.mock_google_api_client.get_role.return_value = {'roleId': 'r1'}
+        self.mock_google_api_client.get_users.return_value = {'u1': None}
+        self.assertEqual(
+            client.list_role_assignments(None, None),
+            [{'roleAssignmentId': '1', 'roleId': 'r1'}],
+        )
+        self.assertEqual(client.get_role('r1'), {'roleId': 'r1'})
+        self.assertEqual(client.get_users(['u1']), {'u1': None})
+      self.mock_google_api_client.list_role_assignments.assert_called_once()
+      self.mock_google_api_client.get_role.assert_called_once()
+      self.mock_google_api_client.get_users.assert_called_once()
+
+  def test_directory_cache_invalidated_by_writes(self):
+    with tempfile.TemporaryDirectory() as output_path:
+      client = MigrationUtilChangeClient(
+          output_path=output_path,
+          oa_client_id_creds='oa_client_id_creds',
+          dry_run=False,
+          is_test_envs=True,
+          cache_max_age_hours=1,
+      )
+      client.google_api_client = self.mock_google_api_client
+      self.mock_google_api_client.get_group.return_value = None
+      self.mock_google_api_client.list_role_assignments.return_value = [
+          {'roleAssignmentId': '1'}
+      ]
+      self.mock_google_api_client.insert_role_assignment.return_value = {
+          'roleAssignmentId': '2'
+      }
+      self.mock_google_api_client.delete_role_assignments.return_value = {
+          '1': True
+      }
+      self.assertIsNone(client.get_group('group@example.com'))
+      client.list_role_assignments(None, None)
+
+      client.create_group('customer', 'group@example.com', 'name', 'desc')
+      client.insert_role_assignment({'roleId': 'r1'})
+      client.delete_role_assignments(['1'])
+
+      self.mock_google_api_client.get_group.return_value = {'id': 'g1'}
+      self.assertEqual(client.get_group('group@example.com'), {'id': 'g1'})
+      self.assertEqual(
+          client.list_role_assignments(None, None), [{'roleAssignmentId': '2'}]
+      )
+      self.mock_google_api_client.list_role_assignments.assert_called_once()
+
+  def test_lookups_cached_including_not_found(self):
+    self.mock_google_api_client.get_customer.return_value = {'id': 'c1'}
+    self.mock_google_api_client.get_group.return_value = None
+    for _ in range(3):
+      self.assertEqual(self.client.get_customer(), {'id': 'c1'})
+      self.client.get_group('group@example.com')
+    self.mock_google_api_client.get_customer.assert_called_once()
+    self.mock_google_api_client.get_group.assert_called_once()
+    self.assertEqual(
+        self.client.get_cache_stats()['customer'],
+        {'size': 1, 'hits': 2, 'misses': 1, 'evictions': 0},
+    )
+
+  def test_create_group_invalidates_group_lookup(self):
+    self.client.dry_run = False
+    self.mock_google_api_client.get_group.return_value = None
+    self.assertIsNone(self.client.get_group('group@example.com'))
+    self.client.create_group('customer', 'group@example.com', 'name', 'desc')
+    self.mock_google_api_client.get_group.return_value = {'id': 'g1'}
+    self.assertEqual(self.client.get_group('group@example.com'), {'id': 'g1'})
+
+  @patch('time.sleep')
+  def test_created_group_read_until_visible(self, mock_sleep):
+    self.client.dry_run = False
+    self.mock_google_api_client.get_group.side_effect = [
+        None,
+        None,
+        {'id': 'g1'},
+    ]
+    self.client.create_group('customer', 'group@example.com', 'name', 'desc')
+    self.assertEqual(self.client.get_group('group@example.com'), {'id': 'g1'})
+    self.assertEqual(mock_sleep.call_count, 2)
+    # Served from the cache once visible
+    self.assertEqual(self.client.get_group('group@example.com'), {'id': 'g1'})
+    self.assertEqual(self.mock_google_api_client.get_group.call_count, 3)
+
+  @patch('time.sleep')
+  def test_created_group_absence_not_cached(self, mock_sleep):
+    del mock_sleep
+    self.client.dry_run = False
+    self.mock_google_api_client.get_group.return_value = None
+    self.client.create_group('customer', 'group@example.com', 'name', 'desc')
+    self.assertIsNone(self.client.get_group('group@example.com'))
+    self.assertNotIn('group@example.com', self.client.lookup_caches['group'])
+    self.mock_google_api_client.get_group.return_value = {'id': 'g1'}
+    self.assertEqual(self.client.get_group('group@example.com'), {'id': 'g1'})
+
+  def test_role_assignment_snapshot_listed_per_role(self):
+    self.client.dry_run = False
+    self.client.ra_listing_workers = 4
+    self.mock_google_api_client.list_roles.return_value = [
+        {'roleId': 'r1'},
+        {'roleId': 'r2'},
+    ]
+    list_by_role = self.mock_google_api_client.iter_role_assignments_by_role
+    list_by_role.return_value = [
+        {'roleAssignmentId': '1', 'roleId': 'r1', 'assignedTo': 'u1',
+         'scopeType': 'CUSTOMER'},
+    ]
+    self.assertEqual(self.client.load_role_assignment_snapshot(), 1)
+    list_by_role.assert_called_once_with(['r1', 'r2'], 4)
+    self.mock_google_api_client.iter_role_assignments.assert_not_called()
+
+  def test_role_assignment_snapshot_counted_while_streamed(self):
+    self.client.dry_run = False
+    self.mock_google_api_client.iter_role_assignments.return_value = iter([
+        {'roleAssignmentId': str(i), 'roleId': 'r1', 'assignedTo': 'u',
+         'scopeType': 'CUSTOMER'}
+        for i in range(3)
+    ])
+    over_limit = []
+    counter = role_assignment_counter.RoleAssignmentCounter(
+        2, lambda scope, count: over_limit.append((scope, count))
+    )
+    self.assertEqual(self.client.load_role_assignment_snapshot(counter), 3)
+    self.assertEqual(over_limit, [(('CUSTOMER', ''), 3)])
+    self.assertEqual(counter.role_scope_counts[('r1', 'CUSTOMER', '')], 3)
+
 
+  def test_concurrent_group_reads_coalesced(self):
+    self.client.dry_run = False
+    both_reading = threading.Barrier(2, timeout=5)
+    release = threading.Event()
+
+    def get_group(group_key):
+      release.wait(5)
+      return {'id': 'g1', 'email': group_key}
+
+    self.mock_google_api_client.get_group.side_effect = get_group
+
+    def read_group(_):
+      both_reading.wait()
+      return self.client.get_group('group@example.com')
+
+    with futures.ThreadPoolExecutor(max_workers=2) as executor:
+      reads = executor.map(read_group, range(2))
+      # Let the second reader join the call in flight
+      while self.client.get_coalescing_stats()['coalesced'] < 1:
+        time.sleep(0.01)
+      release.set()
+      groups = list(reads)
+    self.assertEqual(groups[0], groups[1])
+    self.mock_google_api_client.get_group.assert_called_once()
+    self.assertEqual(
+        self.client.get_coalescing_stats(), {'calls': 1, 'coalesced': 1}
+    )
+
+  def test_member_insert_not_joining_prior_membership_read(self):
+    self.client.dry_run = False
+    self.client.in_flight_reads._in_flight[
+        ('member', 'group@example.com', 'user@example.com')
+    ] = Mock()
+    self.client.insert_member_into_group(
+        'user@example.com', 'u1', 'group@example.com'
+    )
+    self.mock_google_api_client.group_has_member.return_value = True
+    self.assertTrue(
+        self.client.group_has_member('group@example.com', 'user@example.com')
+    )
+    self.mock_google_api_client.group_has_member.assert_called_once()
 
 if __name__ == '__main__':
   unittest.main()
@@ -16,8 +16,10 @@
 
 """Phase wise runner for migration utlity."""
 from __future__ import print_function
+from concurrent import futures
 import time
-from typing import Sequence
+from typing import Optional, Sequence
+from change_client import role_assignment_counter
 import gbra_migration_util
 from utils import logger
 
@@ -42,6 +44,11 @@ class PhaseWiseRunner:
       dry_run: bool,
       is_test_env: bool = False,
       debug: bool = False,
+      preload_users: bool = False,
+      cache_max_age_hours: Optional[float] = None,
+      modify_workers: int = 1,
+      ra_listing_workers: int = 1,
+      token_refresh_margin_seconds: Optional[float] = None,
   ):
     logger.Logger.initialize(output_path, debug)
     self.migration_util = gbra_migration_util.MigrationUtility(
@@ -52,8 +59,81 @@ class PhaseWiseRunner:
         roles_to_skip_gbra,
         dry_run,
         is_test_env,
+        cache_max_age_hours,
+        ra_listing_workers,
+        token_refresh_margin_seconds,
     )
     self.delete_dup_ras_to_sa = delete_dup_ras_to_sa
+    self.modify_workers = modify_workers
+    if preload_users:
+      start_time = time.time()
+      user_count = (
+          self.migration_util.migration_util_change_util.preload_users()
+      )
+      logger.Logger.get_instance().log(
+          'Preloaded {} users in {} seconds.'.format(
+              user_count, int(time.time() - start_time)
+          )
+      )
+
+  def _load_role_assignment_snapshot(
+      self,
+      ra_counter: Optional[
+          role_assignment_counter.RoleAssignmentCounter
+      ] = None,
+  ):
+    """Lists all role-assignments once, later phases reuse the snapshot."""
+    start_time = time.time()
+    change_util = self.migration_util.migration_util_change_util
+    ra_count = change_util.load_role_assignment_snapshot(ra_counter)
+    logger.Logger.get_instance().debug(
+        'Role-assignment snapshot has {} role-assignments, loaded in {}'
+        ' seconds.'.format(ra_count, int(time.time() - start_time))
+    )
+
+  def _log_scope_over_limit(self, scope_key, ra_count):
+    logger.Logger.get_instance().log(
+        '.. Scope {} exceeds the scope limit({}) with {} role-assignments'
+        ' listed so far'.format(
+            self.migration_util.get_human_scope_name(*scope_key),
+            self.migration_util.ra_limit,
+            ra_count,
+        )
+    )
+
+  def _log_client_stats(self):
+    change_util = self.migration_util.migration_util_change_util
+    for kind, stats in change_util.get_cache_stats().items():
+      logger.Logger.get_instance().debug(
+          '{} cache : size={size} hits={hits} misses={misses}'
+          ' evictions={evictions}'.format(kind, **stats)
+      )
+    logger.Logger.get_instance().debug(
+        'Transport : requests={requests} new connections={connects}'
+        ' reuse rate={reuse_rate:.1%} handshake seconds={connect_seconds:.1f}'
+        ' saved={handshake_seconds_saved:.1f}'.format(
+            **change_util.get_transport_stats()
+        )
+    )
+    logger.Logger.get_instance().debug(
+        'Credentials : refreshes={refreshes}'
+        ' coalesced on 401={coalesced_refreshes}'
+        ' in background={background_refreshes}'
+        ' background failures={background_failures}'
+        ' max background refresh seconds={max_refresh_seconds:.2f}'.format(
+            **change_util.get_credential_stats()
+        )
+    )
+    logger.Logger.get_instance().debug(
+        'Coalesced reads : calls={calls} saved={coalesced}'.format(
+            **change_util.get_coalescing_stats()
+        )
+    )
+    for endpoint, stats in change_util.get_retry_stats().items():
+      logger.Logger.get_instance().debug(
+          '{} retries : retries={retries} seconds lost={seconds_lost:.1f}'
+          ' failed without retry={failures}'.format(endpoint, **stats)
+      )
 
   def do_precheck(self):
     """Precheck phase."""
@@ -71,12 +151,15 @@ class PhaseWiseRunner:
             self.migration_util.dry_run
         )
     )
-    rolescope_to_ra_map = self.migration_util.get_rolescope_to_ra_map()
-    scope_to_ra_map = self.migration_util.get_scope_to_ra_map(
-        filter_under_ra_limit=True, human_readable_scope_name=True
+    # Scopes over the limit are reported as the role-assignments stream in
+    ra_counter = role_assignment_counter.RoleAssignmentCounter(
+        self.migration_util.ra_limit, self._log_scope_over_limit
     )
+    self._load_role_assignment_snapshot(ra_counter)
+    rolescope_to_ra_map = self.migration_util.get_rolescope_to_ra_map()
+    scopes_over_limit = ra_counter.scopes_over_limit()
 
-    if not rolescope_to_ra_map.keys() or not scope_to_ra_map.keys():
+    if not rolescope_to_ra_map.keys() or not scopes_over_limit:
       return
     table_rolescope_to_modify = []
     table_scope_exceed_limit = []
@@ -95,12 +178,10 @@ class PhaseWiseRunner:
           len(role_assignments_at_role_scope),
       ])
 
-    for scope, role_assignments_at_scope in scope_to_ra_map.items():
-      if len(role_assignments_at_scope) < self.migration_util.ra_limit:
-        continue
+    for scope_key, ra_count in scopes_over_limit.items():
       table_scope_exceed_limit.append([
-          scope,
-          len(role_assignments_at_scope),
+          self.migration_util.get_human_scope_name(*scope_key),
+          ra_count,
       ])
 
     logger.Logger.get_instance().log(
@@ -124,6 +205,8 @@ class PhaseWiseRunner:
         ['Role Name', 'Role Id', 'Scope', 'Role-Assignments'],
         table_rolescope_to_modify,
     )
+    self._log_client_stats()
+    self.migration_util.migration_util_change_util.save_learned_rates()
     end_time = time.time()
     logger.Logger.get_instance().log(
         '[1]Phase completed in {} seconds.'.format(int(end_time - start_time))
@@ -137,28 +220,39 @@ class PhaseWiseRunner:
             self.migration_util.dry_run
         )
     )
+    self._load_role_assignment_snapshot()
 
     rolescope_to_ra_map = self.migration_util.get_rolescope_to_ra_map()
-    logger.Logger.get_instance().log('[2.1] Creating groups')
-    self.migration_util.create_groups(rolescope_to_ra_map)
-
     logger.Logger.get_instance().log(
-        '[2.2] Assigning roles to newly created groups '
-    )
-    self.migration_util.make_ra_to_groups(rolescope_to_ra_map)
-    logger.Logger.get_instance().log(
-        '[2.3] Inserting users into newly created groups'
+        '[2.1] Creating groups, assigning roles to them and inserting users'
+        ' into them for {} role-scopes with {} workers'.format(
+            len(rolescope_to_ra_map), self.modify_workers
+        )
     )
-    # Add members to the groups
-    # Regenerate the role-scope to role-assignments map since the hierarchy is
-    # modified above.
-    for (
-        role_scope,
-        role_assignments_at_role_scope,
-    ) in self.migration_util.get_rolescope_to_ra_map().items():
-      self.migration_util.add_assignees_to_group_at_scope(
-          role_scope, role_assignments_at_role_scope
-      )
+    # Role-scopes are migrated concurrently, each one in order
+    with futures.ThreadPoolExecutor(
+        max_workers=self.modify_workers
+    ) as executor:
+      pending = [
+          executor.submit(
+              self.migration_util.migrate_role_scope,
+              role_scope,
+              role_assignments_at_role_scope,
+          )
+          for (
+              role_scope,
+              role_assignments_at_role_scope,
+          ) in rolescope_to_ra_map.items()
+      ]
+      try:
+        for future in futures.as_completed(pending):
+          future.result()
+      except Exception:
+        for future in pending:
+          future.cancel()
+        raise
+    self._log_client_stats()
+    self.migration_util.migration_util_change_util.save_learned_rates()
     end_time = time.time()
     logger.Logger.get_instance().log(
         '[2]Phase completed in {} seconds.'.format(int(end_time - start_time))
@@ -172,6 +266,7 @@ class PhaseWiseRunner:
             self.migration_util.dry_run
         )
     )
+    self._load_role_assignment_snapshot()
     if self.delete_dup_ras_to_sa:
       logger.Logger.get_instance().log(
           '[3] Deleting un-needed non-superadmin role-assignments to'
@@ -192,6 +287,8 @@ class PhaseWiseRunner:
       self.migration_util.cleanup_role_assignments(
           role_scope, role_assignments_at_role_scope
       )
+    self._log_client_stats()
+    self.migration_util.migration_util_change_util.save_learned_rates()
     end_time = time.time()
     logger.Logger.get_instance().log(
         '[3]Phase completed in {} seconds.'.format(int(end_time - start_time))
@@ -0,0 +1,38 @@
+import unittest
+from change_client.quota_registry import QuotaRegistry
+
+
+class TestQuotaRegistry(unittest.TestCase):
+
+  def test_endpoints_share_quota_buckets(self):
+    registry = QuotaRegistry()
+    self.assertIs(
+        registry.bucket("users.get"), registry.bucket("roleAssignments.list")
+    )
+    self.assertIsNot(
+        registry.bucket("users.get"),
+        registry.bucket("cloudidentity.groups.create"),
+    )
+
+  def test_unknown_endpoint(self):
+    with self.assertRaises(AssertionError):
+      QuotaRegistry().bucket("unknown.get")
+
+  def test_learned_rates(self):
+    registry = QuotaRegistry({"directory": 60, "unknown": 1})
+    self.assertEqual(registry.rates()["directory"], 60)
+    self.assertEqual(registry.rates()["cloudidentity"], 10)
+
+  def test_learned_rates_capped_unless_confirmed(self):
+    registry = QuotaRegistry({"directory": 60, "cloudidentity": 50})
+    registry.buckets["cloudidentity"].on_rate_limited()
+    learned_rates = registry.learned_rates()
+    # Never rate limited, the initial rate of the bucket is the cap
+    self.assertEqual(learned_rates["directory"], 40)
+    # Confirmed by the quota error
+    self.assertEqual(learned_rates["cloudidentity"], 25)
+    self.assertEqual(learned_rates["people"], 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
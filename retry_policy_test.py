@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch
+from googleapiclient import errors
+import httplib2
+from change_client import retry_policy
+
+
+def _http_error(status, reason='any', retry_after=None):
+  headers = {'status': status}
+  if retry_after is not None:
+    headers['retry-after'] = retry_after
+  return errors.HttpError(
+      httplib2.Response(headers),
+      ('{"error": {"errors": [{"reason": "%s"}]}}' % reason).encode(),
+  )
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+  def test_classify(self):
+    for e, expected in (
+        (_http_error(429), retry_policy.RETRY),
+        (_http_error(500), retry_policy.RETRY),
+        (_http_error(503), retry_policy.RETRY),
+        (_http_error(403, 'rateLimitExceeded'), retry_policy.RETRY),
+        (TimeoutError(), retry_policy.RETRY),
+        (ConnectionResetError(), retry_policy.RETRY),
+        (_http_error(401), retry_policy.REFRESH_CREDENTIALS),
+        (_http_error(400), retry_policy.FAIL),
+        (_http_error(403, 'forbidden'), retry_policy.FAIL),
+        (_http_error(404), retry_policy.FAIL),
+        (ValueError(), retry_policy.FAIL),
+    ):
+      self.assertEqual(retry_policy.classify(e), expected, repr(e))
+
+  def test_backoff_is_jittered_and_capped(self):
+    previous_delay = 0
+    for _ in range(20):
+      delay = retry_policy.get_backoff_seconds(previous_delay)
+      self.assertGreaterEqual(delay, retry_policy.BASE_DELAY_SECONDS)
+      self.assertLessEqual(
+          delay,
+          min(
+              retry_policy.MAX_DELAY_SECONDS,
+              3 * max(previous_delay, retry_policy.BASE_DELAY_SECONDS),
+          ),
+      )
+      previous_delay = delay
+
+  def test_delay_honors_retry_after(self):
+    policy = retry_policy.RetryPolicy()
+    with patch.object(retry_policy.random, 'uniform', return_value=1.5):
+      self.assertEqual(
+          policy.get_delay_seconds('users.get', _http_error(503), 0), 1.5
+      )
+      self.assertEqual(
+          policy.get_delay_seconds(
+              'users.get', _http_error(429, retry_after='7'), 0
+          ),
+          7.0,
+      )
+
+  def test_budget_exhausted_fails(self):
+    policy = retry_policy.RetryPolicy(
+        retry_policy.RetryBudget(max_retries=2, per_success=0.5)
+    )
+    policy.get_delay_seconds('users.get', _http_error(503), 0)
+    policy.get_delay_seconds('users.get', _http_error(503), 0)
+    with self.assertRaises(RuntimeError):
+      policy.get_delay_seconds('users.get', _http_error(503), 0)
+    # Two successful calls refill one retry
+    policy.on_success()
+    policy.on_success()
+    policy.get_delay_seconds('users.get', _http_error(503), 0)
+
+  def test_stats_per_endpoint(self):
+    policy = retry_policy.RetryPolicy()
+    policy.on_retry('users.get', 1.5)
+    policy.on_retry('users.get', 2.0)
+    policy.on_failure('roles.get')
+    self.assertEqual(
+        policy.stats(),
+        {
+            'roles.get': {'retries': 0, 'seconds_lost': 0, 'failures': 1},
+            'users.get': {'retries': 2, 'seconds_lost': 3.5, 'failures': 0},
+        },
+    )
+
+
+if __name__ == '__main__':
+  unittest.main()
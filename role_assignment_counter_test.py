@@ -0,0 +1,65 @@
+import unittest
+from change_client.role_assignment_counter import RoleAssignmentCounter
+
+
+def _ra(role_id, scope_type='CUSTOMER', org_unit_id=None):
+  role_assignment = {'roleId': role_id, 'scopeType': scope_type}
+  if org_unit_id:
+    role_assignment['orgUnitId'] = org_unit_id
+  return role_assignment
+
+
+class TestRoleAssignmentCounter(unittest.TestCase):
+
+  def setUp(self):
+    self.over_limit = []
+    self.counter = RoleAssignmentCounter(
+        2, lambda scope, count: self.over_limit.append((scope, count))
+    )
+
+  def test_counts_per_scope_and_role_scope(self):
+    list(self.counter.counted([
+        _ra('r1'),
+        _ra('r2'),
+        _ra('r1', 'ORG_UNIT', 'ou1'),
+    ]))
+    self.assertEqual(self.counter.scope_counts[('CUSTOMER', '')], 2)
+    self.assertEqual(self.counter.scope_counts[('ORG_UNIT', 'ou1')], 1)
+    self.assertEqual(self.counter.role_scope_counts[('r1', 'CUSTOMER', '')], 1)
+    self.assertEqual(
+        self.counter.role_scope_counts[('r1', 'ORG_UNIT', 'ou1')], 1
+    )
+
+  def test_customer_scope_counted_with_or_without_org_unit(self):
+    list(self.counter.counted([
+        _ra('r1'),
+        _ra('r1', 'CUSTOMER', 'root_ou'),
+        _ra('r2', 'CUSTOMER', 'root_ou'),
+    ]))
+    self.assertEqual(dict(self.counter.scope_counts), {('CUSTOMER', ''): 3})
+    self.assertEqual(self.counter.role_scope_counts[('r1', 'CUSTOMER', '')], 2)
+    self.assertEqual(self.over_limit, [(('CUSTOMER', ''), 3)])
+
+  def test_scope_over_limit_reported_once_while_streaming(self):
+    streamed = self.counter.counted(
+        [_ra('r1'), _ra('r2'), _ra('r3'), _ra('r4')]
+    )
+    for _ in range(3):
+      next(streamed)
+    # Reported as soon as the third role-assignment at the scope streams in
+    self.assertEqual(self.over_limit, [(('CUSTOMER', ''), 3)])
+    list(streamed)
+    self.assertEqual(self.over_limit, [(('CUSTOMER', ''), 3)])
+
+  def test_scopes_over_limit_largest_first(self):
+    for ra in [_ra('r1', 'ORG_UNIT', 'ou1')] * 3 + [_ra('r1')] * 4:
+      self.counter.add(ra)
+    self.counter.add(_ra('r1', 'ORG_UNIT', 'ou2'))
+    self.assertEqual(
+        list(self.counter.scopes_over_limit().items()),
+        [(('CUSTOMER', ''), 4), (('ORG_UNIT', 'ou1'), 3)],
+    )
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+from change_client.role_assignment_snapshot import RoleAssignmentSnapshot
+
+
+def _ra(ra_id, role_id, assigned_to, scope_type='CUSTOMER', org_unit_id=None):
+  role_assignment = {
+      'roleAssignmentId': ra_id,
+      'roleId': role_id,
+      'assignedTo': assigned_to,
+      'scopeType': scope_type,
+  }
+  if org_unit_id:
+    role_assignment['orgUnitId'] = org_unit_id
+  return role_assignment
+
+
+class TestRoleAssignmentSnapshot(unittest.TestCase):
+
+  def setUp(self):
+    self.snapshot = RoleAssignmentSnapshot([
+        _ra('1', 'r1', 'u1'),
+        _ra('2', 'r1', 'u2', 'ORG_UNIT', 'ou1'),
+        _ra('3', 'r2', 'u1', 'ORG_UNIT', 'ou1'),
+    ])
+
+  def _ids(self, role_assignments):
+    return [ra['roleAssignmentId'] for ra in role_assignments]
+
+  def test_list_role_assignments(self):
+    self.assertLen(self.snapshot, 3)
+    self.assertEqual(self._ids(self.snapshot.list_role_assignments()),
+                     ['1', '2', '3'])
+    self.assertEqual(self._ids(self.snapshot.list_role_assignments('r1')),
+                     ['1', '2'])
+    self.assertEqual(
+        self._ids(self.snapshot.list_role_assignments(user_id='u1')),
+        ['1', '3'],
+    )
+    self.assertEqual(self.snapshot.list_role_assignments('r3'), [])
+    with self.assertRaises(AssertionError):
+      self.snapshot.list_role_assignments('r1', 'u1')
+
+  def test_list_role_assignments_at_scope(self):
+    self.assertEqual(
+        self._ids(
+            self.snapshot.list_role_assignments_at_scope('ORG_UNIT', 'ou1')
+        ),
+        ['2', '3'],
+    )
+    self.assertEqual(
+        self._ids(
+            self.snapshot.list_role_assignments_at_role_scope(
+                'r1', 'ORG_UNIT', 'ou1'
+            )
+        ),
+        ['2'],
+    )
+    self.assertEqual(
+        self._ids(self.snapshot.list_role_assignments_at_scope('CUSTOMER')),
+        ['1'],
+    )
+
+  def test_add_and_remove(self):
+    self.snapshot.add(_ra('4', 'r1', 'g1', 'ORG_UNIT', 'ou1'))
+    self.assertTrue(self.snapshot.remove('2'))
+    self.assertFalse(self.snapshot.remove('2'))
+    self.assertFalse(self.snapshot.has_assignee('u2'))
+    self.assertTrue(self.snapshot.has_assignee('g1'))
+    self.assertIsNone(self.snapshot.get('2'))
+    self.assertEqual(
+        self._ids(
+            self.snapshot.list_role_assignments_at_role_scope(
+                'r1', 'ORG_UNIT', 'ou1'
+            )
+        ),
+        ['4'],
+    )
+
+  def test_add_replaces_existing(self):
+    self.snapshot.add(_ra('1', 'r2', 'u1'))
+    self.assertLen(self.snapshot, 3)
+    self.assertEqual(self._ids(self.snapshot.list_role_assignments('r1')),
+                     ['2'])
+
+  def assertLen(self, container, expected_len):
+    self.assertEqual(len(container), expected_len)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Selection of the role-scopes of a scope to convert to group-based ones.
+
+Converting the role-assignments of a role-scope to a group role-assignment
+reduces the role-assignments of the scope by their count minus one, the one of
+the group. Role-scopes are selected from the largest, until the remaining
+role-assignments of the scope fall under the limit.
+
+The planner is pure : the role-assignment counts and the eligibility of the
+roles are resolved beforehand, so that it issues no API call.
+"""
+
+import collections
+import operator
+from typing import Callable, Collection, Hashable, Mapping
+
+Plan = collections.namedtuple('Plan', ['selected', 'reduced_ra_count'])
+
+
+def plan_role_scopes(
+    role_scope_counts: Mapping[Hashable, int],
+    ra_count: int,
+    ra_limit: int,
+    eligible_role_ids: Collection[str],
+    roles_to_force_gbra: Collection[int],
+    roles_to_skip_gbra: Collection[int],
+    get_role_id: Callable[[Hashable], str] = operator.attrgetter('roleId'),
+) -> Plan:
+  """Returns the role-scopes to convert and the role-assignments they save.
+
+  Role-scopes of the forced roles are always selected and those of the skipped
+  roles never are. Others are selected, largest first, while the remaining
+  role-assignments are at or above the limit and their role is eligible.
+
+  Args:
+    role_scope_counts: Count of the role-assignments of each role-scope of the
+      scope, role-scopes of equal counts are selected in the mapping order.
+    ra_count: Count of the role-assignments of the scope.
+    ra_limit: The limit of role-assignments per scope.
+    eligible_role_ids: Ids of the roles which can be converted.
+    roles_to_force_gbra: Ids of the roles whose role-scopes are converted.
+    roles_to_skip_gbra: Ids of the roles whose role-scopes are never converted.
+    get_role_id: Returns the role id of a role-scope.
+
+  Returns:
+    The selected role-scopes, largest first, and the reduction of the
+    role-assignments of the scope once they are converted.
+  """
+  selected = []
+  reduced_ra_count = 0
+  for role_scope, count in sorted(
+      role_scope_counts.items(), key=lambda item: item[1], reverse=True
+  ):
+    role_id = get_role_id(role_scope)
+    is_forced = roles_to_force_gbra and int(role_id) in roles_to_force_gbra
+    if not is_forced and (
+        (roles_to_skip_gbra and int(role_id) in roles_to_skip_gbra)
+        or ra_count - reduced_ra_count < ra_limit
+        or role_id not in eligible_role_ids
+    ):
+      continue
+    selected.append(role_scope)
+    reduced_ra_count += count - 1
+  return Plan(selected, reduced_ra_count)
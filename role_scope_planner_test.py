@@ -0,0 +1,66 @@
+import collections
+import unittest
+import role_scope_planner
+
+RoleScope = collections.namedtuple(
+    'RoleScope', ['roleId', 'scopeType', 'orgUnit']
+)
+
+
+def _role_scope(role_id):
+  return RoleScope(roleId=role_id, scopeType='CUSTOMER', orgUnit='')
+
+
+class TestRoleScopePlanner(unittest.TestCase):
+
+  def plan(self, counts, ra_limit, eligible=None, force=(), skip=()):
+    role_scope_counts = {
+        _role_scope(role_id): count for role_id, count in counts.items()
+    }
+    return role_scope_planner.plan_role_scopes(
+        role_scope_counts,
+        sum(counts.values()),
+        ra_limit,
+        set(counts) if eligible is None else eligible,
+        force,
+        skip,
+    )
+
+  def selected_role_ids(self, plan):
+    return [role_scope.roleId for role_scope in plan.selected]
+
+  def test_largest_selected_until_under_limit(self):
+    plan = self.plan({'1': 2, '2': 5, '3': 3, '4': 1}, ra_limit=8)
+    # 11 role-assignments, then 7 once role 2 is converted
+    self.assertEqual(self.selected_role_ids(plan), ['2'])
+    self.assertEqual(plan.reduced_ra_count, 4)
+
+  def test_reduction_counter_runs_across_selections(self):
+    plan = self.plan({'1': 2, '2': 5, '3': 3, '4': 1}, ra_limit=5)
+    # 11 -> 7 -> 5 -> 4
+    self.assertEqual(self.selected_role_ids(plan), ['2', '3', '1'])
+    self.assertEqual(plan.reduced_ra_count, 7)
+
+  def test_under_limit_selects_nothing(self):
+    plan = self.plan({'1': 2, '2': 5}, ra_limit=8)
+    self.assertEqual(plan.selected, [])
+    self.assertEqual(plan.reduced_ra_count, 0)
+
+  def test_equal_counts_keep_mapping_order(self):
+    plan = self.plan({'3': 2, '1': 2, '2': 2}, ra_limit=1)
+    self.assertEqual(self.selected_role_ids(plan), ['3', '1', '2'])
+
+  def test_forced_roles_selected_under_limit_and_when_ineligible(self):
+    plan = self.plan({'1': 2, '2': 5}, ra_limit=8, eligible=set(), force=[1])
+    self.assertEqual(self.selected_role_ids(plan), ['1'])
+    self.assertEqual(plan.reduced_ra_count, 1)
+
+  def test_skipped_and_ineligible_roles_not_selected(self):
+    plan = self.plan(
+        {'1': 2, '2': 5, '3': 3}, ra_limit=1, eligible={'1', '2'}, skip=[2]
+    )
+    self.assertEqual(self.selected_role_ids(plan), ['1'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -97,6 +97,52 @@ _DELETE_DUP_RAS_TO_SA = flags.DEFINE_boolean(
         ' roles/privileges.)'
     ),
 )
+_PRELOAD_USERS = flags.DEFINE_boolean(
+    'preload_users',
+    default=False,
+    help=(
+        'Page through all users of the customer once at startup and serve'
+        ' user lookups from memory, instead of looking up each role-assignee.'
+        ' Recommended for customers where most users have role-assignments.'
+    ),
+)
+_CACHE_MAX_AGE_HOURS = flags.DEFINE_float(
+    'cache_max_age_hours',
+    default=None,
+    help=(
+        'Persist users, groups, roles, OUs and role-assignments read through'
+        ' the API in a cache database under --output_path, and reuse entries'
+        ' younger than the given number of hours in later runs. Unset'
+        ' disables the cache.'
+    ),
+)
+_MODIFY_WORKERS = flags.DEFINE_integer(
+    'modify_workers',
+    default=4,
+    help=(
+        'Number of role-scopes migrated concurrently in the MODIFY phase. Calls'
+        ' to the groups, members and roleAssignments APIs are additionally'
+        ' capped per API.'
+    ),
+)
+_RA_LISTING_WORKERS = flags.DEFINE_integer(
+    'ra_listing_workers',
+    default=4,
+    help=(
+        'Number of roles whose role-assignments are listed concurrently when'
+        ' loading all role-assignments. Set to 1 to page through all'
+        ' role-assignments of the customer in a single listing.'
+    ),
+)
+_TOKEN_REFRESH_MARGIN_SECONDS = flags.DEFINE_float(
+    'token_refresh_margin_seconds',
+    default=300,
+    help=(
+        'Refresh the oauth token in the background this many seconds before'
+        ' it expires, instead of after a call fails with an expired token.'
+        ' Set to a negative value to disable the background refresh.'
+    ),
+)
 
 # Hidden only, role-assignment per-scope limit - modifiable for testing
 _RA_PER_SCOPE_LIMIT = flags.DEFINE_integer(
@@ -121,6 +167,13 @@ def main(unused_argv):
       _DRY_RUN.value,
       _IS_TEST.value,
       _DEBUG.value,
+      _PRELOAD_USERS.value,
+      _CACHE_MAX_AGE_HOURS.value,
+      _MODIFY_WORKERS.value,
+      _RA_LISTING_WORKERS.value,
+      _TOKEN_REFRESH_MARGIN_SECONDS.value
+      if _TOKEN_REFRESH_MARGIN_SECONDS.value >= 0
+      else None,
   )
 
   if _DRY_RUN.value:
@@ -0,0 +1,62 @@
+from concurrent import futures
+import threading
+import time
+import unittest
+from utils import single_flight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+  def setUp(self):
+    self.single_flight = single_flight.SingleFlight()
+
+  def run_concurrently(self, key, func, callers=3):
+    """Calls do() from the callers, func returns once all of them joined."""
+    release = threading.Event()
+
+    def call(_):
+      return self.single_flight.do(key, lambda: release.wait(5) and func())
+
+    with futures.ThreadPoolExecutor(max_workers=callers) as executor:
+      pending = [executor.submit(call, i) for i in range(callers)]
+      while self.single_flight.coalesced < callers - 1:
+        time.sleep(0.01)
+      release.set()
+      return pending
+
+  def test_concurrent_calls_share_result(self):
+    calls = []
+    pending = self.run_concurrently('key', lambda: calls.append(1) or 'value')
+    self.assertEqual([p.result() for p in pending], ['value'] * 3)
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(
+        self.single_flight.stats(), {'calls': 1, 'coalesced': 2}
+    )
+
+  def test_concurrent_calls_share_exception(self):
+    def fail():
+      raise RuntimeError('Max retries exceeded')
+
+    for pending in self.run_concurrently('key', fail):
+      with self.assertRaises(RuntimeError):
+        pending.result()
+
+  def test_sequential_calls_not_coalesced(self):
+    self.assertEqual(self.single_flight.do('key', lambda: 1), 1)
+    self.assertEqual(self.single_flight.do('key', lambda: 2), 2)
+    self.assertEqual(self.single_flight.coalesced, 0)
+
+  def test_forget_starts_new_call(self):
+    in_flight = []
+
+    def first_call():
+      self.single_flight.forget('key')
+      in_flight.append(self.single_flight.do('key', lambda: 'after change'))
+      return 'before change'
+
+    self.assertEqual(self.single_flight.do('key', first_call), 'before change')
+    self.assertEqual(in_flight, ['after change'])
+
+
+if __name__ == '__main__':
+  unittest.main()
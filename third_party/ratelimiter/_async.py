@@ -15,7 +15,6 @@
 # limitations under the License.
 """ Async support for 3.5+ """
 
-import time
 import asyncio
 
 from ._sync import RateLimiter
@@ -33,17 +32,11 @@ class AsyncRateLimiter(RateLimiter):
             self._init_async_lock()
 
         async with self._alock:
-            # We want to ensure that no more than max_calls were run in the allowed
-            # period. For this, we store the last timestamps of each call and run
-            # the rate verification upon each __enter__ call.
-            if len(self.calls) >= self.max_calls:
-                until = time.time() + self.period - self._timespan
-                if self.callback:
-                    asyncio.ensure_future(self.callback(until))
-                sleeptime = until - time.time()
-                if sleeptime > 0:
-                    await asyncio.sleep(sleeptime)
-            return self
+            slot, delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._mark_started(slot)
+        return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
          return super(AsyncRateLimiter, self).__exit__(exc_type, exc_value, traceback)
@@ -37,9 +37,10 @@ class RateLimiter(object):
         if max_calls <= 0:
             raise ValueError('Rate limiting number of calls should be > 0')
 
-        # We're using a deque to store the last execution timestamps, not for
-        # its maxlen attribute, but to allow constant time front removal.
-        self.calls = collections.deque()
+        # Monotonic start times ( single item lists, updated once started )
+        # of the last max_calls callers, oldest first. A new caller may start
+        # once the oldest of them is a period away.
+        self.calls = collections.deque(maxlen=max_calls)
 
         self.period = period
         self.max_calls = max_calls
@@ -60,32 +61,42 @@ class RateLimiter(object):
                 return f(*args, **kwargs)
         return wrapped
 
-    def __enter__(self):
-        with self._lock:
-            # We want to ensure that no more than max_calls were run in the allowed
-            # period. For this, we store the last timestamps of each call and run
-            # the rate verification upon each __enter__ call.
-            if len(self.calls) >= self.max_calls:
-                until = time.time() + self.period - self._timespan
-                if self.callback:
-                    t = threading.Thread(target=self.callback, args=(until,))
-                    t.daemon = True
-                    t.start()
-                sleeptime = until - time.time()
-                if sleeptime > 0:
-                    time.sleep(sleeptime)
-            return self
+    def _reserve(self):
+        """Reserves the next start time allowed by the window.
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
+        Only the reservation is done under the lock, callers wait for their
+        slot concurrently. Returns the reserved slot and the number of seconds
+        to wait for it.
+        """
         with self._lock:
-            # Store the last operation timestamp.
-            self.calls.append(time.time())
+            now = time.monotonic()
+            if len(self.calls) < self.max_calls:
+                start = now
+            else:
+                start = max(now, self.calls[0][0] + self.period)
+            slot = [start]
+            self.calls.append(slot)
+        delay = start - now
+        if delay > 0 and self.callback:
+            until = time.time() + delay
+            t = threading.Thread(target=self.callback, args=(until,))
+            t.daemon = True
+            t.start()
+        return slot, delay
 
-            # Pop the timestamp list front (ie: the older calls) until the sum goes
-            # back below the period. This is our 'sliding period' window.
-            while self._timespan >= self.period:
-                self.calls.popleft()
+    @staticmethod
+    def _mark_started(slot):
+        # Account for the actual start of the call, which may be later than
+        # the reserved one.
+        slot[0] = time.monotonic()
 
-    @property
-    def _timespan(self):
-        return self.calls[-1] - self.calls[0]
+    def __enter__(self):
+        slot, delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+        self._mark_started(slot)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Calls are accounted for when they start, see _reserve.
+        pass
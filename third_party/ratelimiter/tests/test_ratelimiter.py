@@ -20,8 +20,10 @@ import random
 import time
 import unittest
 import threading
+from unittest import mock
 
 from ratelimiter import RateLimiter
+from ratelimiter import _sync
 
 
 class Timer(object):
@@ -143,6 +145,51 @@ class TestBasic(unittest.TestCase):
         # and sleeping after the 'self.max_calls' iteration has been occured.
         self.assertGreaterEqual(timer.duration, self.period)
 
+    def test_threading_waits_overlap(self):
+        threads = 8
+        max_calls = 2
+        period = 0.1
+        # Allowance for the wake-up latency of time.sleep
+        tolerance = 0.02
+        lock = threading.Lock()
+        starts = []
+        sleeps = []
+        real_sleep = time.sleep
+
+        def recording_sleep(seconds):
+            start = time.monotonic()
+            real_sleep(seconds)
+            with lock:
+                sleeps.append((start, time.monotonic()))
+
+        obj = RateLimiter(max_calls, period)
+        all_ready = threading.Barrier(threads)
+
+        def f():
+            all_ready.wait()
+            with obj:
+                with lock:
+                    starts.append(time.monotonic())
+
+        with mock.patch.object(_sync.time, 'sleep', recording_sleep):
+            workers = [threading.Thread(target=f) for _ in range(threads)]
+            [t.start() for t in workers]
+            [t.join() for t in workers]
+
+        # No more than max_calls calls start within a period
+        starts.sort()
+        self.assertEqual(len(starts), threads)
+        for i in range(len(starts) - max_calls):
+            self.assertGreaterEqual(
+                starts[i + max_calls] - starts[i], period - tolerance)
+
+        # The waiting callers sleep concurrently rather than one at a time
+        self.assertEqual(len(sleeps), threads - max_calls)
+        most_sleeping = max(
+            sum(1 for start, end in sleeps if start <= t < end)
+            for t, _ in sleeps)
+        self.assertGreater(most_sleeping, 1)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,66 @@
+import datetime
+import sys
+import threading
+import unittest
+from unittest.mock import Mock
+
+sys.modules['utils.logger'] = Mock()
+
+from change_client import token_refresher
+
+
+def _expiry_in(seconds):
+  return token_refresher._utcnow() + datetime.timedelta(seconds=seconds)
+
+
+class TestTokenRefresher(unittest.TestCase):
+
+  def test_seconds_until_refresh(self):
+    refresher = token_refresher.TokenRefresher(
+        lambda: _expiry_in(3600), Mock(), margin_seconds=300
+    )
+    self.assertAlmostEqual(refresher.seconds_until_refresh(), 3300, delta=5)
+
+  def test_unknown_expiry_rechecked(self):
+    refresher = token_refresher.TokenRefresher(lambda: None, Mock())
+    self.assertEqual(
+        refresher.seconds_until_refresh(), token_refresher.RECHECK_SECONDS
+    )
+
+  def test_refreshed_within_margin_and_latency_recorded(self):
+    expiry = [_expiry_in(60)]
+    refreshed = threading.Event()
+
+    def refresh():
+      expiry[0] = _expiry_in(3600)
+      refreshed.set()
+
+    refresher = token_refresher.TokenRefresher(
+        lambda: expiry[0], refresh, margin_seconds=300
+    )
+    refresher.start()
+    self.assertTrue(refreshed.wait(5))
+    refresher.stop()
+    self.assertEqual(refresher.stats()['refreshes'], 1)
+    self.assertEqual(refresher.stats()['failures'], 0)
+    self.assertGreaterEqual(refresher.stats()['max_refresh_seconds'], 0.0)
+
+  def test_failed_refresh_counted(self):
+    failed = threading.Event()
+
+    def refresh():
+      failed.set()
+      raise RuntimeError('Refresh failed')
+
+    refresher = token_refresher.TokenRefresher(
+        lambda: _expiry_in(0), refresh, margin_seconds=300
+    )
+    refresher.start()
+    self.assertTrue(failed.wait(5))
+    refresher.stop()
+    self.assertEqual(refresher.stats()['refreshes'], 0)
+    self.assertEqual(refresher.stats()['failures'], 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -16,4 +16,18 @@ python3 google_api_client_test.py
 python3 migration_util_change_client_test.py
 python3 dry_run_change_client_test.py
 python3 gbra_migration_util_test.py
+python3 role_assignment_snapshot_test.py
+python3 directory_cache_test.py
+python3 lookup_cache_test.py
+python3 adaptive_rate_limiter_test.py
+python3 quota_registry_test.py
 python3 google_api_client_test.py
+python3 role_assignment_counter_test.py
+python3 http_transport_test.py
+python3 client_pool_test.py
+python3 token_refresher_test.py
+python3 discovery_documents_test.py
+python3 single_flight_test.py
+python3 retry_policy_test.py
+python3 role_scope_planner_test.py
+python3 credential_store_test.py
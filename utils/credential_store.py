@@ -20,6 +20,7 @@ Exchanges long lived token for Oauth token
 And also gets the token and gives user a link to login for Oauth flow
 """
 
+import json
 import os
 import os.path
 from typing import Optional
@@ -96,5 +97,27 @@ class CredentialStore:
     )
     self._creds = installed_flow.run_local_server(port=0, open_browser=False)
 
+  def refresh(self) -> None:
+    """Refreshes the oauth token.
+
+    The token is refreshed on a copy which then replaces the current one, so
+    that requests in flight keep a consistent token. Should the refresh token
+    be revoked or expired, the user is presented the oauth consent screen.
+    """
+    refreshed_creds = credentials.Credentials.from_authorized_user_info(
+        json.loads(self._creds.to_json()), SCOPES
+    )
+    try:
+      refreshed_creds.refresh(requests.Request())
+    except RefreshError as e:
+      logger.Logger.get_instance().log(
+          'Failed to refresh oauth-token : {}.'.format(e)
+      )
+      self._present_oauth_consent_screen()
+      refreshed_creds = self._creds
+    self._creds = refreshed_creds
+    with open(self._token_path, 'w') as token:
+      token.write(refreshed_creds.to_json())
+
   def get_oauth_token(self) -> Optional[credentials.Credentials]:
     return self._creds
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""DirectoryCache which persists directory entities across runs.
+
+Entities ( users, groups, roles, OUs, role-assignments ) read through the API
+are stored in a SQLite database under the output path along with the time they
+were fetched, so that separate invocations of the utility can reuse them.
+"""
+
+import json
+import os.path
+import sqlite3
+import threading
+import time
+from typing import Any, Mapping, Optional, Sequence, Tuple
+
+CACHE_FILE_NAME = 'directory-cache.sqlite'
+
+
+class DirectoryCache:
+  """SQLite backed cache of directory entities under the output path.
+
+  Entries older than max_age_seconds are stale and treated as misses. Whole
+  listings ( e.g all role-assignments ) are tracked separately from entries,
+  so that single entries written after the listing keep it current.
+  """
+
+  def __init__(self, output_path: str, max_age_seconds: float) -> None:
+    self.cache_path = os.path.join(output_path, CACHE_FILE_NAME)
+    self._max_age_seconds = max_age_seconds
+    # The connection is shared by the worker threads, serialized by the lock.
+    self._connection = sqlite3.connect(
+        self.cache_path, check_same_thread=False
+    )
+    self._lock = threading.Lock()
+    with self._connection:
+      self._connection.execute(
+          'CREATE TABLE IF NOT EXISTS entries (kind TEXT, key TEXT, value'
+          ' TEXT, fetched_at REAL, PRIMARY KEY (kind, key))'
+      )
+      self._connection.execute(
+          'CREATE TABLE IF NOT EXISTS listings (kind TEXT PRIMARY KEY,'
+          ' fetched_at REAL)'
+      )
+
+  def _is_fresh(self, fetched_at: float) -> bool:
+    return time.time() - fetched_at <= self._max_age_seconds
+
+  def get(self, kind: str, key: str) -> Tuple[bool, Optional[Any]]:
+    """Returns whether a fresh entry exists, and its value.
+
+    The value may be None for entities cached as not found.
+    """
+    with self._lock:
+      row = self._connection.execute(
+          'SELECT value, fetched_at FROM entries WHERE kind = ? AND key = ?',
+          (kind, key),
+      ).fetchone()
+    if row is None or not self._is_fresh(row[1]):
+      return False, None
+    return True, json.loads(row[0])
+
+  def put(self, kind: str, key: str, value: Optional[Any]) -> None:
+    with self._lock, self._connection:
+      self._connection.execute(
+          'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+          (kind, key, json.dumps(value), time.time()),
+      )
+
+  def delete(self, kind: str, key: str) -> None:
+    with self._lock, self._connection:
+      self._connection.execute(
+          'DELETE FROM entries WHERE kind = ? AND key = ?', (kind, key)
+      )
+
+  def get_all(self, kind: str) -> Optional[Sequence[Any]]:
+    """Returns all entries of a kind if listed recently enough, else None."""
+    with self._lock:
+      row = self._connection.execute(
+          'SELECT fetched_at FROM listings WHERE kind = ?', (kind,)
+      ).fetchone()
+      if row is None or not self._is_fresh(row[0]):
+        return None
+      return [
+          json.loads(value)
+          for (value,) in self._connection.execute(
+              'SELECT value FROM entries WHERE kind = ? ORDER BY rowid',
+              (kind,),
+          )
+      ]
+
+  def put_all(self, kind: str, values: Mapping[str, Any]) -> None:
+    """Replaces all entries of a kind with a complete listing."""
+    fetched_at = time.time()
+    with self._lock, self._connection:
+      self._connection.execute('DELETE FROM entries WHERE kind = ?', (kind,))
+      self._connection.executemany(
+          'INSERT INTO entries VALUES (?, ?, ?, ?)',
+          [
+              (kind, key, json.dumps(value), fetched_at)
+              for key, value in values.items()
+          ],
+      )
+      self._connection.execute(
+          'INSERT OR REPLACE INTO listings VALUES (?, ?)', (kind, fetched_at)
+      )
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bounded in-memory cache for entity lookups.
+
+Entries expire after a time-to-live and the least recently used entry is
+evicted once the cache is full. Entities which were not found ( None ) are
+cached as well, with their own ( usually shorter ) time-to-live.
+"""
+
+import collections
+import threading
+import time
+from typing import Any, Hashable, Mapping, Optional, Tuple
+
+
+class LookupCache:
+  """Bounded LRU cache with per-entry time-to-live and hit/miss counters."""
+
+  def __init__(
+      self,
+      max_entries: int,
+      ttl_seconds: float,
+      negative_ttl_seconds: Optional[float] = None,
+  ) -> None:
+    self.max_entries = max_entries
+    self.ttl_seconds = ttl_seconds
+    self.negative_ttl_seconds = (
+        ttl_seconds if negative_ttl_seconds is None else negative_ttl_seconds
+    )
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    # Maps keys to ( expiry time, value ), least recently used first.
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def _get_fresh(self, key: Hashable) -> Tuple[bool, Optional[Any]]:
+    entry = self._entries.get(key)
+    if entry is None:
+      return False, None
+    expires_at, value = entry
+    if time.monotonic() >= expires_at:
+      del self._entries[key]
+      return False, None
+    return True, value
+
+  def __contains__(self, key: Hashable) -> bool:
+    with self._lock:
+      return self._get_fresh(key)[0]
+
+  def lookup(self, key: Hashable) -> Tuple[bool, Optional[Any]]:
+    """Returns whether a fresh entry exists, and its value."""
+    with self._lock:
+      hit, value = self._get_fresh(key)
+      if hit:
+        self.hits += 1
+        self._entries.move_to_end(key)
+      else:
+        self.misses += 1
+      return hit, value
+
+  def __getitem__(self, key: Hashable) -> Optional[Any]:
+    hit, value = self.lookup(key)
+    if not hit:
+      raise KeyError(key)
+    return value
+
+  def __setitem__(self, key: Hashable, value: Optional[Any]) -> None:
+    ttl_seconds = (
+        self.negative_ttl_seconds if value is None else self.ttl_seconds
+    )
+    with self._lock:
+      self._entries[key] = (time.monotonic() + ttl_seconds, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def update(self, values: Mapping[Hashable, Optional[Any]]) -> None:
+    for key, value in values.items():
+      self[key] = value
+
+  def invalidate(self, key: Hashable) -> None:
+    with self._lock:
+      self._entries.pop(key, None)
+
+  def stats(self) -> Mapping[str, int]:
+    return {
+        'size': len(self._entries),
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+    }
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Coalescing of identical in-flight calls.
+
+Callers asking for a key while a call for the key is in flight wait for that
+call and share its result ( or exception ) instead of issuing their own.
+"""
+
+from concurrent import futures
+import threading
+from typing import Callable, Hashable, Mapping, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+  """Runs at most one call per key at a time, counting the calls saved."""
+
+  def __init__(self) -> None:
+    self._in_flight = {}
+    self._lock = threading.Lock()
+    self.calls = 0
+    self.coalesced = 0
+
+  def do(self, key: Hashable, func: Callable[[], T]) -> T:
+    """Returns func(), or the result of the call in flight for the key."""
+    with self._lock:
+      in_flight = self._in_flight.get(key)
+      is_first_caller = in_flight is None
+      if is_first_caller:
+        in_flight = self._in_flight[key] = futures.Future()
+        self.calls += 1
+      else:
+        self.coalesced += 1
+    if not is_first_caller:
+      return in_flight.result()
+    try:
+      result = func()
+    except BaseException as e:
+      in_flight.set_exception(e)
+      raise
+    else:
+      in_flight.set_result(result)
+      return result
+    finally:
+      self._forget_call(key, in_flight)
+
+  def _forget_call(self, key: Hashable, in_flight: futures.Future) -> None:
+    with self._lock:
+      if self._in_flight.get(key) is in_flight:
+        del self._in_flight[key]
+
+  def forget(self, key: Hashable) -> None:
+    """Makes later callers issue a new call rather than join the one in flight.
+
+    Called when the entity is changed, the call in flight may have read it
+    before the change.
+    """
+    with self._lock:
+      self._in_flight.pop(key, None)
+
+  def stats(self) -> Mapping[str, int]:
+    return {'calls': self.calls, 'coalesced': self.coalesced}